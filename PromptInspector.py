@@ -1,22 +1,42 @@
 """Prompt Inspector (PI-Chan)"""
+import time
+STARTUP_STARTED = time.perf_counter() # before the heavy imports, for --measure-startup
 import io
+import math
+import mmap
+import os
+import sys
+import warnings
 from collections import OrderedDict
 from pathlib import Path
 import asyncio
-import gzip
+import zlib
 import json
 import pytomlpp as toml
-import gradio_client
+import aiohttp
 import discord
 from discord import (
     Intents, Embed, ButtonStyle, Message, Attachment, File,
     RawReactionActionEvent, ApplicationContext, IntegrationType
 )
 from discord.ext import commands
-from discord.ui import View, button
+from discord.ui import View, Button
 from PIL import Image
 import comfy_parser 
-from translation_utils import init_translator, tprint, t
+from translation_utils import init_translator, tprint, t, error_counts
+from cache_utils import LRUCache, SingleFlight, content_key
+from config_store import ConfigStore
+from guild_settings import GuildSettings, GuildSettingsStore, GUILD_FIELDS
+from parameter_store import ParameterStore
+from metrics import METRICS, STAGES
+from outbound import OutboundScheduler, PRIORITY_INTERACTIVE, PRIORITY_UPDATE, PRIORITY_BACKGROUND
+from loop_monitor import LoopLagMonitor, profile_event_loop
+from backends import LazyBackend
+from chat_context import ContextBuilder
+from chat_coalescer import TriggerCoalescer
+from chat_router import ProviderRouter
+from attachment_spool import ByteBudget, close_http_session, download_spooled, map_spool
+from event_recorder import EventRecorder
 
 # --- Configuration Loading ---
 CONFIG_PATH = Path('config.toml')
@@ -48,10 +68,16 @@ except Exception as e:
     init_translator("normal")
     tprint("unexpected_error_loading_config", error=e)
 
+CONFIG_STORE = ConfigStore(CONFIG_PATH, CONFIG, debounce=CONFIG.get('CONFIG_WRITE_DEBOUNCE', 2.0))
+
 # --- Bot Setup ---
-monitored: list = CONFIG.get('MONITORED_CHANNEL_IDS', [])
-chatmonitored: list = CONFIG.get('CHATBOT_RESPONSIVE', [])
 SCAN_LIMIT_BYTES = CONFIG.get('SCAN_LIMIT_BYTES', 40 * 1024**2)  # Default 40 MB
+STEALTH_MAX_DECOMPRESSED_BYTES = CONFIG.get('STEALTH_MAX_DECOMPRESSED_BYTES', 8 * 1024**2) # Hard cap for stealth_*comp payloads
+IMAGE_PIXEL_BUDGET = CONFIG.get('IMAGE_PIXEL_BUDGET', 4096 * 4096) # Above this, stealth decoding of non-RGB(A) images converts column strips instead of a full-frame copy
+IMAGE_PIXEL_CEILING = CONFIG.get('IMAGE_PIXEL_CEILING', Image.MAX_IMAGE_PIXELS) # Above this, images are rejected before decoding
+comfy_parser.RULE_PACK_DIRS += [Path(d) for d in CONFIG.get('COMFY_RULE_PACK_DIRS', [])] # Extra ComfyUI node rule packs, hot-reloaded
+Image.MAX_IMAGE_PIXELS = IMAGE_PIXEL_CEILING # PIL's decompression-bomb check stays on as a backstop at the same limit
+warnings.simplefilter('ignore', Image.DecompressionBombWarning) # between 1x and 2x the limit, extract_metadata_from_bytes rejects it itself
 GRADIO_BACKEND = CONFIG.get('GRADIO_BACKEND')
 TOKEN = CONFIG.get('TOKEN')
 METADATA_EMOJI = CONFIG.get('METADATA', '🔎')
@@ -59,55 +85,181 @@ TRUSTED_UIDS = CONFIG.get('TRUSTED_UIDS', [0])
 GUESS_EMOJI = CONFIG.get('GUESS', '❔')
 DELETE_DM_EMOJI = CONFIG.get('DELETE_DM', '❌')
 
+# Per-guild overrides (scan limit, emojis, auto-react, chatbot) and per-channel flags live in SQLite
+GUILD_SETTINGS = GuildSettingsStore(
+    CONFIG.get('SETTINGS_DB', 'settings.db'),
+    GuildSettings(scan_limit_bytes=SCAN_LIMIT_BYTES, metadata_emoji=METADATA_EMOJI, guess_emoji=GUESS_EMOJI)
+)
+# Raw A1111 strings behind Full Parameters buttons, in the same database
+FULL_PARAMS = ParameterStore(
+    CONFIG.get('SETTINGS_DB', 'settings.db'),
+    max_rows=CONFIG.get('FULL_PARAMS_MAX_ROWS', 100_000),
+    max_age=CONFIG.get('FULL_PARAMS_MAX_DAYS', 30) * 86400
+)
+if not GUILD_SETTINGS.has_channels():
+    # First run with the settings store: import the old global lists from config.toml
+    GUILD_SETTINGS.import_channels(CONFIG.get('MONITORED_CHANNEL_IDS', []), CONFIG.get('CHATBOT_RESPONSIVE', []))
+# Sets for O(1) membership checks on every message/reaction
+monitored: set
+chatmonitored: set
+monitored, chatmonitored = GUILD_SETTINGS.load_channel_sets()
+CHANNEL_FLAG_CONFIG_KEYS = {'monitored': 'MONITORED_CHANNEL_IDS', 'chatbot': 'CHATBOT_RESPONSIVE'}
+
 # Validate essential config
 if not TOKEN:
     tprint("error_discord_token_not_set")
     exit(1)
+
+# Backends are built in the background once the bot is up, so a cold HF Space or a slow SDK import never delays login
+MEASURE_STARTUP = '--measure-startup' in sys.argv # log how long each startup phase took, then exit
+STARTUP_MARKS = []
+BACKEND_RETRY_MAX = CONFIG.get('BACKEND_RETRY_MAX', 300)
+GRADIO_READY_TIMEOUT = CONFIG.get('GRADIO_READY_TIMEOUT', 30) # how long a guess request waits for a cold backend
+
+def mark_startup(phase: str):
+    STARTUP_MARKS.append((phase, time.perf_counter() - STARTUP_STARTED))
+
+def _connect_gradio():
+    import gradio_client
+    return gradio_client.Client(GRADIO_BACKEND)
+
 if not GRADIO_BACKEND:
     tprint("warning_gradio_backend_not_set")
-    GRADCL = None
+    GRADIO = None
 else:
-    try:
-        GRADCL = gradio_client.Client(GRADIO_BACKEND)
-        tprint("connected_to_gradio_backend", backend=GRADIO_BACKEND)
-    except Exception as e:
-        tprint("error_connecting_to_gradio_backend", backend=GRADIO_BACKEND, error=e)
-        GRADCL = None
-
-if CONFIG.get('USE_GEMINIAPI', False) and CONFIG.get('USE_OPENROUTER', False):
-    tprint("error_both_geminiapi_openrouter")
-    exit(1)
+    GRADIO = LazyBackend("gradio", _connect_gradio, max_retry_delay=BACKEND_RETRY_MAX)
+
+# All bot-initiated sends/edits/reactions go through one rate-limit aware queue
+OUTBOUND = OutboundScheduler(CONFIG.get('OUTBOUND_CONCURRENCY', 4))
+OUTBOUND_REACTION_TTL = CONFIG.get('OUTBOUND_REACTION_TTL', 60)
+METRICS.register_gauge("outbound_queued", lambda: {(('priority', name),): count for name, count in OUTBOUND.stats()['queued'].items()})
+METRICS.register_gauge("outbound", lambda: {(('stat', name),): OUTBOUND.stats()[name] for name in ('in_flight', 'sent', 'failed', 'merged', 'dropped_stale', 'rate_limited')})
+METRICS.register_gauge("logged_errors", lambda: {(('key', key),): count for key, count in error_counts().items()})
+METRICS_HOST = CONFIG.get('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = CONFIG.get('METRICS_PORT', 0) # 0 disables the /metrics endpoint
+_metrics_server = None
+LOOP_MONITOR = LoopLagMonitor(CONFIG.get('LOOP_LAG_INTERVAL', 0.1), CONFIG.get('LOOP_LAG_THRESHOLD', 0.5))
+PROFILE_MAX_SECONDS = CONFIG.get('PROFILE_MAX_SECONDS', 60)
+
+# --- Sharding ---
+# launcher.py sets these for worker processes; SHARDING on its own runs every shard in this process
+SHARD_IDS = [int(shard_id) for shard_id in os.environ['PICHAN_SHARD_IDS'].split(',')] if os.environ.get('PICHAN_SHARD_IDS') else None
+SHARD_COUNT = int(os.environ.get('PICHAN_SHARD_COUNT') or CONFIG.get('SHARD_COUNT', 0)) or None # None = Discord's recommendation
+WORKER_INDEX = int(os.environ.get('PICHAN_WORKER', 0))
+SHARDED = CONFIG.get('SHARDING', False) or SHARD_IDS is not None
+SHARD_HEALTH = {} # shard_id -> {'state', 'since', 'disconnects'}
+if METRICS_PORT and SHARD_IDS is not None:
+    METRICS_PORT += WORKER_INDEX # one /metrics endpoint per worker process
 
 intents = Intents.default() | Intents.message_content | Intents.members
 # members needed
-client = commands.Bot(intents=intents)
 
-chatbotmodule = None
-if CONFIG.get('USE_GEMINIAPI', False):
-    import chat_module_gemini
-    if chat_module_gemini.working:
-        try:            
-            chatbotmodule = chat_module_gemini.ChatModule(
-                CONFIG.get('GEMINIAPI_MODEL', 'gemini-2.0-flash'),
-                api_key=CONFIG.get('GEMINIAPI_TOKEN'),
-                personality=CONFIG.get('PERSONALITY', None),
-                vision=CONFIG.get('CHATBOT_ENABLE_VISION', False)
-            )
-        except ImportError as e:
-            tprint("error_initializing_chatmodule", error=e)
+class _ClosesDownloadSession:
+    """Closes attachment_spool's aiohttp session along with the bot's own connections."""
+    async def close(self):
+        try:
+            await super().close()
+        finally:
+            await close_http_session()
+
+class PIChanBot(_ClosesDownloadSession, commands.Bot):
+    pass
 
+class PIChanShardedBot(_ClosesDownloadSession, commands.AutoShardedBot):
+    pass
+
+if SHARDED:
+    client = PIChanShardedBot(intents=intents, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS)
+else:
+    client = PIChanBot(intents=intents)
+
+def shard_health_report() -> list:
+    """Per-shard state, latency and guild count for the shards this process runs."""
+    if not SHARDED:
+        return []
+    guild_counts = {}
+    for guild in client.guilds:
+        guild_counts[guild.shard_id] = guild_counts.get(guild.shard_id, 0) + 1
+    report = []
+    for shard_id, shard in sorted(client.shards.items()):
+        health = SHARD_HEALTH.get(shard_id, {})
+        report.append({
+            'id': shard_id,
+            'state': 'closed' if shard.is_closed() else health.get('state', 'connecting'),
+            'latency': shard.latency,
+            'guilds': guild_counts.get(shard_id, 0),
+            'disconnects': health.get('disconnects', 0),
+            'since': health.get('since'),
+            'ratelimited': shard.is_ws_ratelimited(),
+        })
+    return report
+
+def set_shard_state(shard_id: int, state: str):
+    health = SHARD_HEALTH.setdefault(shard_id, {'disconnects': 0})
+    if state == 'disconnected':
+        health['disconnects'] += 1
+    health['state'] = state
+    health['since'] = time.time()
+
+METRICS.register_gauge("shard_latency_seconds", lambda: {(('shard', item['id']),): item['latency'] for item in shard_health_report() if math.isfinite(item['latency'])})
+METRICS.register_gauge("shard_guilds", lambda: {(('shard', item['id']),): item['guilds'] for item in shard_health_report()})
+METRICS.register_gauge("shard_up", lambda: {(('shard', item['id']),): int(item['state'] in ('ready', 'resumed')) for item in shard_health_report()})
+
+# One context builder for every provider, so summaries and windows survive a failover
+CHAT_CONTEXT = ContextBuilder(
+    budget=CONFIG.get('CHATBOT_CONTEXT_TOKENS', 2048),
+    min_recent=CONFIG.get('CHATBOT_CONTEXT_MIN_RECENT', 6),
+    fold_batch=CONFIG.get('CHATBOT_SUMMARY_BATCH', 8),
+    summary_words=CONFIG.get('CHATBOT_SUMMARY_WORDS', 150),
+)
+
+def _build_chatbot(provider):
+    """Imports the provider's chat SDK (slow) and builds its ChatModule."""
+    if provider == 'gemini':
+        import chat_module_gemini as chat_module
+        model = CONFIG.get('GEMINIAPI_MODEL', 'gemini-2.0-flash')
+        api_key = CONFIG.get('GEMINIAPI_TOKEN')
+        extra = {
+            'cache_ttl': CONFIG.get('GEMINIAPI_CACHE_TTL', 3600),
+            'cache_min_tokens': CONFIG.get('GEMINIAPI_CACHE_MIN_TOKENS', 1024),
+            'base_url': CONFIG.get('GEMINIAPI_BASE_URL', None),
+        }
+    else:
+        import chat_module_openai as chat_module
+        model = CONFIG.get('OPENROUTER_MODEL', 'openrouter/horizon-alpha')
+        api_key = CONFIG.get('OPENROUTER_TOKEN')
+        extra = {'base_url': CONFIG.get('OPENROUTER_BASE_URL', "https://openrouter.ai/api/v1")}
+    if not chat_module.working:
+        raise ImportError(f"{chat_module.__name__}: client library not installed")
+    return chat_module.ChatModule(
+        model,
+        api_key=api_key,
+        personality=CONFIG.get('PERSONALITY', None),
+        vision=CONFIG.get('CHATBOT_ENABLE_VISION', False),
+        context=CHAT_CONTEXT,
+        **extra
+    )
+
+# Enabled providers in preference order; with both on, the router fails over (and optionally hedges) between them
+CHAT_PROVIDERS = []
+if CONFIG.get('USE_GEMINIAPI', False):
+    CHAT_PROVIDERS.append(("gemini", LazyBackend("gemini", lambda: _build_chatbot('gemini'), max_retry_delay=BACKEND_RETRY_MAX)))
 if CONFIG.get('USE_OPENROUTER', False):
-    import chat_module_openai
-    if chat_module_openai.working:
-        try:            
-            chatbotmodule = chat_module_openai.ChatModule(
-                CONFIG.get('OPENROUTER_MODEL', 'openrouter/horizon-alpha'),
-                api_key=CONFIG.get('OPENROUTER_TOKEN'),
-                personality=CONFIG.get('PERSONALITY', None),
-                vision=CONFIG.get('CHATBOT_ENABLE_VISION', False)
-            )
-        except ImportError as e:
-            tprint("error_initializing_chatmodule", error=e)
+    CHAT_PROVIDERS.append(("openrouter", LazyBackend("openrouter", lambda: _build_chatbot('openrouter'), max_retry_delay=BACKEND_RETRY_MAX)))
+CHATBOT = None
+if CHAT_PROVIDERS:
+    CHATBOT = ProviderRouter(
+        CHAT_PROVIDERS,
+        hedge=CONFIG.get('CHATBOT_HEDGE', False),
+        hedge_min_delay=CONFIG.get('CHATBOT_HEDGE_MIN_DELAY', 1.0),
+        hedge_default_delay=CONFIG.get('CHATBOT_HEDGE_DEFAULT_DELAY', 8.0),
+        failure_threshold=CONFIG.get('CHATBOT_FAILURE_THRESHOLD', 3),
+        cooldown=CONFIG.get('CHATBOT_FAILURE_COOLDOWN', 60),
+    )
+
+BACKENDS = [backend for backend in [GRADIO] + [backend for _, backend in CHAT_PROVIDERS] if backend is not None]
+METRICS.register_gauge("backend_up", lambda: {(('backend', backend.name),): int(backend.state == 'ready') for backend in BACKENDS})
+mark_startup("module_loaded")
 # --- Helper Functions ---
 
 def get_params_from_string(param_str: str) -> OrderedDict:
@@ -192,6 +344,63 @@ def create_param_embed(embed_dict: dict, message_author: discord.User, title: st
     embed.set_footer(text=f'Posted by {message_author}', icon_url=message_author.display_avatar)
     return embed
 
+class PayloadTooLarge(ValueError):
+    pass
+
+def gunzip_bounded(data: bytes, max_output: int) -> bytes:
+    """
+    gzip.decompress that gives up instead of inflating past max_output bytes.
+    Raises PayloadTooLarge past the limit, ValueError for a truncated stream and
+    zlib.error for a corrupt one.
+    """
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) # 16+: expect a gzip header
+    output = decompressor.decompress(data, max_output + 1)
+    if len(output) > max_output or decompressor.unconsumed_tail:
+        raise PayloadTooLarge(f"decompressed payload exceeds {max_output} bytes")
+    if not decompressor.eof:
+        raise ValueError("truncated gzip payload")
+    return output
+
+def reject_stealth_payload(reason: str, detail):
+    METRICS.inc("stealth_rejected", reason=reason)
+    tprint("stealth_payload_rejected", reason=reason, detail=detail)
+
+class ColumnStripImage:
+    """
+    Stands in for a huge image that needs a mode conversion before read_info_from_image_stealth.
+    Stealth data is laid out column by column from the left edge, so only the strips of
+    columns the reader actually reaches are cropped out and converted, instead of making a
+    converted copy of the whole frame. crop() still makes PIL decode the full frame once, so
+    peak memory is bounded by IMAGE_PIXEL_CEILING, not by this class. RGB/RGBA images need
+    no conversion and are read directly.
+    """
+    def __init__(self, image: Image.Image, mode: str, strip_width: int = 16):
+        self.image = image
+        self.mode = mode
+        self.size = image.size
+        self.strip_width = strip_width
+        self.columns_decoded = 0
+        self._start = None
+        self._pixels = None
+
+    def load(self):
+        return self
+
+    def __getitem__(self, xy):
+        x, y = xy
+        if self._start is None or not self._start <= x < self._start + self.strip_width:
+            self._start = x - x % self.strip_width
+            end = min(self._start + self.strip_width, self.size[0])
+            strip = self.image.crop((self._start, 0, end, self.size[1]))
+            if strip.mode != self.mode:
+                strip = strip.convert(self.mode)
+            self._pixels = strip.load()
+            self.columns_decoded = max(self.columns_decoded, end)
+        return self._pixels[x - self._start, y]
+
+class ImageTooLarge(Exception):
+    pass
+
 def read_info_from_image_stealth(image: Image.Image):
     """Try and read stealth PNGInfo"""
     width, height = image.size
@@ -252,10 +461,18 @@ def read_info_from_image_stealth(image: Image.Image):
                             compressed = True
                         buffer_rgb = ""
                         index_rgb = 0
+                    elif not has_alpha:
+                        # No RGB signature and no alpha channel to check later: nothing to find
+                        read_end = True
+                        break
             elif reading_param_len:
                 if mode == "alpha":
                     if index_a == 32:
                         param_len = int(buffer_a, 2)
+                        # One bit per remaining pixel; a longer claim is corrupt or crafted
+                        if not 0 < param_len <= width * height - (x * height + y + 1):
+                            reject_stealth_payload("length", f"{param_len} bits in a {width}x{height} image")
+                            return None
                         reading_param_len = False
                         reading_param = True
                         buffer_a = ""
@@ -265,6 +482,10 @@ def read_info_from_image_stealth(image: Image.Image):
                         pop = buffer_rgb[-1]
                         buffer_rgb = buffer_rgb[:-1]
                         param_len = int(buffer_rgb, 2)
+                        # Three bits per remaining pixel, plus the one carried over
+                        if not 0 < param_len <= (width * height - (x * height + y + 1)) * 3 + 1:
+                            reject_stealth_payload("length", f"{param_len} bits in a {width}x{height} image")
+                            return None
                         reading_param_len = False
                         reading_param = True
                         buffer_rgb = pop
@@ -294,7 +515,18 @@ def read_info_from_image_stealth(image: Image.Image):
         byte_data = bytearray(int(binary_data[i : i + 8], 2) for i in range(0, len(binary_data), 8))
         try:
             if compressed:
-                decoded_data = gzip.decompress(bytes(byte_data)).decode("utf-8")
+                try:
+                    payload = gunzip_bounded(bytes(byte_data), STEALTH_MAX_DECOMPRESSED_BYTES)
+                except PayloadTooLarge as e:
+                    reject_stealth_payload("oversize", e)
+                    return None
+                except ValueError as e:
+                    reject_stealth_payload("truncated", e)
+                    return None
+                except zlib.error as e:
+                    reject_stealth_payload("corrupt", e)
+                    return None
+                decoded_data = payload.decode("utf-8")
             else:
                 decoded_data = byte_data.decode("utf-8", errors="ignore")
             return decoded_data
@@ -351,22 +583,26 @@ def drawthings_drain(info: dict):
         return None
 
 
-async def read_attachment_metadata(attachment: Attachment):
+def extract_metadata_from_bytes(image_data):
     """
-    Reads metadata from a single image attachment.
-    Returns a tuple: (metadata, error_message).
-    Metadata can be a string (A1111, NAI, Invoke, DrawThings JSON) or list (Comfy parsed).
+    Decodes image bytes (or a read-only mmap of a spooled download) and pulls generation metadata out of them.
+    Returns a tuple: (metadata, info_source).
     """
     metadata = None
     info_source = None # To track where the metadata came from
-    try:
-        if not attachment.filename.lower().endswith((".png", ".webp")): # Support webp too?
-            return None, "Not a PNG or WEBP file."
-        if attachment.size > SCAN_LIMIT_BYTES:
-            return None, f"File size ({attachment.size / 1024**2:.1f} MB) exceeds limit ({SCAN_LIMIT_BYTES / 1024**2:.1f} MB)."
-
-        image_data = await attachment.read()
-        with Image.open(io.BytesIO(image_data)) as img:
+    with METRICS.timed("image_open"):
+        # mmap is already file-like; wrapping it in BytesIO would copy the whole file
+        try:
+            img = Image.open(image_data if isinstance(image_data, mmap.mmap) else io.BytesIO(image_data))
+        except Image.DecompressionBombError as e:
+            METRICS.inc("image_pixel_guard", action="rejected")
+            raise ImageTooLarge("Image is too large to scan.") from e
+    if img.width * img.height > IMAGE_PIXEL_CEILING:
+        img.close()
+        METRICS.inc("image_pixel_guard", action="rejected")
+        raise ImageTooLarge(f"Image is too large to scan ({img.width}x{img.height}).")
+    with img:
+        with METRICS.timed("info_read") as timer:
             # 1. Check standard PNG info chunks
             if img.info:
                 if 'parameters' in img.info: # A1111
@@ -387,15 +623,29 @@ async def read_attachment_metadata(attachment: Attachment):
                 elif 'generate_info' in img.info: # Illust metadata
                     metadata = img.info['generate_info']
                     info_source = "Illust (generate_info)"
+                elif 'workflow' in img.info: # ComfyUI, UI-format graph only (no API prompt)
+                    metadata = comfy_parser.convert_ui_workflow(img.info['workflow'])
+                    info_source = "ComfyUI (workflow)"
                 elif 'class_type' in img.info: # ComfyUI
                     metadata = img.info
                     info_source = "ComfyUI (info)"
+            timer.labels["format"] = info_source or "none"
 
 
-            # 2. If no standard metadata found, try stealth PNGInfo
-            if metadata is None:
+        # 2. If no standard metadata found, try stealth PNGInfo
+        if metadata is None:
+            with METRICS.timed("stealth_decode") as timer:
                 # Ensure image mode is suitable for stealth reading (needs RGB or RGBA)
-                if img.mode not in ("RGB", "RGBA"):
+                if img.mode in ("RGB", "RGBA"):
+                    metadata = read_info_from_image_stealth(img)
+                    if metadata: info_source = "Stealth PNGInfo"
+                elif img.width * img.height > IMAGE_PIXEL_BUDGET:
+                    # Too big for a full converted copy: convert only the columns the reader reaches
+                    METRICS.inc("image_pixel_guard", action="column_decode")
+                    metadata = read_info_from_image_stealth(ColumnStripImage(img, "RGBA"))
+                    if metadata: info_source = "Stealth PNGInfo"
+                    timer.labels["columns"] = "strip"
+                else:
                     try:
                         # print(f"Converting image from {img.mode} to RGBA for stealth check.")
                         img_conv = img.convert("RGBA")
@@ -404,19 +654,159 @@ async def read_attachment_metadata(attachment: Attachment):
                         img_conv.close() # Close converted image
                     except Exception as conv_err:
                         tprint("error_converting_image_for_stealth_read", error=conv_err)
-                else:
-                    metadata = read_info_from_image_stealth(img)
-                    if metadata: info_source = "Stealth PNGInfo"
+                timer.labels["found"] = "yes" if metadata else "no"
+
+    return metadata, info_source
+
+
+# Results keyed by content hash, so reposts of the same file skip the decode entirely
+METADATA_CACHE = LRUCache(CONFIG.get('METADATA_CACHE_SIZE', 512))
+_extractions_in_flight = SingleFlight()
 
-        # print(f"Metadata found via: {info_source}" if metadata else "No metadata found.")
-        return metadata, None # Return metadata and no error
+async def _extract_metadata_cached(image_data):
+    """Returns (metadata, error) for image bytes, reusing results for identical content."""
+    key = content_key(image_data)
+    cached = METADATA_CACHE.get(key)
+    if cached is not None:
+        METRICS.inc("cache_hits", cache="content")
+        return cached
+
+    async def extract():
+        try:
+            metadata, _info_source = extract_metadata_from_bytes(image_data)
+            result = (metadata, None)
+        except Image.UnidentifiedImageError:
+            result = (None, "Could not identify image format. Is it corrupted?")
+        except ImageTooLarge as e:
+            result = (None, str(e))
+        METADATA_CACHE.put(key, result)
+        return result
+
+    return await _extractions_in_flight.run(key, extract)
+
+
+# Attachments above the threshold are streamed to a temp file and decoded through mmap,
+# and the total size being processed at once is capped so bursts of big uploads queue instead of piling up in RAM
+SPOOL_THRESHOLD_BYTES = CONFIG.get('SPOOL_THRESHOLD_BYTES', 8 * 1024**2)
+DOWNLOAD_BUDGET = ByteBudget(CONFIG.get('INFLIGHT_BYTES_BUDGET', 256 * 1024**2))
+METRICS.register_gauge("inflight_bytes", lambda: {(('stat', name),): value for name, value in DOWNLOAD_BUDGET.stats().items()})
+
+# Opt-in capture of gateway events for benchmarks/replay_events.py (records message text and images)
+EVENT_RECORDER = None
+if CONFIG.get('RECORD_EVENTS_PATH'):
+    record_path = Path(CONFIG['RECORD_EVENTS_PATH'])
+    if SHARD_IDS is not None: # one file per launcher worker
+        record_path = record_path.with_name(f"{record_path.stem}.worker{WORKER_INDEX}{record_path.suffix}")
+    EVENT_RECORDER = EventRecorder(
+        record_path,
+        record_attachments=CONFIG.get('RECORD_ATTACHMENTS', True),
+        max_attachment_bytes=CONFIG.get('RECORD_ATTACHMENT_MAX_BYTES', 32 * 1024**2),
+        budget=DOWNLOAD_BUDGET
+    )
+    tprint("recording_events", path=record_path)
+
+# Attachment contents never change for a given ID, so results can also be keyed by it
+ATTACHMENT_RESULTS = LRUCache(CONFIG.get('METADATA_CACHE_SIZE', 512))
+_attachment_reads_in_flight = SingleFlight()
+_message_fetches_in_flight = SingleFlight()
+
+async def read_attachment_metadata(attachment: Attachment, message_id: int = None, scan_limit: int = None):
+    """
+    Reads metadata from a single image attachment.
+    Returns a tuple: (metadata, error_message).
+    Metadata can be a string (A1111, NAI, Invoke, DrawThings JSON) or list (Comfy parsed).
+    Concurrent callers for the same attachment share one download + decode.
+    """
+    key = (message_id, attachment.id)
+    cached = ATTACHMENT_RESULTS.get(key)
+    if cached is not None:
+        METRICS.inc("cache_hits", cache="attachment")
+        return cached
+    return await _attachment_reads_in_flight.run(key, lambda: _read_attachment_metadata(attachment, key, scan_limit if scan_limit is not None else SCAN_LIMIT_BYTES))
+
+class RecentMessage:
+    """
+    What the reaction and button paths need from a message (py-cord keeps the full
+    Message in its own cache). `seen` is when it was cached: attachment URLs are signed
+    and expire, so old entries are treated as a miss and refetched.
+    """
+    __slots__ = ('id', 'channel', 'guild', 'author', 'jump_url', 'attachments', 'seen')
+
+    def __init__(self, message: Message):
+        self.id = message.id
+        self.channel = message.channel
+        self.guild = message.guild
+        self.author = message.author
+        self.jump_url = message.jump_url
+        self.attachments = list(message.attachments)
+        self.seen = time.monotonic()
+
+# Recently seen messages from monitored channels, so reactions don't need a REST fetch
+RECENT_MESSAGES = LRUCache(CONFIG.get('MESSAGE_CACHE_SIZE', 2048))
+RECENT_MESSAGE_MAX_AGE = CONFIG.get('MESSAGE_CACHE_MAX_AGE', 3 * 3600) # well inside the CDN URL lifetime
+
+def remember_message(message: Message) -> RecentMessage:
+    record = RecentMessage(message)
+    RECENT_MESSAGES.put(message.id, record)
+    return record
+
+def recent_message(message_id: int):
+    """The cached RecentMessage, or None if unknown or too old to trust its attachment URLs."""
+    record = RECENT_MESSAGES.get(message_id)
+    if record is not None and time.monotonic() - record.seen > RECENT_MESSAGE_MAX_AGE:
+        RECENT_MESSAGES.pop(message_id)
+        return None
+    return record
+
+# thread id -> parent channel id (None for channels that aren't threads), kept fresh by thread events
+THREAD_PARENTS = LRUCache(CONFIG.get('THREAD_PARENT_CACHE_SIZE', 8192))
+_NOT_CACHED = object()
+
+def get_thread_parent(channel_id: int, channel=None):
+    """Returns the parent channel id if channel_id is a thread, otherwise None."""
+    parent_id = THREAD_PARENTS.get(channel_id, _NOT_CACHED)
+    if parent_id is _NOT_CACHED:
+        if channel is None:
+            channel = client.get_channel(channel_id)
+            if channel is None:
+                return None # Unknown channel, don't cache the miss
+        parent_id = getattr(channel, 'parent_id', None)
+        THREAD_PARENTS.put(channel_id, parent_id)
+    return parent_id
+
+async def fetch_message_coalesced(channel, message_id: int) -> Message:
+    """channel.fetch_message, but concurrent fetches of the same message share one REST call."""
+    return await _message_fetches_in_flight.run(message_id, lambda: channel.fetch_message(message_id))
+
+async def _read_attachment_metadata(attachment: Attachment, key, scan_limit: int):
+    try:
+        if not attachment.filename.lower().endswith((".png", ".webp")): # Support webp too?
+            return None, "Not a PNG or WEBP file."
+        if attachment.size > scan_limit:
+            return None, f"File size ({attachment.size / 1024**2:.1f} MB) exceeds limit ({scan_limit / 1024**2:.1f} MB)."
+
+        async with DOWNLOAD_BUDGET.reserve(attachment.size):
+            if attachment.size > SPOOL_THRESHOLD_BYTES:
+                with METRICS.timed("download", spooled="yes"):
+                    spool = await download_spooled(attachment.url, SPOOL_THRESHOLD_BYTES, max_bytes=scan_limit)
+                with spool:
+                    # The mapping outlives the temp file and is unmapped once the last reference goes away
+                    image_data = map_spool(spool)
+            else:
+                with METRICS.timed("download"):
+                    image_data = await attachment.read()
+            result = await _extract_metadata_cached(image_data)
+        ATTACHMENT_RESULTS.put(key, result)
+        return result
 
     except FileNotFoundError:
         return None, "Attachment could not be downloaded."
     except discord.HTTPException as e:
         return None, f"Network error downloading attachment: {e.status}"
-    except Image.UnidentifiedImageError:
-        return None, "Could not identify image format. Is it corrupted?"
+    except aiohttp.ClientResponseError as e:
+        return None, f"Network error downloading attachment: {e.status}"
+    except aiohttp.ClientError:
+        return None, "Attachment could not be downloaded."
     except Exception as error:
         tprint("error_reading_attachment_metadata", filename=attachment.filename, error_type=type(error).__name__, error=error)
         # import traceback
@@ -424,39 +814,107 @@ async def read_attachment_metadata(attachment: Attachment):
         return None, f"An unexpected error occurred: {type(error).__name__}"
 
 # --- UI Views ---
-class MyView(View):
-    """View with a button to show full A1111 parameters."""
-    def __init__(self, metadata_string: str):
-        super().__init__(timeout=3600, disable_on_timeout=True)
-        self.metadata = metadata_string
-
-    @button(label='Full Parameters', style=ButtonStyle.green)
-    async def details(self, interaction: discord.Interaction, button: discord.ui.Button): # Corrected signature
-        button.disabled = True
-        await interaction.response.edit_message(view=self)
-        if not self.metadata:
-            await interaction.followup.send("Metadata is missing.", ephemeral=True)
-            return
+FULL_PARAMS_PREFIX = "pi:params:"
 
-        if len(self.metadata) > 1980:
-            # Try to format as JSON if possible, otherwise send as text
-            try:
-                # Attempt to parse A1111 string into dict, then format nicely
-                params_dict = get_params_from_string(self.metadata)
-                formatted_json = json.dumps(params_dict, indent=2)
-                file_content = formatted_json
-                filename = "parameters.json"
-            except Exception:
-                # Fallback to raw text if JSON fails
-                file_content = self.metadata
-                filename = "parameters.txt"
-
-            with io.StringIO(file_content) as f:
-                f.seek(0)
-                await interaction.followup.send(file=File(f, filename), ephemeral=True)
-        else:
-            # Send directly if short enough
-            await interaction.followup.send(f"```\n{self.metadata[:1990]}\n```", ephemeral=True)
+def full_parameters_view(channel_id: int, message_id: int, attachment_id: int, disabled: bool = False) -> View:
+    """
+    'Full Parameters' button for an A1111 response. The custom_id only encodes where the
+    image lives; on_full_parameters_click looks the metadata up in FULL_PARAMS when it's
+    pressed, so nothing is held in memory per response and the button keeps working after
+    a restart. store=False keeps py-cord from tracking the view for the message.
+    """
+    view = View(timeout=None, store=False)
+    view.add_item(Button(
+        label='Full Parameters', style=ButtonStyle.green, disabled=disabled,
+        custom_id=f"{FULL_PARAMS_PREFIX}{channel_id}:{message_id}:{attachment_id}"
+    ))
+    return view
+
+async def store_full_parameters(message: Message, attachment: Attachment, metadata: str) -> bool:
+    """Persists metadata for a Full Parameters button; False if the button couldn't be answered later."""
+    try:
+        await FULL_PARAMS.put(attachment.id, metadata)
+        return True
+    except Exception as e:
+        tprint("error_storing_full_parameters", error=e)
+        # Without the stored copy, a click has to refetch the message, which needs access to its channel
+        return client.get_channel(message.channel.id) is not None
+
+async def lookup_attachment_metadata(channel_id: int, message_id: int, attachment_id: int):
+    """
+    (metadata, error) for an attachment by ids: the stored copy, else a cached result,
+    else refetch the message and read it again (storing what was found).
+    """
+    stored = await FULL_PARAMS.get(attachment_id)
+    if stored is not None:
+        METRICS.inc("cache_hits", cache="full_params")
+        return stored, None
+    result = ATTACHMENT_RESULTS.get((message_id, attachment_id))
+    if result is not None:
+        METRICS.inc("cache_hits", cache="attachment")
+    else:
+        channel = client.get_channel(channel_id) or await client.fetch_channel(channel_id)
+        message = recent_message(message_id)
+        if message is None:
+            message = remember_message(await fetch_message_coalesced(channel, message_id))
+        attachment = next((a for a in message.attachments if a.id == attachment_id), None)
+        if attachment is None:
+            return None, "The image is no longer attached to that message."
+        settings = GUILD_SETTINGS.get(message.guild.id if message.guild else None)
+        result = await read_attachment_metadata(attachment, message.id, settings.scan_limit_bytes)
+    metadata, _error = result
+    if isinstance(metadata, str) and metadata:
+        try:
+            await FULL_PARAMS.put(attachment_id, metadata)
+        except Exception as e:
+            tprint("error_storing_full_parameters", error=e)
+    return result
+
+async def send_full_parameters(interaction: discord.Interaction, metadata: str):
+    """Sends the raw A1111 parameters as an ephemeral followup (as a file if too long)."""
+    if len(metadata) > 1980:
+        # Try to format as JSON if possible, otherwise send as text
+        try:
+            # Attempt to parse A1111 string into dict, then format nicely
+            params_dict = get_params_from_string(metadata)
+            file_content = json.dumps(params_dict, indent=2)
+            filename = "parameters.json"
+        except Exception:
+            # Fallback to raw text if JSON fails
+            file_content = metadata
+            filename = "parameters.txt"
+
+        with io.StringIO(file_content) as f:
+            f.seek(0)
+            await interaction.followup.send(file=File(f, filename), ephemeral=True)
+    else:
+        # Send directly if short enough
+        await interaction.followup.send(f"```\n{metadata[:1990]}\n```", ephemeral=True)
+
+@client.listen("on_interaction")
+async def on_full_parameters_click(interaction: discord.Interaction):
+    """Handles 'Full Parameters' buttons from any response, including ones sent before a restart."""
+    if interaction.type != discord.InteractionType.component:
+        return
+    custom_id = (interaction.data or {}).get("custom_id", "")
+    if not custom_id.startswith(FULL_PARAMS_PREFIX):
+        return
+    try:
+        channel_id, message_id, attachment_id = (int(part) for part in custom_id[len(FULL_PARAMS_PREFIX):].split(":"))
+    except ValueError:
+        return
+    await interaction.response.edit_message(view=full_parameters_view(channel_id, message_id, attachment_id, disabled=True))
+    try:
+        metadata, error = await lookup_attachment_metadata(channel_id, message_id, attachment_id)
+    except (discord.NotFound, discord.Forbidden):
+        metadata, error = None, "The original message is no longer available."
+    except Exception as e:
+        tprint("error_fetching_full_parameters", error=e)
+        metadata, error = None, f"An unexpected error occurred: {type(e).__name__}"
+    if not isinstance(metadata, str) or not metadata:
+        await interaction.followup.send(error or "Metadata is missing.", ephemeral=True)
+        return
+    await send_full_parameters(interaction, metadata)
 
 # --- Unified Metadata Processing and Display Function ---
 
@@ -482,19 +940,24 @@ async def process_and_display_metadata(
     files_to_send = []
     view_to_send = None
     embed = None
+    img_type = "Unknown"
 
     try:
         if isinstance(metadata, str): # String metadata (A1111, NAI, Invoke, JSON, etc.)
             if 'Steps:' in metadata and 'Negative prompt:' in metadata: # Likely A1111
                 img_type = "A1111"
-                params = get_params_from_string(metadata)
-                embed = create_param_embed(params, message.author, title=f"{img_type} Parameters")
-                if add_details_button:
-                    view_to_send = MyView(metadata) # Pass raw string to button view
+                with METRICS.timed("format_detect", format=img_type):
+                    params = get_params_from_string(metadata)
+                with METRICS.timed("embed_render", format=img_type):
+                    embed = create_param_embed(params, message.author, title=f"{img_type} Parameters")
+                if add_details_button and await store_full_parameters(message, attachment, metadata):
+                    view_to_send = full_parameters_view(message.channel.id, message.id, attachment.id)
 
             else: # Try parsing as JSON, handle different known structures
                 img_type = "Unknown JSON" # Default
                 params_dict = None
+                detect_started = time.perf_counter()
+                comfy_seconds = 0.0
                 try:
                     params_dict = json.loads(metadata)
                     if not isinstance(params_dict, dict):
@@ -566,10 +1029,14 @@ async def process_and_display_metadata(
                     elif 'class_type' in metadata: # Comfy
                         img_type = "ComfyUI"
                         # Pass into comfy_parser
-                        params_dict = comfy_parser.comfyui_get_data(metadata)
-                    
+                        with METRICS.timed("comfy_parse") as comfy_timer:
+                            params_dict = comfy_parser.comfyui_get_data(metadata)
+                        comfy_seconds = comfy_timer.elapsed
+                    METRICS.observe("format_detect", time.perf_counter() - detect_started - comfy_seconds, format=img_type)
+
                     # Create embed from the dictionary
-                    embed = create_param_embed(params_dict, message.author, title=f"{img_type} Parameters")
+                    with METRICS.timed("embed_render", format=img_type):
+                        embed = create_param_embed(params_dict, message.author, title=f"{img_type} Parameters")
 
                 except (json.JSONDecodeError, ValueError):
                     # Not A1111, Not valid JSON -> Treat as basic text/unknown
@@ -603,7 +1070,9 @@ async def process_and_display_metadata(
                 kwargs['view'] = view_to_send
 
             try:
-                await send_func(**kwargs)
+                with METRICS.timed("discord_send", format=img_type):
+                    await send_func(**kwargs)
+                METRICS.inc("metadata_responses", format=img_type)
             except TypeError as te:
                 # Fallback if the send_func doesn't accept all args
                 tprint("warning_send_func_call_failed", error=te)
@@ -634,10 +1103,14 @@ async def process_and_display_metadata(
             tprint("error_sending_error_message", error=final_e)
 
 
+def scan_limit_for(message: Message) -> int:
+    """Scan limit of the guild the message was posted in (global default outside guilds)."""
+    return GUILD_SETTINGS.get(message.guild.id if message.guild else None).scan_limit_bytes
+
 # --- Gradio Prediction ---
 async def predict_prompt_task(user_id: int, member_color: discord.Color, attachment: Attachment):
     """Task to predict prompt using Gradio and send to user DMs."""
-    if not GRADCL:
+    if GRADIO is None:
         tprint("gradio_client_not_configured")
         # Optionally notify user DM?
         return
@@ -649,41 +1122,48 @@ async def predict_prompt_task(user_id: int, member_color: discord.Color, attachm
 
     try:
         user_dm = await user.create_dm()
+        dm_send = OUTBOUND.wrap(user_dm.send, priority=PRIORITY_INTERACTIVE, bucket=user_dm.id)
         embed = Embed(title="Predicted Prompt (Experimental)", color=member_color)
         embed.set_image(url=attachment.url)
         embed.set_footer(text="Prediction via yoinked-da-nsfw-checker HF Space")
 
         # Show a "predicting" message
-        predict_msg = await user_dm.send(embed=embed, content="✨ Predicting tags...")
-        filething = None
-        try:
-            filething = gradio_client.handle_file(attachment.url)
-        except:
+        predict_msg = await dm_send(embed=embed, content="✨ Predicting tags...")
+        gradcl = await GRADIO.get(timeout=GRADIO_READY_TIMEOUT)
+        if gradcl is None:
+            predicted_tags = "Error: The prediction backend is not available right now, try again later."
+        else:
+            import gradio_client # already loaded by the backend
+            filething = None
             try:
-                filething = gradio_client.file(attachment.url)
+                filething = gradio_client.handle_file(attachment.url)
             except:
-                ...
-        if filething is None:
-            return
-        # Make the Gradio prediction
-        job = GRADCL.submit(
-                filething, # filepath in 'parameter_9' Textbox component
-                "chen-pixai",                  # value in 'Select Classifier' Dropdown component
-                0.4,		                        # value in 'Threshold' Slider component
-                True,		                        # value in 'Use character interrogation?' Checkbox component
-                True,		                        # value in 'Use general interrogation?' Checkbox component
-                api_name="/classify",
-                
-        )
-        # Wait for result - consider adding a timeout
-        try:
-            # result is typically a tuple, we need the second element [1]
-            result_data = await asyncio.wait_for(asyncio.to_thread(job.result), timeout=120) # 2 min timeout
-            predicted_tags = result_data[1] if isinstance(result_data, tuple) and len(result_data) > 1 else "Error: Unexpected result format"
-        except asyncio.TimeoutError:
-            predicted_tags = "Error: Prediction timed out."
-        except Exception as pred_err:
-            predicted_tags = f"Error during prediction: {pred_err}"
+                try:
+                    filething = gradio_client.file(attachment.url)
+                except:
+                    ...
+            if filething is None:
+                return
+            # Make the Gradio prediction
+            job = gradcl.submit(
+                    filething, # filepath in 'parameter_9' Textbox component
+                    "chen-pixai",                  # value in 'Select Classifier' Dropdown component
+                    0.4,		                        # value in 'Threshold' Slider component
+                    True,		                        # value in 'Use character interrogation?' Checkbox component
+                    True,		                        # value in 'Use general interrogation?' Checkbox component
+                    api_name="/classify",
+                    
+            )
+            # Wait for result - consider adding a timeout
+            try:
+                # result is typically a tuple, we need the second element [1]
+                with METRICS.timed("gradio_predict"):
+                    result_data = await asyncio.wait_for(asyncio.to_thread(job.result), timeout=120) # 2 min timeout
+                predicted_tags = result_data[1] if isinstance(result_data, tuple) and len(result_data) > 1 else "Error: Unexpected result format"
+            except asyncio.TimeoutError:
+                predicted_tags = "Error: Prediction timed out."
+            except Exception as pred_err:
+                predicted_tags = f"Error during prediction: {pred_err}"
 
         tags_comma = None
         # Format and add fields
@@ -699,7 +1179,10 @@ async def predict_prompt_task(user_id: int, member_color: discord.Color, attachm
             embed.add_field(name="Tags (Comma Space)", value=f"```\n{tags_comma}\n```", inline=False)
 
         # Edit the original message with results
-        await predict_msg.edit(content=tags_comma, embed=embed)
+        await OUTBOUND.submit(
+            lambda: predict_msg.edit(content=tags_comma, embed=embed),
+            priority=PRIORITY_UPDATE, bucket=user_dm.id, merge_key=('edit', predict_msg.id)
+        )
     except discord.Forbidden:
         tprint("cannot_send_dm_to_user", user_id=user_id)
     except discord.HTTPException as http_e:
@@ -708,7 +1191,7 @@ async def predict_prompt_task(user_id: int, member_color: discord.Color, attachm
     except Exception as e:
         tprint("error_in_predict_prompt_task", user_id=user_id, error_type=type(e).__name__, error=e)
         try:
-            await user_dm.send("Sorry, an error occurred while predicting the prompt.")
+            await dm_send("Sorry, an error occurred while predicting the prompt.")
         except Exception: pass # Ignore if sending error message fails
 
 # --- Discord Events ---
@@ -717,14 +1200,96 @@ async def predict_prompt_task(user_id: int, member_color: discord.Color, attachm
 async def on_ready():
     """Prints bot status when ready."""
     tprint("logged_in_as", user=client.user, user_id=client.user.id)
-    tprint("monitoring_channels", count=len(monitored), channels=monitored)
+    tprint("monitoring_channels", count=len(monitored), channels=sorted(monitored))
     tprint("using_metadata_emoji", emoji=METADATA_EMOJI)
-    if GRADCL:
+    if GRADIO is not None:
         tprint("using_guess_emoji", emoji=GUESS_EMOJI)
     else:
         tprint("prompt_guessing_disabled")
     tprint("scan_limit", limit=f"{SCAN_LIMIT_BYTES / 1024**2:.1f}")
+    if SHARDED:
+        tprint("running_shards", shards=sorted(client.shards), shard_count=client.shard_count, worker=WORKER_INDEX)
+    global _metrics_server
+    if METRICS_PORT and _metrics_server is None: # on_ready fires again after reconnects
+        try:
+            _metrics_server = await METRICS.start_http_server(METRICS_HOST, METRICS_PORT)
+        except Exception as e:
+            tprint("error_starting_metrics_endpoint", host=METRICS_HOST, port=METRICS_PORT, error=e)
+    LOOP_MONITOR.start()
+    for backend in BACKENDS:
+        backend.start()
     tprint("separator")
+    if MEASURE_STARTUP and not any(phase == "gateway_ready" for phase, _ in STARTUP_MARKS):
+        mark_startup("gateway_ready")
+        asyncio.create_task(report_startup_and_exit())
+
+async def report_startup_and_exit():
+    """--measure-startup: wait for the backends to settle, log every phase's timing and shut down."""
+    await asyncio.gather(*(backend.get(timeout=GRADIO_READY_TIMEOUT * 4) for backend in BACKENDS))
+    for backend in BACKENDS:
+        mark_startup(f"{backend.name}_{backend.state}")
+    for phase, seconds in STARTUP_MARKS:
+        tprint("startup_phase", phase=phase, seconds=f"{seconds:.2f}")
+    await client.close()
+
+@client.event
+async def on_shard_connect(shard_id: int):
+    set_shard_state(shard_id, 'connecting')
+
+@client.event
+async def on_shard_ready(shard_id: int):
+    set_shard_state(shard_id, 'ready')
+    tprint("shard_ready", shard_id=shard_id)
+
+@client.event
+async def on_shard_disconnect(shard_id: int):
+    set_shard_state(shard_id, 'disconnected')
+    METRICS.inc("shard_disconnects", shard=shard_id)
+    tprint("shard_disconnected", shard_id=shard_id)
+
+@client.event
+async def on_shard_resumed(shard_id: int):
+    set_shard_state(shard_id, 'resumed')
+    tprint("shard_resumed", shard_id=shard_id)
+
+async def answer_chat_triggers(messages):
+    """Answers a batch of chatbot triggers from one channel with a single completion, replying to the newest."""
+    chatbotmodule = CHATBOT if CHATBOT is not None and CHATBOT.ready() else None
+    if chatbotmodule is None:
+        return
+    message = messages[-1]
+    async with message.channel.typing():
+        # Fetch up to 50 messages or until 10 minutes before this message; earlier triggers of the batch are among them
+        history = [message]  # Start with the current message
+        stop = False
+        async for msg in message.channel.history(limit=50, before=message.created_at, oldest_first=False):
+            if (message.created_at - msg.created_at).total_seconds() > 600 or msg.content.startswith(',') or stop:
+                break
+            if msg.content.strip().lower() == "<ctxbreak>":
+                stop = True
+                break
+            history.append(msg)
+            if len(history) >= 50:
+                break
+        # reverse
+        history.reverse()  
+        try:
+            with METRICS.timed("llm_call"):
+                response = await chatbotmodule.chat_with_messages(history, client.user.id)
+            if response and response is not None:
+                await OUTBOUND.submit(
+                    lambda: message.channel.send(response, reference=message),
+                    priority=PRIORITY_INTERACTIVE, bucket=message.channel.id
+                )
+        except Exception as e:
+            tprint("chatbot_error", error=e)
+
+CHAT_TRIGGERS = TriggerCoalescer(
+    answer_chat_triggers,
+    window=CONFIG.get('CHATBOT_COALESCE_WINDOW', 1.5),
+    max_wait=CONFIG.get('CHATBOT_COALESCE_MAX_WAIT', 5.0)
+)
+METRICS.register_gauge("chat_triggers", lambda: {(('stat', name),): value for name, value in CHAT_TRIGGERS.stats().items()})
 
 @client.event
 async def on_message(message: Message):
@@ -732,27 +1297,30 @@ async def on_message(message: Message):
     # Ignore bots, DMs, and non-monitored channels
     if message.author.bot or not message.guild or message.channel.id not in monitored:
         # check if in thread of monitored channel
-        thread_parent = False
-        try:
-            thread_parent = message.channel.parent_id
-        except Exception as e:
-            thread_parent = False
-        if thread_parent and thread_parent in monitored:
-            ...
-        else:
+        if get_thread_parent(message.channel.id, message.channel) not in monitored:
             return
+    if EVENT_RECORDER is not None: # only what the handler actually works on
+        EVENT_RECORDER.record_message(message)
+
 
+    settings = GUILD_SETTINGS.get(message.guild.id if message.guild else None)
 
-    if message.attachments:
+    if message.attachments and settings.auto_react:
+        remember_message(message)
         # Check only the first valid attachment for performance
         for attachment in message.attachments:
-            metadata, error = await read_attachment_metadata(attachment)
+            metadata, error = await read_attachment_metadata(attachment, message.id, settings.scan_limit_bytes)
             if error:
                 # print(f"Skipping attachment {attachment.filename}: {error}")
                 continue # Try next attachment if first one fails or is invalid
             if metadata:
                 try:
-                    await message.add_reaction(METADATA_EMOJI)
+                    # Background priority: dropped if the queue is too backed up to matter anymore
+                    await OUTBOUND.submit(
+                        lambda: message.add_reaction(settings.metadata_emoji),
+                        priority=PRIORITY_BACKGROUND, bucket=message.channel.id,
+                        merge_key=('react', message.id, settings.metadata_emoji), ttl=OUTBOUND_REACTION_TTL
+                    )
                     # Found metadata in one attachment, no need to check others in this message
                     return
                 except discord.HTTPException as e:
@@ -761,7 +1329,8 @@ async def on_message(message: Message):
             # else: # No metadata found in this attachment, try next
                 # print(f"No metadata found in {attachment.filename}")
     
-    if chatbotmodule is not None and message.channel.id in chatmonitored:
+    chatbotmodule = CHATBOT if CHATBOT is not None and CHATBOT.ready() else None # None until a provider is ready
+    if chatbotmodule is not None and settings.chatbot_enabled and message.channel.id in chatmonitored:
         # Check if the message contains any chatbot triggers
         triggers = chatbotmodule.triggers if hasattr(chatbotmodule, "triggers") else []
         replied_to_bot = False
@@ -770,28 +1339,33 @@ async def on_message(message: Message):
             if replied_message.author and replied_message.author.id == client.user.id:
                 replied_to_bot = True
         if (any(trigger in message.content.lower() for trigger in triggers) or replied_to_bot or client.user.mentioned_in(message)) and not message.content.startswith(','):
-            async with message.channel.typing():
-                # Fetch last 15 messages or until 10 minutes before this message
-                history = [message]  # Start with the current message
-                stop = False
-                async for msg in message.channel.history(limit=50, before=message.created_at, oldest_first=False):
-                    if (message.created_at - msg.created_at).total_seconds() > 600 or msg.content.startswith(',') or stop:
-                        break
-                    if msg.content.strip().lower() == "<ctxbreak>":
-                        stop = True
-                        break
-                    history.append(msg)
-                    if len(history) >= 50:
-                        break
-                    # Get chatbot response
-                # reverse
-                history.reverse()  
-                try:
-                    response = await chatbotmodule.chat_with_messages(history, client.user.id)
-                    if response and response is not None:
-                        await message.channel.send(response, reference=message)
-                except Exception as e:
-                    tprint("chatbot_error", error=e)
+            CHAT_TRIGGERS.submit(message) # answered together with other triggers in this channel
+
+@client.event
+async def on_thread_create(thread: discord.Thread):
+    """Records the parent of new threads for the monitoring check."""
+    THREAD_PARENTS.put(thread.id, thread.parent_id)
+
+@client.event
+async def on_raw_thread_delete(payload: discord.RawThreadDeleteEvent):
+    """Forgets deleted threads."""
+    THREAD_PARENTS.pop(payload.thread_id)
+
+@client.event
+async def on_raw_message_edit(payload: discord.RawMessageUpdateEvent):
+    """Drops edited messages from the message cache (attachments may have been removed)."""
+    RECENT_MESSAGES.pop(payload.message_id)
+
+@client.event
+async def on_raw_message_delete(payload: discord.RawMessageDeleteEvent):
+    """Drops deleted messages from the message cache."""
+    RECENT_MESSAGES.pop(payload.message_id)
+
+@client.event
+async def on_raw_bulk_message_delete(payload: discord.RawBulkMessageDeleteEvent):
+    """Drops bulk-deleted messages from the message cache."""
+    for message_id in payload.message_ids:
+        RECENT_MESSAGES.pop(message_id)
 
 @client.event
 async def on_raw_reaction_add(payload: RawReactionActionEvent):
@@ -801,16 +1375,15 @@ async def on_raw_reaction_add(payload: RawReactionActionEvent):
         if str(payload.emoji) == DELETE_DM_EMOJI:
             # get message and delete it
             try:
-                channel = await client.fetch_channel(payload.channel_id)
-                message = await channel.fetch_message(payload.message_id)
-                if message and message.author.id == client.user.id:
-                    await message.delete() # Delete the bot's own message
+                channel = client.get_channel(payload.channel_id) or await client.fetch_channel(payload.channel_id)
+                # Only our own messages are deletable in DMs, so skip the fetch and delete directly
+                await channel.get_partial_message(payload.message_id).delete()
+            except discord.Forbidden:
+                pass # Not one of our messages
             except Exception as e:
                 tprint("error_deleting_message_in_dm", error=e)
     
-    thread_parent = False
     if payload.member.bot or not payload.guild_id or payload.channel_id not in monitored:
-        channel = client.get_channel(payload.channel_id)
         if str(payload.emoji) == DELETE_DM_EMOJI and payload.member.bot and payload.member.id == client.user.id:
             # Handle delete DM emoji reaction
             try:
@@ -819,27 +1392,29 @@ async def on_raw_reaction_add(payload: RawReactionActionEvent):
                 if message and message.author.id == client.user.id:
                     await message.delete() # Delete the bot's own message
             except Exception: pass # Ignore if DM fails
-        try:
-            thread_parent = channel.parent_id
-        except Exception as e:
-            thread_parent = False
-        if thread_parent and thread_parent in monitored and payload.member and not payload.member.bot: #dont react to ourselves, oops.
+        thread_parent = get_thread_parent(payload.channel_id)
+        if thread_parent in monitored and payload.member and not payload.member.bot: #dont react to ourselves, oops.
             ...
         else:
             return
 
+    if EVENT_RECORDER is not None: # only reactions in monitored channels
+        EVENT_RECORDER.record_reaction(payload)
     emoji_name = str(payload.emoji) # Get emoji representation
 
     # Check if the reaction is one we care about
-    is_metadata_request = emoji_name == METADATA_EMOJI
-    is_guess_request = emoji_name == GUESS_EMOJI and GRADCL is not None
+    settings = GUILD_SETTINGS.get(payload.guild_id)
+    is_metadata_request = emoji_name == settings.metadata_emoji
+    is_guess_request = emoji_name == settings.guess_emoji and GRADIO is not None and GRADIO.available
 
     if not is_metadata_request and not is_guess_request:
         return
 
     try:
         channel = client.get_channel(payload.channel_id)
-        message = await channel.fetch_message(payload.message_id)
+        message = recent_message(payload.message_id)
+        if message is None:
+            message = remember_message(await fetch_message_coalesced(channel, payload.message_id))
     except discord.NotFound:
         tprint("message_not_found_for_reaction", message_id=payload.message_id)
         return
@@ -853,7 +1428,7 @@ async def on_raw_reaction_add(payload: RawReactionActionEvent):
     # Ensure the message has attachments
     valid_attachments = [
         a for a in message.attachments
-        if a.filename.lower().endswith((".png", ".webp")) and a.size <= SCAN_LIMIT_BYTES
+        if a.filename.lower().endswith((".png", ".webp")) and a.size <= settings.scan_limit_bytes
     ]
     if not valid_attachments:
         return # No valid attachments to process
@@ -869,7 +1444,8 @@ async def on_raw_reaction_add(payload: RawReactionActionEvent):
         # Notify user maybe?
         try:
             user_dm = await client.get_user(payload.user_id).create_dm()
-            await user_dm.send(f"✨ Attempting to predict prompts for {len(tasks)} image(s) from the message...")
+            dm_send = OUTBOUND.wrap(user_dm.send, priority=PRIORITY_INTERACTIVE, bucket=user_dm.id)
+            await dm_send(f"✨ Attempting to predict prompts for {len(tasks)} image(s) from the message...")
         except Exception: pass # Ignore if DM fails
         # Tasks run in background, no need to await here usually
         return # Guessing handled, exit
@@ -882,6 +1458,7 @@ async def on_raw_reaction_add(payload: RawReactionActionEvent):
 
         try:
             user_dm = await user.create_dm()
+            dm_send = OUTBOUND.wrap(user_dm.send, priority=PRIORITY_INTERACTIVE, bucket=user_dm.id)
         except discord.Forbidden:
             tprint("cannot_send_dm_metadata_request_ignored", user_id=payload.user_id)
             # Optionally notify in channel? Might be noisy.
@@ -894,7 +1471,7 @@ async def on_raw_reaction_add(payload: RawReactionActionEvent):
         processed_count = 0
         # Process each valid attachment for metadata
         for attachment in valid_attachments:
-            metadata, error = await read_attachment_metadata(attachment)
+            metadata, error = await read_attachment_metadata(attachment, message.id, settings.scan_limit_bytes)
             if error:
                 # print(f"Skipping attachment {attachment.filename} for reaction: {error}")
                 continue # Skip attachments with errors
@@ -906,7 +1483,7 @@ async def on_raw_reaction_add(payload: RawReactionActionEvent):
                     message=message,
                     attachment=attachment,
                     metadata=metadata,
-                    send_func=user_dm.send, # Send to user's DMs
+                    send_func=dm_send, # Send to user's DMs
                     attach_original_image=True, # Don't attach image in reaction DM
                     add_details_button=('Steps:' in metadata if isinstance(metadata, str) else False) # Add button only for A1111 strings
                 )
@@ -914,7 +1491,7 @@ async def on_raw_reaction_add(payload: RawReactionActionEvent):
 
         if processed_count == 0:
             try:
-                await user_dm.send("I couldn't find any generation parameters in the attachments of that message.")
+                await dm_send("I couldn't find any generation parameters in the attachments of that message.")
             except Exception: pass # Ignore if DM fails
 
 
@@ -940,6 +1517,25 @@ async def privacy(ctx: ApplicationContext):
     await ctx.respond(embed=base, ephemeral=True)
 
 
+async def toggle_channel_membership(channel_set: set, flag: str, channel_id: int, guild_id: int) -> str:
+    """Adds/removes channel_id from channel_set in place and persists the flag. Returns the action taken."""
+    if channel_id in channel_set:
+        channel_set.discard(channel_id)
+        action = "Removed"
+    else:
+        channel_set.add(channel_id)
+        action = "Added"
+    await GUILD_SETTINGS.set_channel_flag(channel_id, guild_id, flag, action == "Added")
+    # Keep config.toml's lists in sync (debounced) so rolling back to an older version still works
+    mirrored = channel_set
+    if SHARD_IDS is not None:
+        # Other worker processes toggle channels too; only the database has the full lists
+        all_monitored, all_chatbot = await asyncio.to_thread(GUILD_SETTINGS.load_channel_sets)
+        mirrored = all_monitored if flag == 'monitored' else all_chatbot
+    CONFIG_STORE.set(CHANNEL_FLAG_CONFIG_KEYS[flag], sorted(mirrored))
+    return action
+
+
 @client.slash_command(name="toggle_channel", description="Adds/Removes a channel from monitoring.")
 @commands.has_permissions(manage_messages=True)
 @commands.guild_only() # Ensure this command is not used in DMs
@@ -958,31 +1554,9 @@ async def toggle_channel(
 
     channel_id = target_channel.id
 
-    global monitored # Ensure we modify the global list
-    if channel_id in monitored:
-        monitored.remove(channel_id)
-        action = "Removed"
-    else:
-        monitored.append(channel_id)
-        action = "Added"
-
-    # Update the config file persistently
-    try:
-        # Read existing config first to avoid overwriting other settings
-        current_config = {}
-        if CONFIG_PATH.exists():
-            current_config = toml.load(CONFIG_PATH)
-
-        current_config['MONITORED_CHANNEL_IDS'] = monitored # Update the list
-
-        with open(CONFIG_PATH, 'w', encoding='utf-8') as f:
-            toml.dump(current_config, f)
-            await ctx.respond(f"{action} channel {target_channel.mention} (`{channel_id}`) {('to' if action == 'Added' else 'from')} the monitoring list.", ephemeral=True)
-        tprint("channel_action_by_user", action=action, channel_id=channel_id, user=ctx.author, user_id=ctx.author.id, current_list=monitored)
-
-    except Exception as e:
-        tprint("error_updating_config_file_for_toggle_channel", error=e)
-        await ctx.respond(f"Failed to update config file. {action} channel {target_channel.mention} in memory, but change may be lost on restart.", ephemeral=True)
+    action = await toggle_channel_membership(monitored, 'monitored', channel_id, ctx.guild_id)
+    await ctx.respond(f"{action} channel {target_channel.mention} (`{channel_id}`) {('to' if action == 'Added' else 'from')} the monitoring list.", ephemeral=True)
+    tprint("channel_action_by_user", action=action, channel_id=channel_id, user=ctx.author, user_id=ctx.author.id, current_list=sorted(monitored))
 
 
 @client.slash_command(name="toggle_channel_id", description="Adds/Removes a channel from monitoring. [with id]")
@@ -1002,31 +1576,9 @@ async def toggle_channel_id(
     except:
         await ctx.respond("not a id", ephemeral=True)
         return
-    global monitored # Ensure we modify the global list
-    if channel_id in monitored:
-        monitored.remove(channel_id)
-        action = "Removed"
-    else:
-        monitored.append(channel_id)
-        action = "Added"
-
-    # Update the config file persistently
-    try:
-        # Read existing config first to avoid overwriting other settings
-        current_config = {}
-        if CONFIG_PATH.exists():
-            current_config = toml.load(CONFIG_PATH)
-
-        current_config['MONITORED_CHANNEL_IDS'] = monitored # Update the list
-
-        with open(CONFIG_PATH, 'w', encoding='utf-8') as f:
-            toml.dump(current_config, f)
-            await ctx.respond(f"{action} channel <${channel_id}> (`{channel_id}`) {('to' if action == 'Added' else 'from')} the monitoring list.", ephemeral=True)
-        tprint("channel_action_by_user", action=action, channel_id=channel_id, user=ctx.author, user_id=ctx.author.id, current_list=monitored)
-
-    except Exception as e:
-        tprint("error_updating_config_file_for_toggle_channel", error=e)
-        await ctx.respond(f"Failed to update config file. {action} channel <#{channel_id}> in memory, but change may be lost on restart.", ephemeral=True)
+    action = await toggle_channel_membership(monitored, 'monitored', channel_id, ctx.guild_id)
+    await ctx.respond(f"{action} channel <#{channel_id}> (`{channel_id}`) {('to' if action == 'Added' else 'from')} the monitoring list.", ephemeral=True)
+    tprint("channel_action_by_user", action=action, channel_id=channel_id, user=ctx.author, user_id=ctx.author.id, current_list=sorted(monitored))
 
 @client.slash_command(
     name="toggle_gemini_channel",
@@ -1051,34 +1603,12 @@ async def toggle_chatbot_channel(
         return
     
     channel_id = target.id
-    global chatmonitored
-
-    if channel_id in chatmonitored:
-        chatmonitored.remove(channel_id)
-        action = "Removed"
-        preposition = "from"
-    else:
-        chatmonitored.append(channel_id)
-        action = "Added"
-        preposition = "to"
-
-    # Persist change
-    try:
-        current = toml.load(CONFIG_PATH) if CONFIG_PATH.exists() else {}
-        current['CHATBOT_RESPONSIVE'] = chatmonitored
-        with open(CONFIG_PATH, 'w', encoding='utf-8') as f:
-            toml.dump(current, f)
-
-        await ctx.respond(
-            f"{action} channel {target.mention} (`{channel_id}`) {preposition} the list.",
-            ephemeral=True
-        )    
-    except Exception as e:
-        tprint("error_updating_chatbot_responsive_in_config", error=e)
-        await ctx.respond(
-            f"{action} in memory, but failed to write to config.toml. Change may be lost on restart.",
-            ephemeral=True
-        )
+    action = await toggle_channel_membership(chatmonitored, 'chatbot', channel_id, ctx.guild_id)
+    preposition = "to" if action == "Added" else "from"
+    await ctx.respond(
+        f"{action} channel {target.mention} (`{channel_id}`) {preposition} the list.",
+        ephemeral=True
+    )
 
 
 @toggle_chatbot_channel.error
@@ -1103,6 +1633,86 @@ async def toggle_channel_error(ctx: ApplicationContext, error):
         await ctx.respond("An unexpected error occurred.", ephemeral=True)
 
 
+@client.slash_command(name="guild_settings", description="Shows or changes PI-Chan's settings for this server.")
+@commands.has_permissions(manage_guild=True)
+@commands.guild_only()
+async def guild_settings(
+    ctx: ApplicationContext,
+    scan_limit_mb: float = None,
+    metadata_emoji: str = None,
+    guess_emoji: str = None,
+    auto_react: bool = None,
+    chatbot: bool = None,
+    reset: bool = False
+):
+    """
+    Per-server overrides for the scan limit, emojis, auto-reacting and the chatbot.
+    Run without options to view the current settings. Requires 'Manage Server' permission.
+    """
+    if reset:
+        settings = await GUILD_SETTINGS.update(ctx.guild_id, **{key: None for key in GUILD_FIELDS})
+    else:
+        changes = {}
+        if scan_limit_mb is not None:
+            # Guilds can lower the limit, but never above what the host allows
+            changes['scan_limit_bytes'] = int(min(max(scan_limit_mb, 0), SCAN_LIMIT_BYTES / 1024**2) * 1024**2)
+        if metadata_emoji is not None:
+            changes['metadata_emoji'] = metadata_emoji.strip()
+        if guess_emoji is not None:
+            changes['guess_emoji'] = guess_emoji.strip()
+        if auto_react is not None:
+            changes['auto_react'] = int(auto_react)
+        if chatbot is not None:
+            changes['chatbot_enabled'] = int(chatbot)
+        if changes:
+            settings = await GUILD_SETTINGS.update(ctx.guild_id, **changes)
+            tprint("guild_settings_changed_by_user", guild_id=ctx.guild_id, user=ctx.author, user_id=ctx.author.id, changes=changes)
+        else:
+            settings = GUILD_SETTINGS.get(ctx.guild_id)
+
+    embed = Embed(title="Server Settings", color=ctx.author.color if hasattr(ctx.author, 'color') else discord.Color.blue())
+    embed.add_field(name="Scan Limit", value=f"{settings.scan_limit_bytes / 1024**2:.1f} MB")
+    embed.add_field(name="Metadata Emoji", value=settings.metadata_emoji)
+    embed.add_field(name="Guess Emoji", value=settings.guess_emoji)
+    embed.add_field(name="Auto React", value="on" if settings.auto_react else "off")
+    embed.add_field(name="Chatbot", value="on" if settings.chatbot_enabled else "off")
+    await ctx.respond(embed=embed, ephemeral=True)
+
+@guild_settings.error
+async def guild_settings_error(ctx: ApplicationContext, error):
+    """Error handler for guild_settings command."""
+    if isinstance(error, commands.MissingPermissions):
+        await ctx.respond("You need the 'Manage Server' permission to use this command.", ephemeral=True)
+    elif isinstance(error, commands.NoPrivateMessage):
+        await ctx.respond("This command can only be used in a server.", ephemeral=True)
+    else:
+        tprint("error_in_guild_settings_command", error=error)
+        await ctx.respond("An unexpected error occurred.", ephemeral=True)
+
+
+@client.slash_command(name="profile", description="Samples the bot's event loop and returns a flamegraph-ready stack file.")
+async def profile(ctx: ApplicationContext, seconds: int = 10):
+    """
+    Runs the sampling profiler on the event loop thread for a few seconds and sends the
+    collapsed stacks (for flamegraph.pl / speedscope). Trusted users only.
+    """
+    if ctx.author.id not in TRUSTED_UIDS:
+        await ctx.respond("You do not have permission to use this command.", ephemeral=True)
+        return
+    seconds = min(max(seconds, 1), PROFILE_MAX_SECONDS)
+    await ctx.defer(ephemeral=True)
+    tprint("profiling_started", seconds=seconds, user=ctx.author, user_id=ctx.author.id)
+    collapsed = await profile_event_loop(seconds)
+    summary = f"Profiled the event loop for {seconds}s. Max loop lag so far: {LOOP_MONITOR.max_lag * 1000:.0f} ms, stalls: {LOOP_MONITOR.stalls}."
+    await ctx.respond(summary, file=File(io.BytesIO(collapsed.encode("utf-8")), filename=f"pichan-profile-{int(time.time())}.folded"), ephemeral=True)
+
+@profile.error
+async def profile_error(ctx: ApplicationContext, error):
+    """Error handler for profile command."""
+    tprint("error_in_profile_command", error=error)
+    await ctx.respond("An unexpected error occurred.", ephemeral=True)
+
+
 @client.message_command(name="View Raw Prompt")
 async def raw_prompt(ctx: ApplicationContext, message: Message):
     """(Message Command) Get raw metadata for the first valid image."""
@@ -1116,7 +1726,7 @@ async def raw_prompt(ctx: ApplicationContext, message: Message):
     first_attachment = None
 
     for attachment in message.attachments:
-        metadata, error = await read_attachment_metadata(attachment)
+        metadata, error = await read_attachment_metadata(attachment, message.id, scan_limit_for(message))
         if error:
             # print(f"Skipping {attachment.filename} for raw view: {error}")
             continue
@@ -1184,7 +1794,7 @@ async def formatted_params(ctx: ApplicationContext, message: Message):
 
     # Find the first attachment with metadata
     for attachment in message.attachments:
-        metadata, error = await read_attachment_metadata(attachment)
+        metadata, error = await read_attachment_metadata(attachment, message.id, scan_limit_for(message))
         if error:
             error_message = f"Checked attachment {attachment.filename}: {error}" # Keep last error
             continue
@@ -1222,6 +1832,7 @@ async def formatted_params_dm(ctx: ApplicationContext, message: Message):
     # Create a DM channel to the requesting user
     try:
         user_dm = await ctx.author.create_dm()
+        dm_send = OUTBOUND.wrap(user_dm.send, priority=PRIORITY_INTERACTIVE, bucket=user_dm.id)
     except discord.Forbidden:
         await ctx.respond("I can't DM you. Please check your privacy settings to allow DMs from apps/bots.", ephemeral=True)
         return
@@ -1231,7 +1842,7 @@ async def formatted_params_dm(ctx: ApplicationContext, message: Message):
         return
 
     if not message.attachments:
-        await user_dm.send(f"This message has no attachments. {message.jump_url}")
+        await dm_send(f"This message has no attachments. {message.jump_url}")
         await ctx.edit(content="Sent DM!")
         return
 
@@ -1241,7 +1852,7 @@ async def formatted_params_dm(ctx: ApplicationContext, message: Message):
 
     # Find the first attachment with metadata
     for attachment in message.attachments:
-        metadata, error = await read_attachment_metadata(attachment)
+        metadata, error = await read_attachment_metadata(attachment, message.id, scan_limit_for(message))
         if error:
             error_message = f"Checked attachment {attachment.filename}: {error}" # Keep last error
             continue
@@ -1251,7 +1862,7 @@ async def formatted_params_dm(ctx: ApplicationContext, message: Message):
             break # Found metadata, stop searching
 
     if not metadata_found:
-        await user_dm.send(f"{error_message}\n{message.author.mention} might need to enable metadata embedding in their image generator. {message.jump_url}")
+        await dm_send(f"{error_message}\n{message.author.mention} might need to enable metadata embedding in their image generator. {message.jump_url}")
         await ctx.edit(content="Sent DM!")
         return
 
@@ -1260,7 +1871,7 @@ async def formatted_params_dm(ctx: ApplicationContext, message: Message):
         message=message,
         attachment=first_attachment,
         metadata=metadata_found,
-        send_func=user_dm.send, # Send to user's DMs
+        send_func=dm_send, # Send to user's DMs
         attach_original_image=True, # Attach the image for context in the DM
         add_details_button=('Steps:' in metadata_found if isinstance(metadata_found, str) else False)
     )
@@ -1284,6 +1895,62 @@ try:
             embed.add_field(name="CPU Usage", value=f"{cpu_usage:.1f}%")
             embed.add_field(name="RAM Usage", value=f"{ram_usage:.1f}% ({ram.used / 1024**3:.1f}/{ram.total / 1024**3:.1f} GB)")
             embed.add_field(name="Disk Usage", value=f"{disk_usage:.1f}% ({disk.used / 1024**3:.1f}/{disk.total / 1024**3:.1f} GB)")
+            outbound_stats = OUTBOUND.stats()
+            queued = ", ".join(f"{name}: {count}" for name, count in outbound_stats['queued'].items())
+            embed.add_field(
+                name="Outbound Queue",
+                value=f"{queued}\nin flight: {outbound_stats['in_flight']} | sent: {outbound_stats['sent']} | 429s: {outbound_stats['rate_limited']} | dropped: {outbound_stats['dropped_stale']} | merged: {outbound_stats['merged']}",
+                inline=False
+            )
+            stage_lines = []
+            for stage in STAGES:
+                histogram = METRICS.stage_summary(stage).get(stage)
+                if histogram and histogram.count:
+                    stage_lines.append(f"{stage}: {histogram.count}x, p50 {histogram.quantile(0.5) * 1000:.0f} / p95 {histogram.quantile(0.95) * 1000:.0f} ms")
+            loop_lag = METRICS.stage_summary("loop_lag").get("loop_lag")
+            if loop_lag and loop_lag.count:
+                stage_lines.append(f"loop lag: p50 {loop_lag.quantile(0.5) * 1000:.1f} / p95 {loop_lag.quantile(0.95) * 1000:.1f} / max {LOOP_MONITOR.max_lag * 1000:.0f} ms, {LOOP_MONITOR.stalls} stalls")
+            prompt_tokens = METRICS.counter_total("llm_prompt_tokens")
+            if prompt_tokens:
+                cached_tokens = METRICS.counter_total("llm_prompt_tokens_cached")
+                hits = METRICS.counter_total("llm_prompt_cache", result="hit")
+                requests = METRICS.counter_total("llm_prompt_cache")
+                stage_lines.append(f"prompt cache: {cached_tokens / prompt_tokens:.0%} of prompt tokens, hit on {hits:.0f}/{requests:.0f} requests")
+            if stage_lines:
+                embed.add_field(name="Pipeline Latency", value="\n".join(stage_lines)[:1024], inline=False)
+            by_format = METRICS.stage_summary("format_detect", group_by="format")
+            if by_format:
+                format_lines = [
+                    f"{fmt}: {histogram.count}x, p95 {histogram.quantile(0.95) * 1000:.1f} ms"
+                    for fmt, histogram in sorted(by_format.items(), key=lambda item: -item[1].count)
+                ]
+                embed.add_field(name="By Format", value="\n".join(format_lines)[:1024], inline=False)
+            backend_lines = []
+            for backend in BACKENDS:
+                health = backend.health()
+                detail = f"ready in {health['init_seconds']:.1f}s" if health['state'] == 'ready' else (health['last_error'] or "")[:100]
+                backend_lines.append(f"{backend.name}: {health['state']} ({health['attempts']} attempts) {detail}")
+            if backend_lines:
+                embed.add_field(name="Backends", value="\n".join(backend_lines)[:1024], inline=False)
+            if CHATBOT is not None:
+                provider_lines = []
+                for name, health in CHATBOT.health().items():
+                    latency = f"p50 {health['p50'] * 1000:.0f} / p90 {health['p90'] * 1000:.0f} ms" if health['p50'] is not None else "no calls yet"
+                    benched = ", cooling down" if health['cooling_down'] else ""
+                    provider_lines.append(f"{name}: {latency}, {health['error_rate']:.0%} errors over {health['calls']} calls{benched}")
+                hedge = "on" if CHATBOT.hedge else "off"
+                embed.add_field(name=f"Chat Providers (hedging {hedge})", value="\n".join(provider_lines)[:1024], inline=False)
+            shard_lines = []
+            for item in shard_health_report():
+                marker = " (this server)" if ctx.guild and ctx.guild.shard_id == item['id'] else ""
+                latency = f"{item['latency'] * 1000:.0f} ms" if math.isfinite(item['latency']) else "n/a" # NaN before the first heartbeat
+                shard_lines.append(f"#{item['id']}{marker}: {item['state']}, {latency}, {item['guilds']} guilds, {item['disconnects']} disconnects")
+            if shard_lines:
+                embed.add_field(
+                    name=f"Shards (worker {WORKER_INDEX}, {len(shard_lines)}/{client.shard_count})",
+                    value="\n".join(shard_lines)[:1024],
+                    inline=False
+                )
             embed.set_footer(text="Resource usage of the host system.", icon_url=ctx.author.display_avatar if ctx.author else None)
             await ctx.respond(embed=embed, ephemeral=True)
         except Exception as e:
@@ -1306,3 +1973,7 @@ if __name__ == "__main__":
             tprint("fatal_improper_token")
         except Exception as e:
             tprint("fatal_error_during_startup", error=e)
+        finally:
+            CONFIG_STORE.flush_sync() # Don't lose toggles made inside the debounce window
+            if EVENT_RECORDER is not None:
+                EVENT_RECORDER.close()
@@ -0,0 +1,88 @@
+"""Memory-bounded attachment downloads for PI-Chan"""
+import asyncio
+import mmap
+import tempfile
+from contextlib import asynccontextmanager
+
+class ByteBudget:
+    """
+    Caps the total size of attachments being downloaded/decoded at once.
+    Callers over the budget wait until enough bytes are released; a single file
+    larger than the whole budget is let through once nothing else is running.
+    """
+    def __init__(self, limit: int):
+        self.limit = max(int(limit), 1)
+        self.in_use = 0
+        self.waiting = 0
+        self.peak = 0
+        self._condition = asyncio.Condition()
+
+    @asynccontextmanager
+    async def reserve(self, size: int):
+        size = min(max(int(size), 0), self.limit)
+        async with self._condition:
+            self.waiting += 1
+            try:
+                await self._condition.wait_for(lambda: self.in_use + size <= self.limit)
+            finally:
+                self.waiting -= 1
+            self.in_use += size
+            self.peak = max(self.peak, self.in_use)
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self.in_use -= size
+                self._condition.notify_all()
+
+    def stats(self) -> dict:
+        return {"in_use": self.in_use, "waiting": self.waiting, "peak": self.peak, "limit": self.limit}
+
+_session = None
+
+def _http_session():
+    global _session
+    if _session is None or _session.closed:
+        import aiohttp # ships with py-cord
+        _session = aiohttp.ClientSession()
+    return _session
+
+async def close_http_session():
+    """Closes the download session (called when the bot shuts down)."""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+async def download_spooled(url: str, threshold: int, max_bytes: int, chunk_size: int = 256 * 1024):
+    """
+    Streams url into a SpooledTemporaryFile: kept in memory up to `threshold` bytes,
+    moved to disk beyond that. Raises ValueError if the body grows past max_bytes.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=threshold)
+    try:
+        async with _http_session().get(url) as response:
+            response.raise_for_status()
+            written = 0
+            async for chunk in response.content.iter_chunked(chunk_size):
+                written += len(chunk)
+                if written > max_bytes:
+                    raise ValueError(f"download exceeds {max_bytes} bytes")
+                spool.write(chunk)
+        spool.seek(0)
+        return spool
+    except BaseException:
+        spool.close()
+        raise
+
+def map_spool(spool):
+    """
+    Read-only mmap of a spool's contents (rolling it to disk first if needed), so the
+    file is decoded from the page cache instead of a private bytes copy.
+    The mapping stays valid after the spool is closed.
+    """
+    spool.flush()
+    if spool.seek(0, 2) == 0:
+        return b"" # mmap can't map an empty file
+    spool.seek(0)
+    return mmap.mmap(spool.fileno(), 0, access=mmap.ACCESS_READ)
@@ -0,0 +1,88 @@
+"""Lazily initialised network backends (Gradio, chat models) for PI-Chan"""
+import asyncio
+import time
+from translation_utils import tprint
+
+class LazyBackend:
+    """
+    Builds a backend client in a worker thread after the bot is up, instead of at import time.
+
+    `factory` is a blocking callable (it may import heavy SDKs and do network round
+    trips); failures are retried in the background with exponential backoff. An
+    ImportError means the library is missing, so the backend is marked unavailable
+    and never retried. Callers either peek at `.value` or `await get(timeout)`.
+    """
+    def __init__(self, name: str, factory, retry_delay: float = 5.0, max_retry_delay: float = 300.0):
+        self.name = name
+        self.factory = factory
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.value = None
+        self.state = "pending" # pending -> connecting -> ready | retrying | unavailable
+        self.attempts = 0
+        self.last_error = None
+        self.init_seconds = None
+        self.ready_at = None
+        self._ready = None
+        self._task = None
+
+    def start(self):
+        """Starts background initialisation (no-op if already running or done)."""
+        if self._task is not None:
+            return
+        self._ready = asyncio.Event()
+        self._task = asyncio.create_task(self._init_loop())
+
+    async def _init_loop(self):
+        delay = self.retry_delay
+        while True:
+            self.state = "connecting"
+            self.attempts += 1
+            started = time.perf_counter()
+            try:
+                self.value = await asyncio.to_thread(self.factory)
+            except ImportError as e:
+                self.state = "unavailable"
+                self.last_error = e
+                tprint("backend_unavailable", backend=self.name, error=e)
+                self._ready.set() # wake waiters, there is nothing to wait for
+                return
+            except Exception as e:
+                self.state = "retrying"
+                self.last_error = e
+                tprint("backend_init_failed", backend=self.name, error=e, delay=f"{delay:.0f}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_retry_delay)
+                continue
+            self.init_seconds = time.perf_counter() - started
+            self.ready_at = time.time()
+            self.state = "ready"
+            self.last_error = None
+            self._ready.set()
+            tprint("backend_ready", backend=self.name, seconds=f"{self.init_seconds:.2f}", attempts=self.attempts)
+            return
+
+    @property
+    def available(self) -> bool:
+        """False once the backend is known to be unusable (missing library)."""
+        return self.state != "unavailable"
+
+    async def get(self, timeout: float = None):
+        """The backend client, waiting up to `timeout` seconds for it; None if it isn't ready."""
+        if self.value is not None:
+            return self.value
+        self.start()
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.value
+
+    def health(self) -> dict:
+        return {
+            "state": self.state,
+            "attempts": self.attempts,
+            "init_seconds": self.init_seconds,
+            "ready_at": self.ready_at,
+            "last_error": str(self.last_error) if self.last_error else None,
+        }
@@ -0,0 +1,284 @@
+"""
+End-to-end load test for the chatbot path.
+
+Usage:
+    python benchmarks/bench_chatbot.py [--provider openai|gemini|both] [--channels 20] [--duration 30]
+    python benchmarks/bench_chatbot.py --server http://127.0.0.1:8808 ...   (reuse a running mock server)
+
+Starts benchmarks/mock_llm_server.py (unless --server is given), imports the bot with a
+config that points the enabled providers at it, and feeds synthetic conversations from
+fake channels into on_message. Reports trigger -> reply latency percentiles, throughput
+and what the mock server saw, as JSON (same --output / --compare flow as bench_metadata).
+Needs the provider's SDK (openai / google-genai) installed, like the bot itself.
+"""
+import argparse
+import asyncio
+import contextlib
+import itertools
+import json
+import math
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+from datetime import datetime, timezone
+from pathlib import Path
+from types import SimpleNamespace
+
+from bench_metadata import compare, environment, load_bot_module
+
+MOCK_SERVER = Path(__file__).resolve().parent / "mock_llm_server.py"
+BOT_USER_ID = 990000000000000001
+GUILD_ID = 990000000000000002
+FIRST_CHANNEL_ID = 990000000000001000
+
+CHATTER = ("lol", "did anyone see the new model", "that's cursed", "brb", "what sampler is that",
+           "nice image", "ok but why", "same", "I disagree", "can someone explain the workflow")
+QUESTIONS = ("what do you think about {topic}?", "tell me about {topic}", "is {topic} any good?", "help with {topic}")
+TOPICS = ("loras", "comfyui", "upscaling", "the weather", "cats", "prompt weights", "flux", "negative prompts")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_mock_server(args):
+    port = free_port()
+    process = subprocess.Popen([
+        sys.executable, str(MOCK_SERVER), "--port", str(port),
+        "--latency", str(args.latency), "--tokens-per-second", str(args.tokens_per_second),
+        "--reply-tokens", str(args.reply_tokens), "--error-rate", str(args.error_rate), "--seed", str(args.seed),
+    ], stdout=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(f"{url}/stats", timeout=1).read()
+            return process, url
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("mock LLM server did not start")
+
+
+def bench_config(server: str, provider: str, channel_ids, hedge: bool) -> str:
+    return f"""
+TOKEN = "benchmark"
+LANGUAGE = "normal"
+MONITORED_CHANNEL_IDS = {list(channel_ids)}
+CHATBOT_RESPONSIVE = {list(channel_ids)}
+CHATBOT_ENABLE_VISION = false
+CHATBOT_HEDGE = {str(hedge).lower()}
+USE_GEMINIAPI = {str(provider in ('gemini', 'both')).lower()}
+GEMINIAPI_TOKEN = "mock"
+GEMINIAPI_MODEL = "mock-gemini"
+GEMINIAPI_BASE_URL = "{server}"
+USE_OPENROUTER = {str(provider in ('openai', 'both')).lower()}
+OPENROUTER_TOKEN = "mock"
+OPENROUTER_MODEL = "mock-openai"
+OPENROUTER_BASE_URL = "{server}/v1"
+"""
+
+
+class FakeUser:
+    def __init__(self, user_id: int, name: str, bot: bool = False):
+        self.id = user_id
+        self.global_name = name
+        self.display_name = name
+        self.bot = bot
+
+    def mentioned_in(self, message) -> bool:
+        return False
+
+
+class FakeChannel:
+    """Just enough of discord.TextChannel for on_message and answer_chat_triggers."""
+    def __init__(self, channel_id: int, recorder):
+        self.id = channel_id
+        self.messages = []
+        self.recorder = recorder
+
+    async def history(self, limit=100, before=None, oldest_first=False):
+        count = 0
+        for message in reversed(self.messages):
+            if before is not None and message.created_at >= before:
+                continue
+            yield message
+            count += 1
+            if count >= limit:
+                break
+
+    def typing(self):
+        return contextlib.nullcontext()
+
+    async def send(self, content, reference=None):
+        self.recorder.replied(self, reference)
+        return SimpleNamespace(id=None, content=content)
+
+
+class Recorder:
+    """Matches replies to the triggers they answer (a coalesced reply answers every earlier trigger)."""
+    def __init__(self):
+        self.waiting = {} # channel id -> [(message id, sent at)]
+        self.latencies = []
+        self.replies = 0
+        self.triggers = 0
+
+    def triggered(self, message):
+        self.triggers += 1
+        self.waiting.setdefault(message.channel.id, []).append((message.id, time.perf_counter()))
+
+    def replied(self, channel, reference):
+        now = time.perf_counter()
+        self.replies += 1
+        waiting = self.waiting.get(channel.id, [])
+        answered = [sent for message_id, sent in waiting if reference is None or message_id <= reference.id]
+        self.waiting[channel.id] = [item for item in waiting if reference is not None and item[0] > reference.id]
+        self.latencies.extend(now - sent for sent in answered)
+
+    @property
+    def unanswered(self) -> int:
+        return sum(len(items) for items in self.waiting.values())
+
+
+async def drive(bot, args, channel_ids, recorder):
+    """Sends Poisson-distributed chatter into every channel for args.duration seconds."""
+    rng = random.Random(args.seed)
+    snowflakes = itertools.count(int(time.time() * 1000) << 22, 1 << 22)
+    guild = SimpleNamespace(id=GUILD_ID, shard_id=0)
+    channels = [FakeChannel(channel_id, recorder) for channel_id in channel_ids]
+    tasks = set()
+
+    async def channel_loop(channel, index):
+        users = [FakeUser(10_000 + index * 100 + n, f"user{index}_{n}") for n in range(5)]
+        deadline = time.perf_counter() + args.duration
+        while True:
+            await asyncio.sleep(rng.expovariate(args.rate))
+            if time.perf_counter() >= deadline:
+                return
+            trigger = rng.random() < args.trigger_ratio
+            if trigger:
+                content = "pichan " + rng.choice(QUESTIONS).format(topic=rng.choice(TOPICS))
+            else:
+                content = rng.choice(CHATTER)
+            message = SimpleNamespace(
+                id=next(snowflakes), content=content, clean_content=content, author=rng.choice(users),
+                guild=guild, channel=channel, attachments=[], mentions=[], mention_everyone=False,
+                reference=None, created_at=datetime.now(timezone.utc),
+            )
+            channel.messages.append(message)
+            if trigger:
+                recorder.triggered(message)
+            task = asyncio.create_task(bot.on_message(message)) # like discord's event dispatch
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+    await asyncio.gather(*(channel_loop(channel, i) for i, channel in enumerate(channels)))
+    if tasks:
+        await asyncio.gather(*tasks)
+    drain_deadline = time.perf_counter() + args.drain
+    while recorder.unanswered and time.perf_counter() < drain_deadline:
+        await asyncio.sleep(0.1)
+
+
+def percentile(samples, q):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[max(0, min(len(ordered) - 1, math.ceil(q * len(ordered)) - 1))]
+
+
+async def run(bot, args, channel_ids, server):
+    bot.client._connection.user = FakeUser(BOT_USER_ID, "PI-Chan", bot=True)
+    for backend in bot.BACKENDS:
+        backend.start()
+    await asyncio.gather(*(backend.get(timeout=30) for backend in bot.BACKENDS))
+    not_ready = {backend.name: backend.health()['last_error'] for backend in bot.BACKENDS if backend.state != "ready"}
+    if bot.CHATBOT is None or not bot.CHATBOT.ready():
+        raise SystemExit(f"no chat provider came up: {not_ready}")
+
+    recorder = Recorder()
+    started = time.perf_counter()
+    await drive(bot, args, channel_ids, recorder)
+    elapsed = time.perf_counter() - started
+    server_stats = json.loads(urllib.request.urlopen(f"{server}/stats", timeout=5).read())
+    latencies_ms = [seconds * 1000 for seconds in recorder.latencies]
+    return {
+        "triggers": recorder.triggers,
+        "answered": len(recorder.latencies),
+        "unanswered": recorder.unanswered,
+        "replies": recorder.replies,
+        "replies_per_second": recorder.replies / elapsed,
+        "triggers_per_reply": len(recorder.latencies) / recorder.replies if recorder.replies else None,
+        "latency_ms": {
+            "mean": statistics.fmean(latencies_ms) if latencies_ms else None,
+            "p50": percentile(latencies_ms, 0.5),
+            "p90": percentile(latencies_ms, 0.9),
+            "p99": percentile(latencies_ms, 0.99),
+            "max": max(latencies_ms) if latencies_ms else None,
+        },
+        "providers": bot.CHATBOT.health(),
+        "providers_not_ready": not_ready,
+        "prompt_tokens": bot.METRICS.counter_total("llm_prompt_tokens"),
+        "prompt_tokens_cached": bot.METRICS.counter_total("llm_prompt_tokens_cached"),
+        "server": server_stats,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test PI-Chan's chatbot against a local mock LLM.")
+    parser.add_argument("--provider", choices=("openai", "gemini", "both"), default="openai")
+    parser.add_argument("--hedge", action="store_true", help="enable request hedging (needs --provider both)")
+    parser.add_argument("--channels", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of traffic")
+    parser.add_argument("--rate", type=float, default=0.5, help="messages per second per channel")
+    parser.add_argument("--trigger-ratio", type=float, default=0.3, help="share of messages that address the bot")
+    parser.add_argument("--drain", type=float, default=30.0, help="seconds to wait for outstanding replies")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--server", help="URL of an already running mock_llm_server.py")
+    parser.add_argument("--latency", type=float, default=0.3, help="mock: seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=60.0, help="mock: generation speed")
+    parser.add_argument("--reply-tokens", type=int, default=40, help="mock: average reply length")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="mock: share of requests failing with 503")
+    parser.add_argument("--output", help="write JSON results here instead of stdout")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="compare two result files")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    output_path = Path(args.output).resolve() if args.output else None
+    process = None
+    server = args.server
+    if server is None:
+        process, server = start_mock_server(args)
+    try:
+        channel_ids = range(FIRST_CHANNEL_ID, FIRST_CHANNEL_ID + args.channels)
+        bot = load_bot_module(bench_config(server, args.provider, channel_ids, args.hedge))
+        result = asyncio.run(run(bot, args, channel_ids, server))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    latency = result["latency_ms"]
+    if latency["p50"] is not None:
+        print(f"{result['answered']}/{result['triggers']} triggers answered with {result['replies']} replies, "
+              f"p50 {latency['p50']:.0f} / p90 {latency['p90']:.0f} / p99 {latency['p99']:.0f} ms", file=sys.stderr)
+    settings = {key: value for key, value in vars(args).items() if key not in ("output", "compare")}
+    # Flatten to the {case: {"median_ms": ...}} shape bench_metadata's --compare understands
+    results = {f"chatbot/{args.provider}/trigger_to_reply": {"median_ms": latency["p50"] or 0.0, **result}}
+    text = json.dumps({"environment": environment(), "settings": settings, "results": results}, indent=2)
+    if output_path:
+        output_path.write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""
+Benchmarks for the metadata pipeline.
+
+Usage:
+    python benchmarks/bench_metadata.py [--repeat 20] [--budget 5] [--output results.json]
+    python benchmarks/bench_metadata.py --compare before.json after.json
+
+Results are JSON (timings in milliseconds) so runs can be diffed with --compare.
+The bot module is imported from a scratch directory with a throwaway config, so
+no network backends are contacted and the real config.toml is left alone.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+CORPUS_DIR = Path(__file__).resolve().parent / "corpus"
+
+BENCH_CONFIG = """
+TOKEN = "benchmark"
+LANGUAGE = "normal"
+MONITORED_CHANNEL_IDS = []
+CHATBOT_RESPONSIVE = []
+USE_GEMINIAPI = false
+USE_OPENROUTER = false
+"""
+
+
+def load_bot_module(config: str = BENCH_CONFIG):
+    """Imports PromptInspector inside a scratch working directory with a benchmark config."""
+    workdir = Path(tempfile.mkdtemp(prefix="pichan-bench-"))
+    (workdir / "config.toml").write_text(config, encoding="utf-8")
+    os.symlink(REPO_ROOT / "translations", workdir / "translations")
+    os.chdir(workdir)
+    sys.path.insert(0, str(REPO_ROOT))
+    import PromptInspector
+    return PromptInspector
+
+
+class FakeAttachment:
+    """Just enough of discord.Attachment for read_attachment_metadata."""
+    _ids = itertools.count(1)
+
+    def __init__(self, path: Path):
+        self.data = path.read_bytes()
+        self.filename = path.name
+        self.size = len(self.data)
+        self.url = f"https://cdn.example.invalid/{path.name}"
+        self.id = next(self._ids)
+
+    async def read(self):
+        return self.data
+
+
+def fake_message():
+    import discord
+    author = SimpleNamespace(color=discord.Color.blue(), display_avatar="https://cdn.example.invalid/avatar.png", bot=False)
+    return SimpleNamespace(id=1, author=author, jump_url="https://discord.com/channels/1/2/3", attachments=[])
+
+
+async def discard_send(**kwargs):
+    return None
+
+
+def time_case(func, repeat: int, budget: float, warmup: int = 1):
+    """Runs func repeatedly; stops early once the time budget is spent (after at least 3 runs)."""
+    for _ in range(warmup):
+        func()
+    samples = []
+    started = time.perf_counter()
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - t0) * 1000)
+        if i >= 2 and time.perf_counter() - started > budget:
+            break
+    samples.sort()
+    return {
+        "runs": len(samples),
+        "mean_ms": statistics.fmean(samples),
+        "median_ms": statistics.median(samples),
+        "p95_ms": samples[min(len(samples) - 1, int(round(len(samples) * 0.95)) - 1)],
+        "min_ms": samples[0],
+        "max_ms": samples[-1],
+        "stdev_ms": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+    }
+
+
+def run_benchmarks(repeat: int, budget: float, only: str = None):
+    from PIL import Image
+    bot = load_bot_module()
+    import comfy_parser
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    corpus = sorted(CORPUS_DIR.glob("*.png"))
+    results = {}
+
+    def record(name, func, **extra):
+        if only and only not in name:
+            return
+        results[name] = {**time_case(func, repeat, budget), **extra}
+        print(f"{name:<55} {results[name]['median_ms']:>10.3f} ms (median of {results[name]['runs']})", file=sys.stderr)
+
+    # Cold end-to-end extraction: caches are cleared and every run uses a new attachment id
+    extracted = {}
+    for path in corpus:
+        def read_cold(path=path):
+            bot.METADATA_CACHE.clear()
+            bot.ATTACHMENT_RESULTS.clear()
+            metadata, error = loop.run_until_complete(bot.read_attachment_metadata(FakeAttachment(path)))
+            extracted[path.name] = metadata
+        record(f"read_attachment_metadata/{path.stem}", read_cold, bytes=path.stat().st_size)
+
+    # Warm path: same attachment again (what reaction bursts and reposts hit)
+    attachment = FakeAttachment(CORPUS_DIR / "a1111.png")
+    loop.run_until_complete(bot.read_attachment_metadata(attachment))
+    record("read_attachment_metadata_cached/a1111", lambda: loop.run_until_complete(bot.read_attachment_metadata(attachment)))
+
+    for path in corpus:
+        if not path.stem.startswith(("stealth", "plain")):
+            continue
+        with Image.open(path) as img:
+            img.load()
+            frame = img.copy()
+        record(f"read_info_from_image_stealth/{path.stem}", lambda frame=frame: bot.read_info_from_image_stealth(frame))
+
+    a1111 = extracted.get("a1111.png")
+    if isinstance(a1111, str):
+        record("get_params_from_string/a1111", lambda: bot.get_params_from_string(a1111))
+
+    for name in ("comfyui", "comfyui_large"):
+        comfy = extracted.get(f"{name}.png")
+        if isinstance(comfy, str):
+            record(f"comfyui_get_data/{name}", lambda comfy=comfy: comfy_parser.comfyui_get_data(comfy))
+
+    message = fake_message()
+    for name, metadata in extracted.items():
+        if not isinstance(metadata, str):
+            continue
+        record(
+            f"process_and_display_metadata/{Path(name).stem}",
+            lambda metadata=metadata: loop.run_until_complete(bot.process_and_display_metadata(
+                message=message,
+                attachment=FakeAttachment(CORPUS_DIR / name),
+                metadata=metadata,
+                send_func=discard_send,
+                attach_original_image=True,
+            )),
+        )
+
+    loop.close()
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True).stdout.strip()
+    except Exception:
+        commit = None
+    import PIL
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "pillow": PIL.__version__,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def compare(before_path: str, after_path: str):
+    before = json.loads(Path(before_path).read_text())["results"]
+    after = json.loads(Path(after_path).read_text())["results"]
+    print(f"{'case':<55} {'before':>10} {'after':>10} {'change':>8}")
+    for name in sorted(set(before) | set(after)):
+        if name not in before or name not in after:
+            print(f"{name:<55} {'only in ' + ('after' if name in after else 'before'):>30}")
+            continue
+        b, a = before[name]["median_ms"], after[name]["median_ms"]
+        change = (a - b) / b * 100 if b else 0.0
+        print(f"{name:<55} {b:>9.3f}m {a:>9.3f}m {change:>+7.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark PI-Chan's metadata pipeline.")
+    parser.add_argument("--repeat", type=int, default=20, help="max runs per case")
+    parser.add_argument("--budget", type=float, default=5.0, help="seconds per case before stopping early")
+    parser.add_argument("--only", help="only run cases whose name contains this")
+    parser.add_argument("--output", help="write JSON results here instead of stdout")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="compare two result files")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    # Resolve before the benchmark changes the working directory
+    output_path = Path(args.output).resolve() if args.output else None
+    output = {"environment": environment(), "results": run_benchmarks(args.repeat, args.budget, args.only)}
+    text = json.dumps(output, indent=2)
+    if output_path:
+        output_path.write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
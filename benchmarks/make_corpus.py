@@ -0,0 +1,239 @@
+"""Generates the synthetic benchmark corpus (deterministic, re-run to rebuild benchmarks/corpus)"""
+import gzip
+import json
+from pathlib import Path
+from PIL import Image, ImageDraw
+from PIL.PngImagePlugin import PngInfo
+
+CORPUS_DIR = Path(__file__).parent / "corpus"
+
+A1111_PARAMETERS = (
+    "masterpiece, best quality, 1girl, solo, long hair, looking at viewer, smile, outdoors, cherry blossoms, "
+    "<lora:detail_tweaker:0.6>, (sunlight:1.2)\n"
+    "Negative prompt: lowres, bad anatomy, bad hands, text, error, missing fingers, extra digit, cropped, worst quality\n"
+    "Steps: 28, Sampler: DPM++ 2M Karras, CFG scale: 7, Seed: 1234567890, Size: 832x1216, Model hash: 6ce0161689, "
+    "Model: animagine-xl-3.1, Denoising strength: 0.4, Clip skip: 2, Hires upscale: 1.5, Hires steps: 14, "
+    "Hires upscaler: 4x-UltraSharp, Lora hashes: \"detail_tweaker: 3f8a2b\", Version: v1.9.4"
+)
+
+NAI_COMMENT = {
+    "prompt": "1girl, solo, silver hair, red eyes, maid, indoors, window, soft lighting",
+    "steps": 28, "height": 1216, "width": 832, "scale": 5.0, "uncond_scale": 0.0, "cfg_rescale": 0.0,
+    "seed": 2718281828, "n_samples": 1, "noise_schedule": "native", "sampler": "k_euler_ancestral",
+    "strength": 0.7, "noise": 0.0, "sm": False, "sm_dyn": False,
+    "uc": "lowres, bad anatomy, bad hands, text, error, missing fingers",
+}
+
+SWARM_PARAMETERS = {
+    "sui_image_params": {
+        "prompt": "a cozy cabin in a snowy forest at night, warm window light, aurora",
+        "negativeprompt": "blurry, lowres",
+        "model": "sd_xl_base_1.0", "seed": 424242, "steps": 30, "cfgscale": 6.5,
+        "aspectratio": "16:9", "width": 1344, "height": 768, "sampler": "dpmpp_2m", "scheduler": "karras",
+        "swarm_version": "0.9.2.1", "sui_models": [{"name": "sd_xl_base_1.0.safetensors", "param": "model"}],
+    },
+    "sui_extra_data": {"date": "2024-06-01", "generation_time": "3.21 (prep) and 7.80 (gen) seconds"},
+}
+
+MOOSHIE_PARAMETERS = {
+    "sui_image_params": {
+        "prompt": "portrait of a knight in ornate armor, dramatic lighting",
+        "negativeprompt": "deformed", "model": "juggernautXL_v9", "seed": 99, "steps": 25, "cfgscale": 4.5,
+        "width": 1024, "height": 1024, "sampler": "euler", "scheduler": "normal",
+    },
+    "sui_extra_data": {"date": "2025-02-02"},
+    "mooshie_extra": {"software": "MooshieUI", "upscale_model": "4x_NMKD-Siax_200k", "face_fix": True},
+}
+
+INVOKEAI_METADATA = {
+    "generation_mode": "txt2img", "positive_prompt": "isometric city block, tiny people, tilt-shift",
+    "negative_prompt": "text, watermark", "width": 1024, "height": 1024, "seed": 31337, "rand_device": "cpu",
+    "cfg_scale": 7.5, "cfg_rescale_multiplier": 0, "steps": 30, "scheduler": "dpmpp_2m_k",
+    "model": {"key": "abc123", "hash": "blake3:deadbeef", "name": "dreamshaper-xl", "base": "sdxl", "type": "main"},
+    "seamless_x": False, "seamless_y": False, "positive_style_prompt": "", "negative_style_prompt": "",
+    "app_version": "4.2.4", "_invokeai_metadata_tag": True,
+}
+
+DRAWTHINGS_JSON = {
+    "c": "a watercolor fox in a meadow", "uc": "photo, realistic", "model": "sd_v1.5_f16.ckpt",
+    "seed": 1111, "steps": 20, "scale": 7.0, "sampler": "DPM++ 2M Karras",
+    "v2": {"width": 768, "height": 512, "guidanceMode": "standard", "aesthetic_score": 6.0},
+}
+
+ILLUST_GENERATE_INFO = {
+    "type": "txt2img", "prompt": "a girl reading under a tree, anime style", "negativePrompt": "bad quality",
+    "samplerName": "Euler a", "steps": 25, "cfgScale": 6, "seed": 8080, "width": 896, "height": 1152,
+    "checkpoint": "illustrious-xl-v1",
+}
+
+COMFY_PROMPT = {
+    "3": {"inputs": {"seed": 89898989, "steps": 20, "cfg": 7.0, "sampler_name": "dpmpp_2m", "scheduler": "karras",
+                     "denoise": 1.0, "model": ["10", 0], "positive": ["6", 0], "negative": ["7", 0],
+                     "latent_image": ["5", 0]}, "class_type": "KSampler"},
+    "4": {"inputs": {"ckpt_name": "sd_xl_base_1.0.safetensors"}, "class_type": "CheckpointLoaderSimple"},
+    "5": {"inputs": {"width": 1024, "height": 1024, "batch_size": 1}, "class_type": "EmptyLatentImage"},
+    "6": {"inputs": {"text": "beautiful landscape painting, epic composition", "clip": ["10", 1]}, "class_type": "CLIPTextEncode"},
+    "7": {"inputs": {"text": "ugly, deformed", "clip": ["10", 1]}, "class_type": "CLIPTextEncode"},
+    "8": {"inputs": {"samples": ["3", 0], "vae": ["4", 2]}, "class_type": "VAEDecode"},
+    "9": {"inputs": {"filename_prefix": "ComfyUI", "images": ["8", 0]}, "class_type": "SaveImage"},
+    "10": {"inputs": {"lora_name": "add_detail.safetensors", "strength_model": 0.8, "strength_clip": 0.8,
+                      "model": ["4", 0], "clip": ["4", 1]}, "class_type": "LoraLoader"},
+}
+
+# The same graph as COMFY_PROMPT in the UI "workflow" format, plus a reroute and a bypassed node
+COMFY_WORKFLOW = {
+    "last_node_id": 12, "last_link_id": 14, "version": 0.4,
+    "nodes": [
+        {"id": 3, "type": "KSampler", "mode": 0,
+         "inputs": [{"name": "model", "type": "MODEL", "link": 13}, {"name": "positive", "type": "CONDITIONING", "link": 4},
+                    {"name": "negative", "type": "CONDITIONING", "link": 6}, {"name": "latent_image", "type": "LATENT", "link": 2}],
+         "outputs": [{"name": "LATENT", "type": "LATENT", "links": [7], "slot_index": 0}],
+         "widgets_values": [89898989, "fixed", 20, 7.0, "dpmpp_2m", "karras", 1.0]},
+        {"id": 4, "type": "CheckpointLoaderSimple", "mode": 0, "inputs": [],
+         "outputs": [{"name": "MODEL", "type": "MODEL", "links": [10]}, {"name": "CLIP", "type": "CLIP", "links": [11]},
+                     {"name": "VAE", "type": "VAE", "links": [8]}],
+         "widgets_values": ["sd_xl_base_1.0.safetensors"]},
+        {"id": 5, "type": "EmptyLatentImage", "mode": 0, "inputs": [],
+         "outputs": [{"name": "LATENT", "type": "LATENT", "links": [2]}], "widgets_values": [1024, 1024, 1]},
+        {"id": 6, "type": "CLIPTextEncode", "mode": 0, "inputs": [{"name": "clip", "type": "CLIP", "link": 12}],
+         "outputs": [{"name": "CONDITIONING", "type": "CONDITIONING", "links": [4]}],
+         "widgets_values": ["beautiful landscape painting, epic composition"]},
+        {"id": 7, "type": "CLIPTextEncode", "mode": 0, "inputs": [{"name": "clip", "type": "CLIP", "link": 14}],
+         "outputs": [{"name": "CONDITIONING", "type": "CONDITIONING", "links": [6]}], "widgets_values": ["ugly, deformed"]},
+        {"id": 8, "type": "VAEDecode", "mode": 0,
+         "inputs": [{"name": "samples", "type": "LATENT", "link": 7}, {"name": "vae", "type": "VAE", "link": 8}],
+         "outputs": [{"name": "IMAGE", "type": "IMAGE", "links": [9]}]},
+        {"id": 9, "type": "SaveImage", "mode": 0, "inputs": [{"name": "images", "type": "IMAGE", "link": 9}], "widgets_values": ["ComfyUI"]},
+        {"id": 10, "type": "LoraLoader", "mode": 0,
+         "inputs": [{"name": "model", "type": "MODEL", "link": 10}, {"name": "clip", "type": "CLIP", "link": 11}],
+         "outputs": [{"name": "MODEL", "type": "MODEL", "links": [1]}, {"name": "CLIP", "type": "CLIP", "links": [3]}],
+         "widgets_values": ["add_detail.safetensors", 0.8, 0.8]},
+        {"id": 11, "type": "Reroute", "mode": 0, "inputs": [{"name": "", "type": "*", "link": 3}],
+         "outputs": [{"name": "", "type": "CLIP", "links": [12, 14]}]},
+        {"id": 12, "type": "FreeU_V2", "mode": 4, "inputs": [{"name": "model", "type": "MODEL", "link": 1}],
+         "outputs": [{"name": "MODEL", "type": "MODEL", "links": [13]}], "widgets_values": [1.3, 1.4, 0.9, 0.2]},
+    ],
+    "links": [
+        [1, 10, 0, 12, 0, "MODEL"], [2, 5, 0, 3, 3, "LATENT"], [3, 10, 1, 11, 0, "CLIP"], [4, 6, 0, 3, 1, "CONDITIONING"],
+        [6, 7, 0, 3, 2, "CONDITIONING"], [7, 3, 0, 8, 0, "LATENT"], [8, 4, 2, 8, 1, "VAE"], [9, 8, 0, 9, 0, "IMAGE"],
+        [10, 4, 0, 10, 0, "MODEL"], [11, 4, 1, 10, 1, "CLIP"], [12, 11, 0, 6, 0, "CLIP"], [13, 12, 0, 3, 0, "MODEL"],
+        [14, 11, 0, 7, 0, "CLIP"],
+    ],
+}
+
+
+def large_comfy_prompt(extra_nodes: int = 600) -> dict:
+    """COMFY_PROMPT plus a hires pass, a preview-only sampler and a long chain of unrelated nodes."""
+    prompt = json.loads(json.dumps(COMFY_PROMPT))
+    prompt["20"] = {"inputs": {"image": ["8", 0], "upscale_method": "lanczos", "scale_by": 1.5}, "class_type": "ImageScaleBy"}
+    prompt["21"] = {"inputs": {"pixels": ["20", 0], "vae": ["4", 2]}, "class_type": "VAEEncode"}
+    prompt["22"] = {"inputs": {"seed": 89898989, "steps": 12, "cfg": 5.0, "sampler_name": "euler", "scheduler": "normal",
+                               "denoise": 0.4, "model": ["10", 0], "positive": ["6", 0], "negative": ["7", 0],
+                               "latent_image": ["21", 0]}, "class_type": "KSampler"}
+    prompt["23"] = {"inputs": {"samples": ["22", 0], "vae": ["4", 2]}, "class_type": "VAEDecode"}
+    prompt["9"]["inputs"]["images"] = ["23", 0]
+    prompt["30"] = {"inputs": {"seed": 1, "steps": 4, "cfg": 1.0, "sampler_name": "lcm", "scheduler": "sgm_uniform",
+                               "denoise": 1.0, "model": ["4", 0], "positive": ["6", 0], "negative": ["7", 0],
+                               "latent_image": ["5", 0]}, "class_type": "KSampler"}
+    prompt["31"] = {"inputs": {"images": ["30", 0]}, "class_type": "PreviewImage"}
+    for i in range(1000, 1000 + extra_nodes):
+        prompt[str(i)] = {"inputs": {"image": [str(i - 1) if i > 1000 else "8", 0], "low_threshold": 100, "high_threshold": 200},
+                          "class_type": "CannyEdgePreprocessor"}
+    return prompt
+
+
+def base_image(size=(512, 512), mode="RGB"):
+    """A deterministic, compressible picture (gradient plus shapes) so the corpus stays small."""
+    width, height = size
+    img = Image.merge("RGB", (
+        Image.linear_gradient("L").resize(size),
+        Image.linear_gradient("L").rotate(90).resize(size),
+        Image.radial_gradient("L").resize(size),
+    ))
+    draw = ImageDraw.Draw(img)
+    draw.ellipse((width // 4, height // 4, width * 3 // 4, height * 3 // 4), outline=(255, 255, 255), width=max(width // 128, 1))
+    if mode == "RGBA":
+        img.putalpha(255)
+    return img
+
+
+def embed_stealth(img: Image.Image, text: str, mode: str, compressed: bool) -> Image.Image:
+    """Writes stealth pnginfo the same way sd_webui_stealth_pnginfo does (column-major LSBs)."""
+    if mode == "alpha":
+        signature = "stealth_pngcomp" if compressed else "stealth_pnginfo"
+        img = img.convert("RGBA")
+    else:
+        signature = "stealth_rgbcomp" if compressed else "stealth_rgbinfo"
+        img = img.convert("RGB")
+    payload = gzip.compress(text.encode("utf-8"), mtime=0) if compressed else text.encode("utf-8")
+    bits = "".join(format(b, "08b") for b in signature.encode("utf-8"))
+    bits += format(len(payload) * 8, "032b")
+    bits += "".join(format(b, "08b") for b in payload)
+
+    width, height = img.size
+    pixels = img.load()
+    index = 0
+    for x in range(width):
+        for y in range(height):
+            if index >= len(bits):
+                return img
+            if mode == "alpha":
+                r, g, b, a = pixels[x, y]
+                pixels[x, y] = (r, g, b, (a & ~1) | int(bits[index]))
+                index += 1
+            else:
+                r, g, b = pixels[x, y]
+                channel_bits = bits[index:index + 3].ljust(3, "0")
+                pixels[x, y] = ((r & ~1) | int(channel_bits[0]), (g & ~1) | int(channel_bits[1]), (b & ~1) | int(channel_bits[2]))
+                index += 3
+    raise ValueError("Image too small for stealth payload")
+
+
+def save_with_text(name: str, chunks: dict, img: Image.Image = None, itxt: bool = False):
+    img = img or base_image()
+    info = PngInfo()
+    for key, value in chunks.items():
+        if itxt:
+            info.add_itxt(key, value)
+        else:
+            info.add_text(key, value)
+    img.save(CORPUS_DIR / name, pnginfo=info, optimize=True)
+
+
+def main():
+    CORPUS_DIR.mkdir(parents=True, exist_ok=True)
+    drawthings_xmp = (
+        '<x:xmpmeta xmlns:x="adobe:ns:meta/"><rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">'
+        '<rdf:Description><dc:description><rdf:Alt><rdf:li xml:lang="x-default">a watercolor fox in a meadow</rdf:li>'
+        '</rdf:Alt></dc:description><exif:UserComment><rdf:Alt><rdf:li xml:lang="x-default">'
+        + json.dumps(DRAWTHINGS_JSON) +
+        '</rdf:li></rdf:Alt></exif:UserComment></rdf:Description></rdf:RDF></x:xmpmeta>'
+    )
+
+    save_with_text("a1111.png", {"parameters": A1111_PARAMETERS})
+    save_with_text("novelai.png", {"Description": NAI_COMMENT["prompt"], "Software": "NovelAI", "Comment": json.dumps(NAI_COMMENT)})
+    save_with_text("swarmui.png", {"parameters": json.dumps(SWARM_PARAMETERS)})
+    save_with_text("mooshieui.png", {"parameters": json.dumps(MOOSHIE_PARAMETERS)})
+    save_with_text("invokeai.png", {"invokeai_metadata": json.dumps(INVOKEAI_METADATA)})
+    save_with_text("drawthings_xmp.png", {"XML:com.adobe.xmp": drawthings_xmp}, itxt=True)
+    save_with_text("illust.png", {"generate_info": json.dumps(ILLUST_GENERATE_INFO)})
+    save_with_text("comfyui.png", {"prompt": json.dumps(COMFY_PROMPT)})
+    save_with_text("comfyui_large.png", {"prompt": json.dumps(large_comfy_prompt())})
+    save_with_text("comfyui_workflow.png", {"workflow": json.dumps(COMFY_WORKFLOW)})
+
+    for mode in ("alpha", "rgb"):
+        for compressed in (False, True):
+            img = embed_stealth(base_image(), A1111_PARAMETERS, mode, compressed)
+            name = f"stealth_{mode}{'_comp' if compressed else ''}.png"
+            img.save(CORPUS_DIR / name, optimize=True)
+
+    # Large images without any metadata: the worst case for the stealth scan
+    base_image((3840, 2160)).save(CORPUS_DIR / "plain_4k_rgb.png", optimize=True)
+    base_image((3840, 2160), mode="RGBA").save(CORPUS_DIR / "plain_4k_rgba.png", optimize=True)
+
+    for path in sorted(CORPUS_DIR.glob("*.png")):
+        print(f"{path.name}: {path.stat().st_size / 1024:.1f} KiB")
+
+
+if __name__ == "__main__":
+    main()
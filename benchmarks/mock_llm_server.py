@@ -0,0 +1,269 @@
+"""
+Local stand-in for the chatbot's LLM providers, for offline benchmarks.
+
+Usage:
+    python benchmarks/mock_llm_server.py [--port 8808] [--latency 0.3] [--tokens-per-second 60]
+
+Speaks just enough of two APIs for chat_module_openai / chat_module_gemini:
+    OpenAI chat completions   POST /v1/chat/completions (also /api/v1/...), "stream": true for SSE
+    Gemini generate content   POST /v1beta/models/<model>:generateContent
+                              POST /v1beta/models/<model>:streamGenerateContent?alt=sse
+                              POST /v1beta/cachedContents, PATCH /v1beta/cachedContents/<id>
+    GET /stats                request counts and peak concurrency (for bench_chatbot.py)
+
+Point the bot at it with OPENROUTER_BASE_URL = "http://127.0.0.1:8808/v1" or
+GEMINIAPI_BASE_URL = "http://127.0.0.1:8808". Each reply waits `latency` seconds (plus
+prefill time for uncached prompt tokens), then produces tokens at `tokens-per-second`.
+A repeated system prompt counts as a prefix-cache hit, like the real providers.
+"""
+import argparse
+import asyncio
+import hashlib
+import itertools
+import json
+import random
+import time
+
+from aiohttp import web
+
+WORDS = ("sure", "that", "sounds", "fun", "let", "me", "think", "about", "it", "for", "a",
+         "moment", "honestly", "I", "would", "say", "yes", "but", "maybe", "not", "today")
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4) if text else 0
+
+
+class MockLLM:
+    def __init__(self, latency: float, jitter: float, tokens_per_second: float, prefill_rate: float,
+                 reply_tokens: int, error_rate: float, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.tokens_per_second = tokens_per_second
+        self.prefill_rate = prefill_rate
+        self.reply_tokens = reply_tokens
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.prefixes = set() # hashes of system prompts seen, for prefix-cache hits
+        self.caches = {} # Gemini cachedContents name -> system instruction tokens
+        self.ids = itertools.count(1)
+        self.requests = {}
+        self.errors = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    def prefix_cached(self, system_text: str) -> int:
+        """Tokens of the system prompt served from the (simulated) prefix cache."""
+        if not system_text:
+            return 0
+        key = hashlib.sha1(system_text.encode()).digest()
+        if key in self.prefixes:
+            return estimate_tokens(system_text)
+        self.prefixes.add(key)
+        return 0
+
+    def reply(self):
+        count = max(1, int(self.reply_tokens * self.random.uniform(0.5, 1.5)))
+        return [self.random.choice(WORDS) for _ in range(count)]
+
+    async def wait_first_token(self, prompt_tokens: int, cached_tokens: int):
+        delay = self.latency * self.random.uniform(1 - self.jitter, 1 + self.jitter)
+        delay += max(prompt_tokens - cached_tokens, 0) / self.prefill_rate
+        await asyncio.sleep(delay)
+
+    def begin(self, kind: str):
+        self.requests[kind] = self.requests.get(kind, 0) + 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        if self.random.random() < self.error_rate:
+            self.errors += 1
+            return web.json_response({"error": {"code": 503, "message": "mock overload", "status": "UNAVAILABLE"}}, status=503)
+        return None
+
+    def stats(self) -> dict:
+        return {"requests": self.requests, "errors": self.errors, "in_flight": self.in_flight, "peak_in_flight": self.peak_in_flight}
+
+
+def openai_text(content) -> str:
+    if isinstance(content, str):
+        return content
+    return " ".join(part.get("text", "") for part in content or [] if isinstance(part, dict))
+
+
+async def openai_chat(request: web.Request):
+    llm: MockLLM = request.app["llm"]
+    body = await request.json()
+    error = llm.begin("openai")
+    try:
+        if error is not None:
+            return error
+        messages = body.get("messages", [])
+        system = "".join(openai_text(m.get("content")) for m in messages[:1] if m.get("role") == "system")
+        prompt_tokens = sum(4 + estimate_tokens(openai_text(m.get("content"))) for m in messages)
+        cached = llm.prefix_cached(system)
+        words = llm.reply()[:body.get("max_tokens") or None]
+        completion_id = f"chatcmpl-mock-{next(llm.ids)}"
+        created = int(time.time())
+        model = body.get("model", "mock")
+        usage = {
+            "prompt_tokens": prompt_tokens, "completion_tokens": len(words), "total_tokens": prompt_tokens + len(words),
+            "prompt_tokens_details": {"cached_tokens": cached},
+        }
+        await llm.wait_first_token(prompt_tokens, cached)
+        if not body.get("stream"):
+            await asyncio.sleep(len(words) / llm.tokens_per_second)
+            return web.json_response({
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": " ".join(words)}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+
+        async def event(choices, **extra):
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model, "choices": choices, **extra}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+
+        for i, word in enumerate(words):
+            delta = {"content": word if i == 0 else " " + word}
+            if i == 0:
+                delta["role"] = "assistant"
+            await event([{"index": 0, "delta": delta, "finish_reason": None}])
+            await asyncio.sleep(1 / llm.tokens_per_second)
+        await event([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        if (body.get("stream_options") or {}).get("include_usage"):
+            await event([], usage=usage)
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+    finally:
+        llm.in_flight -= 1
+
+
+def gemini_text(contents) -> str:
+    if isinstance(contents, str):
+        return contents
+    if isinstance(contents, dict):
+        contents = [contents]
+    texts = []
+    for content in contents or []:
+        for part in content.get("parts", []) if isinstance(content, dict) else []:
+            texts.append(part.get("text", ""))
+    return " ".join(texts)
+
+
+async def gemini_generate(request: web.Request):
+    llm: MockLLM = request.app["llm"]
+    model, _, method = request.match_info["target"].partition(":")
+    if method not in ("generateContent", "streamGenerateContent"):
+        raise web.HTTPNotFound()
+    body = await request.json()
+    error = llm.begin("gemini")
+    try:
+        if error is not None:
+            return error
+        system = gemini_text(body.get("systemInstruction") or body.get("system_instruction"))
+        cache_name = body.get("cachedContent") or body.get("cached_content")
+        if cache_name and cache_name not in llm.caches:
+            return web.json_response({"error": {"code": 404, "message": f"{cache_name} not found", "status": "NOT_FOUND"}}, status=404)
+        history_tokens = sum(4 + estimate_tokens(gemini_text(c)) for c in body.get("contents", []))
+        cached = llm.caches[cache_name] if cache_name else llm.prefix_cached(system)
+        prompt_tokens = history_tokens + (cached if cache_name else estimate_tokens(system))
+        max_tokens = (body.get("generationConfig") or {}).get("maxOutputTokens")
+        words = llm.reply()[:max_tokens or None]
+
+        def chunk(text, done, count):
+            return {
+                "candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "index": 0, **({"finishReason": "STOP"} if done else {})}],
+                "usageMetadata": {"promptTokenCount": prompt_tokens, "candidatesTokenCount": count,
+                                  "totalTokenCount": prompt_tokens + count, **({"cachedContentTokenCount": cached} if cached else {})},
+                "modelVersion": model.rsplit("/", 1)[-1],
+            }
+
+        await llm.wait_first_token(prompt_tokens, cached)
+        if method == "generateContent":
+            await asyncio.sleep(len(words) / llm.tokens_per_second)
+            return web.json_response(chunk(" ".join(words), True, len(words)))
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+        for i, word in enumerate(words):
+            text = word if i == 0 else " " + word
+            await response.write(f"data: {json.dumps(chunk(text, i == len(words) - 1, i + 1))}\r\n\r\n".encode())
+            await asyncio.sleep(1 / llm.tokens_per_second)
+        await response.write_eof()
+        return response
+    finally:
+        llm.in_flight -= 1
+
+
+def cached_content(name, body, tokens, ttl):
+    return {
+        "name": name, "model": body.get("model", ""), "displayName": body.get("displayName", ""),
+        "expireTime": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() + ttl)),
+        "usageMetadata": {"totalTokenCount": tokens},
+    }
+
+
+def parse_ttl(value) -> float:
+    return float(str(value or "3600s").rstrip("s"))
+
+
+async def gemini_create_cache(request: web.Request):
+    llm: MockLLM = request.app["llm"]
+    body = await request.json()
+    llm.requests["gemini_cache"] = llm.requests.get("gemini_cache", 0) + 1
+    name = f"cachedContents/mock{next(llm.ids)}"
+    tokens = estimate_tokens(gemini_text(body.get("systemInstruction") or body.get("system_instruction")))
+    tokens += sum(estimate_tokens(gemini_text(c)) for c in body.get("contents", []))
+    llm.caches[name] = tokens
+    return web.json_response(cached_content(name, body, tokens, parse_ttl(body.get("ttl"))))
+
+
+async def gemini_update_cache(request: web.Request):
+    llm: MockLLM = request.app["llm"]
+    name = f"cachedContents/{request.match_info['cache_id']}"
+    if name not in llm.caches:
+        return web.json_response({"error": {"code": 404, "message": f"{name} not found", "status": "NOT_FOUND"}}, status=404)
+    body = await request.json()
+    llm.requests["gemini_cache"] = llm.requests.get("gemini_cache", 0) + 1
+    return web.json_response(cached_content(name, body, llm.caches[name], parse_ttl(body.get("ttl"))))
+
+
+async def stats(request: web.Request):
+    return web.json_response(request.app["llm"].stats())
+
+
+def make_app(llm: MockLLM) -> web.Application:
+    app = web.Application(client_max_size=32 * 1024**2) # vision requests carry base64 images
+    app["llm"] = llm
+    app.router.add_post("/v1/chat/completions", openai_chat)
+    app.router.add_post("/api/v1/chat/completions", openai_chat)
+    app.router.add_post("/chat/completions", openai_chat)
+    app.router.add_post("/{version:v1(?:beta|alpha)?}/models/{target}", gemini_generate)
+    app.router.add_post("/{version:v1(?:beta|alpha)?}/cachedContents", gemini_create_cache)
+    app.router.add_patch("/{version:v1(?:beta|alpha)?}/cachedContents/{cache_id}", gemini_update_cache)
+    app.router.add_get("/stats", stats)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock OpenAI / Gemini server for PI-Chan chatbot benchmarks.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8808)
+    parser.add_argument("--latency", type=float, default=0.3, help="seconds before the first token")
+    parser.add_argument("--jitter", type=float, default=0.3, help="latency varies by +- this fraction")
+    parser.add_argument("--tokens-per-second", type=float, default=60.0, help="generation speed")
+    parser.add_argument("--prefill-rate", type=float, default=20000.0, help="uncached prompt tokens processed per second")
+    parser.add_argument("--reply-tokens", type=int, default=40, help="average reply length")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with a 503")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    llm = MockLLM(args.latency, args.jitter, args.tokens_per_second, args.prefill_rate, args.reply_tokens, args.error_rate, args.seed)
+    print(f"mock LLM server on http://{args.host}:{args.port}", flush=True)
+    web.run_app(make_app(llm), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
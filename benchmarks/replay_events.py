@@ -0,0 +1,457 @@
+"""
+Replays recorded gateway events into the bot's handlers, for load testing and sizing.
+
+Usage:
+    python benchmarks/replay_events.py events.jsonl [--speed 10] [--repeat 3] [--output replay.json]
+    python benchmarks/replay_events.py --make-synthetic events.jsonl [--posts 200]
+    python benchmarks/replay_events.py --compare before.json after.json
+
+Recordings come from the bot itself (set RECORD_EVENTS_PATH in config.toml) or from
+--make-synthetic, which builds one from the benchmark corpus: bursts of image posts,
+reaction storms on them and chatbot triggers. Events are fed to on_message /
+on_raw_reaction_add at their recorded offsets divided by --speed, against fake channels,
+messages and attachments (attachment bytes come from the recording's fixtures). Chatbot
+triggers need --chatbot, which answers them from benchmarks/mock_llm_server.py.
+
+Reports per-handler latency percentiles and exceptions that escaped the handlers, the
+errors the bot caught and logged (by message key), dispatch lag (how far behind schedule
+the replay fell), peak RSS and, with --tracemalloc, the Python heap high-water mark.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import random
+import resource
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from types import SimpleNamespace
+
+from bench_metadata import CORPUS_DIR, compare, environment, load_bot_module
+
+BOT_USER_ID = 990000000000000001
+SYNTHETIC_GUILD_ID = 990000000000000002
+SYNTHETIC_CHANNEL_ID = 990000000000002000
+ID_STRIDE = 1 << 40 # added to message/attachment ids per --repeat pass, so caches see new content
+
+
+def load_recording(path: Path):
+    events = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            event = json.loads(line)
+            if event.get("type") in ("message", "reaction"):
+                events.append(event)
+    events.sort(key=lambda event: event["t"])
+    return events
+
+
+def make_synthetic(path: Path, posts: int, channels: int, seed: int):
+    """Writes a recording built from the benchmark corpus (fixtures point into benchmarks/corpus)."""
+    rng = random.Random(seed)
+    corpus = sorted(CORPUS_DIR.glob("*.png"))
+    if not corpus:
+        raise SystemExit("benchmarks/corpus is empty, run make_corpus.py first")
+    ids = itertools.count(1_000_000_000_000_000_000)
+    users = [{"id": 20_000 + n, "bot": False, "name": f"user{n}"} for n in range(50)]
+    events = []
+    t = 0.0
+    for _ in range(posts):
+        t += rng.expovariate(2.0) # ~2 posts per second, with bursts
+        channel_id = SYNTHETIC_CHANNEL_ID + rng.randrange(channels)
+        image = rng.choice(corpus)
+        message_id = next(ids)
+        events.append({
+            "type": "message", "t": round(t, 4), "id": message_id, "channel_id": channel_id,
+            "guild_id": SYNTHETIC_GUILD_ID, "author": rng.choice(users), "content": "",
+            "created_at": None, "reference_id": None, "mentions": [],
+            "attachments": [{"id": next(ids), "filename": image.name, "size": image.stat().st_size,
+                             "url": f"https://cdn.example.invalid/{image.name}", "fixture": str(image.resolve())}],
+        })
+        if rng.random() < 0.3: # a reaction storm: many people ask for the same image's parameters
+            for _ in range(rng.randint(1, 25)):
+                user = rng.choice(users)
+                events.append({
+                    "type": "reaction", "t": round(t + rng.uniform(0.2, 5.0), 4), "message_id": message_id,
+                    "channel_id": channel_id, "guild_id": SYNTHETIC_GUILD_ID, "user_id": user["id"],
+                    "member": {"id": user["id"], "bot": False}, "emoji": "🔎",
+                })
+        if rng.random() < 0.15:
+            events.append({
+                "type": "message", "t": round(t + rng.uniform(0.1, 3.0), 4), "id": next(ids), "channel_id": channel_id,
+                "guild_id": SYNTHETIC_GUILD_ID, "author": rng.choice(users), "content": "pichan what do you think of this one?",
+                "created_at": None, "reference_id": None, "mentions": [], "attachments": [],
+            })
+    events.sort(key=lambda event: event["t"])
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"type": "header", "version": 1, "synthetic": True, "seed": seed}) + "\n")
+        for event in events:
+            f.write(json.dumps(event, ensure_ascii=False) + "\n")
+    print(f"wrote {len(events)} events to {path}", file=sys.stderr)
+
+
+def replay_config(channel_ids, chatbot: str, server: str = None) -> str:
+    config = f"""
+TOKEN = "benchmark"
+LANGUAGE = "normal"
+MONITORED_CHANNEL_IDS = {sorted(channel_ids)}
+CHATBOT_RESPONSIVE = {sorted(channel_ids) if chatbot != 'off' else []}
+SPOOL_THRESHOLD_BYTES = {2**62}
+USE_GEMINIAPI = {str(chatbot == 'gemini').lower()}
+USE_OPENROUTER = {str(chatbot == 'openai').lower()}
+"""
+    if server:
+        config += f"""
+GEMINIAPI_TOKEN = "mock"
+GEMINIAPI_MODEL = "mock-gemini"
+GEMINIAPI_BASE_URL = "{server}"
+OPENROUTER_TOKEN = "mock"
+OPENROUTER_MODEL = "mock-openai"
+OPENROUTER_BASE_URL = "{server}/v1"
+"""
+    return config
+
+
+# --- Fake Discord objects ---
+
+class FakeUser:
+    def __init__(self, user_id: int, name: str = None, bot: bool = False):
+        import discord
+        self.id = user_id
+        self.name = name or f"user{user_id}"
+        self.global_name = self.name
+        self.display_name = self.name
+        self.bot = bot
+        self.color = discord.Color.blue()
+        self.display_avatar = "https://cdn.example.invalid/avatar.png"
+        self.mention = f"<@{user_id}>"
+        self.dm = None
+
+    def __str__(self):
+        return self.name
+
+    def mentioned_in(self, message) -> bool:
+        return self.id in [user.id for user in message.mentions]
+
+    async def create_dm(self):
+        if self.dm is None:
+            self.dm = FakeChannel(-self.id, None)
+        return self.dm
+
+
+class FakeAttachment:
+    def __init__(self, spec: dict, base_dir: Path, id_offset: int):
+        self.id = spec["id"] + id_offset
+        self.filename = spec["filename"]
+        self.size = spec["size"]
+        self.url = spec["url"]
+        fixture = spec.get("fixture")
+        self.path = (base_dir / fixture) if fixture else None
+
+    async def read(self):
+        if self.path is None or not self.path.exists():
+            return b"" # not captured: behaves like an unreadable image
+        return await asyncio.to_thread(self.path.read_bytes)
+
+
+class FakeChannel:
+    """Enough of a text channel / DM channel for the handlers; counts what the bot sends."""
+    def __init__(self, channel_id: int, world):
+        self.id = channel_id
+        self.world = world
+        self.messages = {}
+        self.sent = 0
+
+    async def fetch_message(self, message_id):
+        import discord
+        message = self.messages.get(message_id)
+        if message is None:
+            raise discord.NotFound(SimpleNamespace(status=404, reason="Not Found"), "Unknown Message")
+        return message
+
+    def get_partial_message(self, message_id):
+        return SimpleNamespace(delete=self._noop)
+
+    async def history(self, limit=100, before=None, oldest_first=False):
+        count = 0
+        for message in sorted(self.messages.values(), key=lambda m: m.id, reverse=True):
+            if before is not None and message.created_at >= before:
+                continue
+            yield message
+            count += 1
+            if count >= limit:
+                break
+
+    def typing(self):
+        import contextlib
+        return contextlib.nullcontext()
+
+    async def send(self, content=None, **kwargs):
+        self.sent += 1
+        return SimpleNamespace(id=None, content=content)
+
+    async def _noop(self, *args, **kwargs):
+        return None
+
+
+class World:
+    """All fake channels and users, plus the ids of the current --repeat pass."""
+    def __init__(self, base_dir: Path):
+        self.base_dir = base_dir
+        self.channels = {}
+        self.users = {}
+        self.id_offset = 0
+        self.reactions_added = 0
+
+    def channel(self, channel_id):
+        if channel_id not in self.channels:
+            self.channels[channel_id] = FakeChannel(channel_id, self)
+        return self.channels[channel_id]
+
+    def user(self, user_id, name=None, bot=False):
+        if user_id not in self.users:
+            self.users[user_id] = FakeUser(user_id, name, bot)
+        return self.users[user_id]
+
+    def message(self, event):
+        channel = self.channel(event["channel_id"])
+        author = event["author"]
+        created_at = datetime.fromisoformat(event["created_at"]) if event.get("created_at") else datetime.now(timezone.utc)
+        if self.id_offset:
+            created_at += timedelta(microseconds=self.id_offset >> 30)
+        message = SimpleNamespace(
+            id=event["id"] + self.id_offset,
+            content=event["content"],
+            clean_content=event["content"],
+            author=self.user(author["id"], author.get("name"), author.get("bot", False)),
+            guild=SimpleNamespace(id=event["guild_id"], shard_id=0) if event.get("guild_id") else None,
+            channel=channel,
+            attachments=[FakeAttachment(spec, self.base_dir, self.id_offset) for spec in event.get("attachments", [])],
+            mentions=[self.user(user_id) for user_id in event.get("mentions", [])],
+            mention_everyone=False,
+            reference=None,
+            created_at=created_at,
+            jump_url=f"https://discord.com/channels/{event.get('guild_id')}/{event['channel_id']}/{event['id']}",
+        )
+        async def add_reaction(emoji):
+            self.reactions_added += 1
+        message.add_reaction = add_reaction
+        channel.messages[message.id] = message
+        return message
+
+    def reaction(self, event):
+        member = event.get("member")
+        return SimpleNamespace(
+            message_id=event["message_id"] + self.id_offset,
+            channel_id=event["channel_id"],
+            guild_id=event.get("guild_id"),
+            user_id=event["user_id"],
+            member=self.user(member["id"], bot=member.get("bot", False)) if member else None,
+            emoji=event["emoji"],
+        )
+
+
+# --- Replay ---
+
+class HandlerStats:
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.error_types = {}
+
+    def summary(self) -> dict:
+        ordered = sorted(self.latencies)
+        def pct(q):
+            return ordered[max(0, min(len(ordered) - 1, math.ceil(q * len(ordered)) - 1))] * 1000 if ordered else None
+        return {
+            "events": len(ordered) + self.errors,
+            "uncaught": self.errors,
+            "error_types": self.error_types,
+            "mean_ms": statistics.fmean(ordered) * 1000 if ordered else None,
+            "p50_ms": pct(0.5), "p90_ms": pct(0.9), "p99_ms": pct(0.99),
+            "max_ms": ordered[-1] * 1000 if ordered else None,
+        }
+
+
+def current_rss() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+async def replay(bot, events, world: World, speed: float, repeat: int, drain: float):
+    handlers = {"message": bot.on_message, "reaction": bot.on_raw_reaction_add}
+    stats = {name: HandlerStats() for name in handlers}
+    lags = []
+    tasks = set()
+    peak_rss = current_rss()
+    sampling = True
+
+    async def sample_rss():
+        nonlocal peak_rss
+        while sampling:
+            peak_rss = max(peak_rss, current_rss())
+            await asyncio.sleep(0.05)
+
+    async def run_handler(kind, argument):
+        started = time.perf_counter()
+        try:
+            await handlers[kind](argument)
+        except Exception as e:
+            stats[kind].errors += 1
+            name = type(e).__name__
+            stats[kind].error_types[name] = stats[kind].error_types.get(name, 0) + 1
+            return
+        stats[kind].latencies.append(time.perf_counter() - started)
+
+    errors_before = dict(bot.error_counts())
+    sampler = asyncio.create_task(sample_rss())
+    started = time.perf_counter()
+    span = events[-1]["t"] if events else 0.0
+    for index in range(repeat):
+        world.id_offset = index * ID_STRIDE
+        pass_started = started + index * span / speed
+        for event in events:
+            due = pass_started + event["t"] / speed
+            delay = due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            lags.append(max(time.perf_counter() - due, 0.0))
+            argument = world.message(event) if event["type"] == "message" else world.reaction(event)
+            task = asyncio.create_task(run_handler(event["type"], argument)) # like discord's event dispatch
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.gather(*tasks)
+    drain_deadline = time.perf_counter() + drain
+    while bot.CHAT_TRIGGERS.stats()["channels"] and time.perf_counter() < drain_deadline: # coalesced chatbot replies
+        await asyncio.sleep(0.1)
+    elapsed = time.perf_counter() - started
+    sampling = False
+    await sampler
+
+    lags.sort()
+    return {
+        "events": len(events) * repeat,
+        "wall_seconds": elapsed,
+        "events_per_second": len(events) * repeat / elapsed if elapsed else None,
+        "recorded_seconds": span * repeat,
+        "handlers": {name: handler.summary() for name, handler in stats.items()},
+        "dispatch_lag_ms": {
+            "p50": lags[len(lags) // 2] * 1000 if lags else None,
+            "p99": lags[max(0, math.ceil(0.99 * len(lags)) - 1)] * 1000 if lags else None,
+            "max": lags[-1] * 1000 if lags else None,
+        },
+        "peak_rss_mb": peak_rss / 1024**2,
+        "sent": {
+            "channel_messages": sum(channel.sent for channel in world.channels.values()),
+            "dms": sum(user.dm.sent for user in world.users.values() if user.dm is not None),
+            "reactions": world.reactions_added,
+        },
+        "outbound": bot.OUTBOUND.stats(),
+        # The handlers catch and log almost everything, so these are the errors that matter
+        "bot_errors": {key: count - errors_before.get(key, 0) for key, count in bot.error_counts().items() if count > errors_before.get(key, 0)},
+    }
+
+
+async def run(bot, args, events, world, server):
+    bot.client._connection.user = FakeUser(BOT_USER_ID, "PI-Chan", bot=True)
+    bot.client.get_channel = lambda channel_id: world.channels.get(channel_id) or world.channel(channel_id)
+    bot.client.get_user = lambda user_id: world.user(user_id)
+    for backend in bot.BACKENDS:
+        backend.start()
+    if args.chatbot != "off":
+        await asyncio.gather(*(backend.get(timeout=30) for backend in bot.BACKENDS))
+        if bot.CHATBOT is None or not bot.CHATBOT.ready():
+            raise SystemExit(f"chat provider did not come up: {[backend.health() for backend in bot.BACKENDS]}")
+    result = await replay(bot, events, world, args.speed, args.repeat, args.drain)
+    if server:
+        import urllib.request
+        result["llm_server"] = json.loads(urllib.request.urlopen(f"{server}/stats", timeout=5).read())
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded Discord events into PI-Chan's handlers.")
+    parser.add_argument("recording", nargs="?", help="JSONL recording (RECORD_EVENTS_PATH or --make-synthetic)")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed factor, e.g. 1 to 100")
+    parser.add_argument("--repeat", type=int, default=1, help="replay the recording this many times back to back, with fresh ids")
+    parser.add_argument("--chatbot", choices=("off", "openai", "gemini"), default="off", help="answer chatbot triggers from the mock LLM server")
+    parser.add_argument("--server", help="running mock_llm_server.py to use with --chatbot (default: start one)")
+    parser.add_argument("--drain", type=float, default=30.0, help="seconds to wait for outstanding chatbot replies")
+    parser.add_argument("--tracemalloc", action="store_true", help="also report the Python heap high-water mark (slower)")
+    parser.add_argument("--make-synthetic", metavar="PATH", help="write a synthetic recording from the corpus and exit")
+    parser.add_argument("--posts", type=int, default=200, help="image posts in a synthetic recording")
+    parser.add_argument("--channels", type=int, default=5, help="channels in a synthetic recording")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write JSON results here instead of stdout")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="compare two result files")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    if args.make_synthetic:
+        make_synthetic(Path(args.make_synthetic), args.posts, args.channels, args.seed)
+        return
+    if not args.recording:
+        parser.error("a recording is required")
+    if not 0 < args.speed <= 1000:
+        parser.error("--speed must be between 0 and 1000")
+
+    recording = Path(args.recording).resolve()
+    output_path = Path(args.output).resolve() if args.output else None
+    events = load_recording(recording)
+    world = World(recording.parent)
+    channel_ids = {event["channel_id"] for event in events}
+
+    process = None
+    server = args.server
+    if args.chatbot != "off" and server is None:
+        from bench_chatbot import start_mock_server
+        process, server = start_mock_server(SimpleNamespace(latency=0.3, tokens_per_second=60.0, reply_tokens=40, error_rate=0.0, seed=args.seed))
+    try:
+        bot = load_bot_module(replay_config(channel_ids, args.chatbot, server))
+        if args.tracemalloc:
+            tracemalloc.start()
+        result = asyncio.run(run(bot, args, events, world, server))
+        if args.tracemalloc:
+            result["python_heap_peak_mb"] = tracemalloc.get_traced_memory()[1] / 1024**2
+            tracemalloc.stop()
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    for name, summary in result["handlers"].items():
+        if summary["events"]:
+            print(f"{name:<10} {summary['events']:>6} events, {summary['uncaught']} uncaught, "
+                  f"p50 {summary['p50_ms'] or 0:.1f} / p99 {summary['p99_ms'] or 0:.1f} ms", file=sys.stderr)
+    logged = result["bot_errors"]
+    print(f"bot errors: {sum(logged.values())}" + (f" ({', '.join(f'{key} x{count}' for key, count in sorted(logged.items()))})" if logged else ""), file=sys.stderr)
+    print(f"peak RSS {result['peak_rss_mb']:.0f} MB, dispatch lag p99 {result['dispatch_lag_ms']['p99'] or 0:.1f} ms", file=sys.stderr)
+
+    # {case: {"median_ms": ...}} entries so bench_metadata's --compare can diff two replays
+    results = {f"replay/{name}": {"median_ms": summary["p50_ms"] or 0.0, **summary} for name, summary in result["handlers"].items()}
+    output = {"environment": environment(), "settings": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+              "summary": {k: v for k, v in result.items() if k != "handlers"}, "results": results}
+    text = json.dumps(output, indent=2, default=str)
+    if output_path:
+        output_path.write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
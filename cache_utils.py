@@ -0,0 +1,63 @@
+"""Caching utilities for PI-Chan"""
+import asyncio
+import hashlib
+from collections import OrderedDict
+
+class LRUCache:
+    """Small bounded mapping that evicts the least recently used entry."""
+    def __init__(self, maxsize: int = 512):
+        self.maxsize = max(int(maxsize), 0)
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        """Return the cached value for key (and mark it as recently used)."""
+        if key not in self._data:
+            return default
+        self._data.move_to_end(key)
+        return self._data[key]
+
+    def put(self, key, value):
+        """Store a value, evicting the oldest entries if over capacity."""
+        if self.maxsize == 0:
+            return
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        return self._data.pop(key, default)
+
+    def clear(self):
+        self._data.clear()
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into a single in-flight task."""
+    def __init__(self):
+        self._inflight = {}
+
+    async def run(self, key, coro_factory):
+        """
+        Await coro_factory() once per key; concurrent callers share the result.
+        The entry is dropped as soon as the task finishes, so later calls run again.
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(coro_factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _t: self._inflight.pop(key, None))
+        # shield so one cancelled waiter doesn't cancel the shared work
+        return await asyncio.shield(task)
+
+    def __len__(self):
+        return len(self._inflight)
+
+def content_key(data: bytes) -> str:
+    """Content hash used to recognise identical reposted files."""
+    return f"{len(data)}:{hashlib.sha256(data).hexdigest()}"
@@ -0,0 +1,78 @@
+"""Per-channel coalescing of chatbot triggers for PI-Chan"""
+import asyncio
+from metrics import METRICS
+from translation_utils import tprint
+
+class _ChannelBatch:
+    __slots__ = ('pending', 'first_at', 'last_at', 'task', 'running')
+
+    def __init__(self):
+        self.pending = []
+        self.first_at = 0.0
+        self.last_at = 0.0
+        self.task = None
+        self.running = False
+
+class TriggerCoalescer:
+    """
+    Debounces chatbot triggers per channel and answers them with one request.
+
+    The first trigger in a channel starts collecting; the batch is handed to
+    `handler(messages)` once the channel has been quiet for `window` seconds, or
+    `max_wait` seconds after the first trigger at the latest. Triggers arriving
+    while the handler runs are queued for the next batch, so a channel never has
+    more than one LLM request in flight.
+    """
+    def __init__(self, handler, window: float = 1.5, max_wait: float = 5.0):
+        self.handler = handler
+        self.window = window
+        self.max_wait = max(max_wait, window)
+        self._channels = {} # channel id -> _ChannelBatch
+        self.triggers = 0
+        self.batches = 0
+
+    def submit(self, message):
+        """Queues a triggering message; returns immediately."""
+        now = asyncio.get_running_loop().time()
+        batch = self._channels.get(message.channel.id)
+        if batch is None:
+            batch = self._channels[message.channel.id] = _ChannelBatch()
+        if not batch.pending:
+            batch.first_at = now
+        batch.pending.append(message)
+        batch.last_at = now
+        self.triggers += 1
+        if batch.task is None:
+            batch.task = asyncio.create_task(self._run(message.channel.id, batch))
+
+    async def _run(self, channel_id, batch):
+        loop = asyncio.get_running_loop()
+        try:
+            while batch.pending:
+                # Wait for a quiet window, capped by max_wait since the oldest queued trigger
+                while True:
+                    delay = min(batch.last_at + self.window, batch.first_at + self.max_wait) - loop.time()
+                    if delay <= 0:
+                        break
+                    await asyncio.sleep(delay)
+                messages, batch.pending = batch.pending, []
+                self.batches += 1
+                METRICS.inc("chat_triggers_coalesced", len(messages) - 1)
+                batch.running = True
+                try:
+                    await self.handler(messages)
+                except Exception as e:
+                    tprint("chatbot_error", error=e)
+                finally:
+                    batch.running = False
+        finally:
+            # No await between the empty check and here, so no trigger can slip in unseen
+            del self._channels[channel_id]
+
+    def stats(self) -> dict:
+        return {
+            "triggers": self.triggers,
+            "batches": self.batches,
+            "in_flight": sum(1 for batch in self._channels.values() if batch.running),
+            "channels": len(self._channels),
+        }
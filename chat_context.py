@@ -0,0 +1,149 @@
+"""Token-budgeted chat history with cached rolling summaries for PI-Chan's chatbot"""
+import asyncio
+from collections import OrderedDict
+from metrics import METRICS
+from translation_utils import tprint
+
+IMG = ('png', 'jpg', 'jpeg', 'gif', 'webp')
+CHARS_PER_TOKEN = 4 # rough average for English chat; no tokenizer needed
+MESSAGE_OVERHEAD_TOKENS = 4 # role / name framing of each turn
+IMAGE_TOKENS = 258 # what one image costs on Gemini; OpenAI low-detail is cheaper
+
+SUMMARY_INSTRUCTION = (
+    "You keep a running summary of a Discord conversation for a chatbot that only sees "
+    "the most recent messages. Merge the new messages into the summary. Keep who said "
+    "what, names, open questions, promises and running jokes; drop small talk. Write at "
+    "most {max_words} words of plain prose, no preamble."
+)
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (characters / 4, rounded up)."""
+    return -(-len(text) // CHARS_PER_TOKEN) if text else 0
+
+def message_tokens(message, vision: bool = False) -> int:
+    tokens = MESSAGE_OVERHEAD_TOKENS + estimate_tokens(message.content or "")
+    if vision and message.attachments and message.attachments[0].filename.lower().split('.')[-1] in IMG:
+        tokens += IMAGE_TOKENS
+    return tokens
+
+def summary_prompt(previous: str, transcript: str, max_words: int) -> str:
+    """The user turn sent to the model when folding messages into a summary."""
+    return (
+        f"Summary so far:\n{previous or '(nothing yet)'}\n\n"
+        f"New messages:\n{transcript}\n\n"
+        f"Updated summary (at most {max_words} words):"
+    )
+
+def record_prompt_usage(provider: str, prompt_tokens, cached_tokens):
+    """Counts prompt tokens reported by the provider and how many were served from its prefix cache."""
+    prompt_tokens = prompt_tokens or 0
+    cached_tokens = cached_tokens or 0
+    METRICS.inc("llm_prompt_tokens", prompt_tokens, provider=provider)
+    METRICS.inc("llm_prompt_tokens_cached", cached_tokens, provider=provider)
+    METRICS.inc("llm_prompt_cache", provider=provider, result="hit" if cached_tokens else "miss")
+
+class ChannelSummary:
+    __slots__ = ("text", "last_id", "task", "start_id")
+
+    def __init__(self):
+        self.text = None
+        self.last_id = 0 # id of the newest message folded into text
+        self.task = None
+        self.start_id = 0 # id of the oldest message in the verbatim window
+
+class ContextBuilder:
+    """
+    Chooses what part of a channel's history is sent to the model.
+
+    The newest messages are kept verbatim until `budget` tokens (minus the personality
+    and the summary) are used up, but never fewer than `min_recent`. Older messages are
+    folded into a per-channel rolling summary. Folding runs in the background once
+    `fold_batch` unfolded messages have piled up and only sends the new messages plus
+    the previous summary, so a reply never waits for it.
+
+    The start of the verbatim window is sticky: between turns it only grows at the end,
+    so the request prefix stays byte-identical and the provider's prefix cache can be
+    reused. Once it outgrows the budget it is cut back to `trim_to` of the budget in one
+    step instead of sliding by a message every turn.
+    """
+    def __init__(self, budget: int = 2048, min_recent: int = 6, fold_batch: int = 8,
+                 summary_words: int = 150, max_channels: int = 1024, trim_to: float = 0.5):
+        self.budget = budget
+        self.trim_to = trim_to
+        self.min_recent = min_recent
+        self.fold_batch = fold_batch
+        self.summary_words = summary_words
+        self.max_channels = max_channels
+        self.summaries = OrderedDict() # channel id -> ChannelSummary, least recently used first
+
+    def _state(self, channel_id) -> ChannelSummary:
+        state = self.summaries.get(channel_id)
+        if state is None:
+            state = self.summaries[channel_id] = ChannelSummary()
+            while len(self.summaries) > self.max_channels:
+                self.summaries.popitem(last=False)
+        else:
+            self.summaries.move_to_end(channel_id)
+        return state
+
+    def assemble(self, messages, fixed_tokens: int = 0, vision: bool = False):
+        """
+        Splits `messages` (oldest first) for one request.
+        Returns (summary text or None, messages to send verbatim, older messages not yet in the summary).
+        """
+        state = self._state(messages[-1].channel.id)
+        summary = state.text
+        available = self.budget - fixed_tokens
+        if summary:
+            available -= MESSAGE_OVERHEAD_TOKENS + estimate_tokens(summary)
+        costs = [message_tokens(message, vision) for message in messages]
+        start = next((i for i, message in enumerate(messages) if message.id >= state.start_id), len(messages))
+        start = min(start, max(len(messages) - self.min_recent, 0))
+        used = sum(costs[start:])
+        if used > available:
+            # Over budget: restart the window from the newest messages that fit in trim_to of it
+            limit = available * self.trim_to
+            used = 0
+            start = len(messages)
+            while start > 0 and (len(messages) - start < self.min_recent or used + costs[start - 1] <= limit):
+                start -= 1
+                used += costs[start]
+        state.start_id = messages[start].id if start < len(messages) else 0
+        keep = len(messages) - start
+        recent = messages[start:]
+        pending = [message for message in messages[:len(messages) - keep] if message.id > state.last_id]
+        METRICS.inc("llm_context_tokens", fixed_tokens, part="prompt")
+        METRICS.inc("llm_context_tokens", used, part="history")
+        if summary:
+            METRICS.inc("llm_context_tokens", estimate_tokens(summary), part="summary")
+        METRICS.inc("llm_context_messages_folded", len(messages) - keep)
+        return summary, recent, pending
+
+    def schedule_fold(self, pending, render, summarize):
+        """
+        Folds `pending` into the channel summary in the background if enough has piled up.
+        render(message) -> transcript line; summarize(instruction, prompt) -> awaitable text.
+        """
+        if not pending:
+            return None
+        state = self._state(pending[-1].channel.id)
+        if state.task is not None and not state.task.done():
+            return state.task # one fold per channel at a time, the next trigger picks up the rest
+        if len(pending) < self.fold_batch:
+            return None
+        state.task = asyncio.create_task(self._fold(state, list(pending), render, summarize))
+        return state.task
+
+    async def _fold(self, state, pending, render, summarize):
+        transcript = "\n".join(render(message) for message in pending)
+        instruction = SUMMARY_INSTRUCTION.format(max_words=self.summary_words)
+        try:
+            with METRICS.timed("llm_summary"):
+                text = await summarize(instruction, summary_prompt(state.text, transcript, self.summary_words))
+        except Exception as e:
+            METRICS.inc("llm_summary_failed")
+            tprint("chat_summary_failed", error=e)
+            return
+        if text and text.strip():
+            state.text = text.strip()
+            state.last_id = pending[-1].id
@@ -1,10 +1,17 @@
+import asyncio
+import threading
+import time
 import pytomlpp as toml
 from pathlib import Path
 import re
+from chat_context import ContextBuilder, estimate_tokens, record_prompt_usage
+from metrics import METRICS
+from translation_utils import tprint
 working = False
 try:
     from google import genai
     from google.genai import types
+    from google.genai import errors as genai_errors
     working = True
 except ImportError:
     print("Error: Google GenAI library not found.")
@@ -18,6 +25,7 @@ repl = "bot: "
 """
 
 IMG = ('png', 'jpg', 'jpeg', 'gif', 'webp')
+SUMMARY_MAX_TOKENS = 384
 
 async def handle_pings(msg):
     # Regex to find all <@id> patterns
@@ -38,12 +46,103 @@ async def handle_pings(msg):
         return id_to_name.get(uid, f"@unknown")
     return pattern.sub(repl, msg.content)
 
+def safety_settings():
+    return [
+        types.SafetySetting(category=category, threshold=types.HarmBlockThreshold.BLOCK_NONE)
+        for category in (
+            types.HarmCategory.HARM_CATEGORY_HATE_SPEECH,
+            types.HarmCategory.HARM_CATEGORY_HARASSMENT,
+            types.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT,
+            types.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT,
+            types.HarmCategory.HARM_CATEGORY_CIVIC_INTEGRITY,
+        )
+    ]
+
+def is_cache_error(error) -> bool:
+    """True if a request failed because its cached content is gone or unusable, not because the API is struggling."""
+    if not working or not isinstance(error, genai_errors.APIError):
+        return False
+    if error.status == "NOT_FOUND" or error.code == 404:
+        return True
+    return (error.status == "INVALID_ARGUMENT" or error.code == 400) and "cache" in str(error).lower()
+
+class PromptCache:
+    """
+    Keeps the personality prompt in a Gemini cached content, so it is not processed again
+    on every request. The TTL is extended while the bot keeps chatting and the cache is
+    recreated once it has expired; if creating it fails (e.g. the prompt is under the
+    model's minimum) requests go without it until `retry_delay` has passed. A cache that
+    is replaced while still alive is deleted, since it is billed until its TTL runs out.
+    get() and invalidate() block and are called from worker threads.
+    """
+    def __init__(self, client, model_name, system_instruction, ttl=3600, retry_delay=None):
+        self.client = client
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+        self.ttl = ttl
+        self.retry_delay = retry_delay or ttl
+        self.name = None
+        self.expires_at = 0.0
+        self.retry_at = 0.0
+        self._lock = threading.Lock() # concurrent channels would otherwise each create a cache
+
+    def get(self):
+        """Name of a live cached content for the prompt, or None to send it uncached."""
+        with self._lock:
+            return self._get()
+
+    def _get(self):
+        now = time.time()
+        if self.name is not None and now < self.expires_at - self.ttl / 4:
+            return self.name
+        if now < self.retry_at:
+            return None
+        try:
+            if self.name is not None and now < self.expires_at:
+                self.client.caches.update(name=self.name, config=types.UpdateCachedContentConfig(ttl=f"{self.ttl}s"))
+                METRICS.inc("llm_prompt_cache_refresh", provider="gemini", action="extend")
+            else:
+                self._drop()
+                cache = self.client.caches.create(
+                    model=self.model_name,
+                    config=types.CreateCachedContentConfig(
+                        display_name="pichan-personality",
+                        system_instruction=self.system_instruction,
+                        ttl=f"{self.ttl}s",
+                    )
+                )
+                self.name = cache.name
+                METRICS.inc("llm_prompt_cache_refresh", provider="gemini", action="create")
+            self.expires_at = now + self.ttl
+        except Exception as e:
+            tprint("prompt_cache_failed", provider="gemini", error=e)
+            self._drop()
+            self.retry_at = now + self.retry_delay
+        return self.name
+
+    def _drop(self):
+        name, self.name = self.name, None
+        if name is not None and time.time() < self.expires_at:
+            try:
+                self.client.caches.delete(name=name)
+            except Exception:
+                pass # already gone, or it expires with its TTL
+
+    def invalidate(self):
+        """Forget (and delete) the current cache after a request reported it unusable."""
+        with self._lock:
+            self._drop()
+
 class ChatModule:
-    def __init__(self, model_name="gemini-2.0-flash", api_key=None, personality=None, vision=False):
+    def __init__(self, model_name="gemini-2.0-flash", api_key=None, personality=None, vision=False, context=None,
+                 cache_ttl=3600, cache_min_tokens=1024, base_url=None):
         self.vision = vision
         if not working:
             raise ImportError("Google GenAI library is not available.")
-        self.client = genai.Client(api_key=api_key)
+        if base_url: # e.g. a proxy or benchmarks/mock_llm_server.py
+            self.client = genai.Client(api_key=api_key, http_options=types.HttpOptions(base_url=base_url))
+        else:
+            self.client = genai.Client(api_key=api_key)
         self.model_name = model_name
         if personality is None:
             self.personality = toml.loads(BASE)
@@ -53,11 +152,25 @@ class ChatModule:
                 personality_path = Path(personality)
             self.personality = toml.loads(personality_path.read_text())
         self.triggers = self.personality['triggers']
-    async def preprocess(self, messages, uid):
+        self.context = context or ContextBuilder()
+        self.definition_tokens = estimate_tokens(self.personality['definition'])
+        self.prompt_cache = None
+        if cache_ttl and self.definition_tokens >= cache_min_tokens:
+            self.prompt_cache = PromptCache(self.client, model_name, self.personality['definition'], ttl=cache_ttl)
+    def render(self, message, uid):
+        """One transcript line for the rolling summary."""
+        name = message.author.global_name if message.author.id != uid else self.personality['name']
+        text = message.clean_content.strip() or "[image]"
+        return f"{name}: {text}"
+    async def preprocess(self, messages, uid, summary=None):
         if not messages:
             raise ValueError("Messages cannot be empty.")
         
         contents = []
+        if summary:
+            contents.append(types.Content(parts=[types.Part.from_text(
+                text=f"[Summary of the earlier conversation]\n{summary}",
+            )], role="user"))
         for message in messages:
             tp = []
             if message.attachments and self.vision:
@@ -84,38 +197,42 @@ class ChatModule:
             contents.append(types.Content(parts=tp, role=role))
         return contents
 
+    def chat_config(self, cache_name):
+        """The personality goes first, either as the cached content or as the system instruction."""
+        if cache_name is not None:
+            return types.GenerateContentConfig(cached_content=cache_name,
+                                            max_output_tokens=256,
+                                            safety_settings=safety_settings())
+        return types.GenerateContentConfig(system_instruction=self.personality['definition'],
+                                        max_output_tokens=256,
+                                        safety_settings=safety_settings())
     async def chat(self, contents):
         if not contents:
             raise ValueError("Contents cannot be empty.")
         
-        response = self.client.models.generate_content(
-            model=self.model_name,
-            config=types.GenerateContentConfig(system_instruction=self.personality['definition'],
-                                            max_output_tokens=256,
-                                            safety_settings=[
-        types.SafetySetting(
-            category=types.HarmCategory.HARM_CATEGORY_HATE_SPEECH,
-            threshold=types.HarmBlockThreshold.BLOCK_NONE,
-        ),
-        types.SafetySetting(
-            category=types.HarmCategory.HARM_CATEGORY_HARASSMENT,
-            threshold=types.HarmBlockThreshold.BLOCK_NONE,
-        ),
-        types.SafetySetting(
-            category=types.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT,
-            threshold=types.HarmBlockThreshold.BLOCK_NONE,
-        ),
-        types.SafetySetting(
-            category=types.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT,
-            threshold=types.HarmBlockThreshold.BLOCK_NONE,
-        ),
-        types.SafetySetting(
-            category=types.HarmCategory.HARM_CATEGORY_CIVIC_INTEGRITY,
-            threshold=types.HarmBlockThreshold.BLOCK_NONE,
-        ),
-        ]),
-            contents=contents
-        )
+        # The SDK calls block, so they run in a worker thread and other channels (or a hedged request) keep going
+        cache_name = await asyncio.to_thread(self.prompt_cache.get) if self.prompt_cache is not None else None
+        try:
+            response = await asyncio.to_thread(
+                self.client.models.generate_content,
+                model=self.model_name,
+                config=self.chat_config(cache_name),
+                contents=contents
+            )
+        except Exception as e:
+            # Only a broken cache is worth an immediate second request; overloads and timeouts propagate to the router
+            if cache_name is None or not is_cache_error(e):
+                raise
+            await asyncio.to_thread(self.prompt_cache.invalidate) # deleted or expired server-side, retry with the plain prompt
+            response = await asyncio.to_thread(
+                self.client.models.generate_content,
+                model=self.model_name,
+                config=self.chat_config(None),
+                contents=contents
+            )
+        usage = response.usage_metadata
+        if usage is not None:
+            record_prompt_usage("gemini", usage.prompt_token_count, usage.cached_content_token_count)
         
         txt = response.text.strip()
         temp = txt.split(':')
@@ -124,7 +241,19 @@ class ChatModule:
             txt = ':'.join(temp[1:]).strip()
         txt = txt.replace('&#x20;', ' ')
         return txt
+    async def summarize(self, instruction, prompt):
+        response = await asyncio.to_thread(
+            self.client.models.generate_content,
+            model=self.model_name,
+            config=types.GenerateContentConfig(system_instruction=instruction,
+                                            max_output_tokens=SUMMARY_MAX_TOKENS,
+                                            safety_settings=safety_settings()),
+            contents=prompt
+        )
+        return response.text
     async def chat_with_messages(self, messages, uid):
-        contents = await self.preprocess(messages, uid)
+        summary, recent, pending = self.context.assemble(messages, self.definition_tokens, self.vision)
+        contents = await self.preprocess(recent, uid, summary)
+        self.context.schedule_fold(pending, lambda message: self.render(message, uid), self.summarize)
         return await self.chat(contents)
 
@@ -1,6 +1,8 @@
+import asyncio
 import pytomlpp as toml
 from pathlib import Path
 import re
+from chat_context import ContextBuilder, estimate_tokens, record_prompt_usage
 working = False
 try:
     import openai
@@ -17,6 +19,8 @@ repl = "bot: "
 """
 
 IMG = ('png', 'jpg', 'jpeg', 'gif', 'webp')
+DEFAULT_BASE_URL = "https://openrouter.ai/api/v1"
+SUMMARY_MAX_TOKENS = 384
 
 async def handle_pings(msg):
     pattern = re.compile(r"<@(\d+)>")
@@ -34,12 +38,12 @@ async def handle_pings(msg):
     return pattern.sub(repl, msg.content)
 
 class ChatModule:
-    def __init__(self, model_name="gpt-3.5-turbo", api_key=None, personality=None, vision=False):
+    def __init__(self, model_name="gpt-3.5-turbo", api_key=None, personality=None, vision=False, context=None, base_url=None):
         self.vision = vision
         if api_key is None:
             raise ValueError("API key must be provided.")
         self.client = openai.Client(
-            base_url="https://openrouter.ai/api/v1",
+            base_url=base_url or DEFAULT_BASE_URL,
             api_key=api_key
         )
         self.model_name = model_name
@@ -51,7 +55,14 @@ class ChatModule:
                 personality_path = Path(personality)
             self.personality = toml.loads(personality_path.read_text())
         self.triggers = self.personality['triggers']
-    async def preprocess(self, messages, uid):
+        self.context = context or ContextBuilder()
+        self.definition_tokens = estimate_tokens(self.personality['definition'])
+    def render(self, message, uid):
+        """One transcript line for the rolling summary."""
+        name = message.author.global_name if message.author.id != uid else self.personality['name']
+        text = message.clean_content.strip() or "[image]"
+        return f"{name}: {text}"
+    async def preprocess(self, messages, uid, summary=None):
         if not messages:
             raise ValueError("Messages cannot be empty.")
         chat_messages = []
@@ -70,23 +81,41 @@ class ChatModule:
                 cont.append({"type": "text", "text": f"{name}: {msgcont}"})
             if cont:
                 chat_messages.append({"role": role, "content": cont})
-        # Add system prompt at the start
+        # Add system prompt (and the summary of older messages) at the start; keeping this prefix
+        # byte-identical between turns lets the provider reuse its prompt cache
+        if summary:
+            chat_messages.insert(0, {"role": "system", "content": f"[Summary of the earlier conversation]\n{summary}"})
         chat_messages.insert(0, {"role": "system", "content": self.personality['definition']})
         return chat_messages
     async def chat(self, chat_messages):
         if not chat_messages:
             raise ValueError("Contents cannot be empty.")
-        response = self.client.chat.completions.create(
+        response = await asyncio.to_thread( # blocking SDK call, keep the event loop free
+            self.client.chat.completions.create,
             model=self.model_name,
             messages=chat_messages,
             max_tokens=768,
         )
+        usage = getattr(response, 'usage', None)
+        if usage is not None:
+            details = getattr(usage, 'prompt_tokens_details', None)
+            record_prompt_usage("openai", usage.prompt_tokens, getattr(details, 'cached_tokens', 0))
         txt = response.choices[0].message.content.strip()
         temp = txt.split(':')
         if len(temp) > 1 and temp[0].strip().lower() == self.personality['repl'].strip().lower():
             txt = ':'.join(temp[1:]).strip()
         txt = txt.replace('&#x20;', ' ')
         return txt
+    async def summarize(self, instruction, prompt):
+        response = await asyncio.to_thread(
+            self.client.chat.completions.create,
+            model=self.model_name,
+            messages=[{"role": "system", "content": instruction}, {"role": "user", "content": prompt}],
+            max_tokens=SUMMARY_MAX_TOKENS,
+        )
+        return response.choices[0].message.content
     async def chat_with_messages(self, messages, uid):
-        chat_messages = await self.preprocess(messages, uid)
+        summary, recent, pending = self.context.assemble(messages, self.definition_tokens, self.vision)
+        chat_messages = await self.preprocess(recent, uid, summary)
+        self.context.schedule_fold(pending, lambda message: self.render(message, uid), self.summarize)
         return await self.chat(chat_messages)
@@ -0,0 +1,149 @@
+"""Failover and hedging across chatbot providers for PI-Chan"""
+import asyncio
+import time
+from collections import deque
+from metrics import METRICS
+
+class ProviderStats:
+    """Rolling latency / error window for one provider, plus a simple circuit breaker."""
+    def __init__(self, name: str, window: int = 100):
+        self.name = name
+        self.latencies = deque(maxlen=window) # seconds, successful calls only
+        self.outcomes = deque(maxlen=window) # True = ok
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+        self.last_error = None
+
+    def record(self, seconds: float, ok: bool, failure_threshold: int, cooldown: float, error=None):
+        self.outcomes.append(ok)
+        if ok:
+            self.latencies.append(seconds)
+            self.consecutive_failures = 0
+            return
+        self.last_error = error
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= failure_threshold: # after a cooldown, one more failure re-trips it
+            self.cooldown_until = time.monotonic() + cooldown
+
+    def quantile(self, q: float):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+    def error_rate(self) -> float:
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+    @property
+    def cooling_down(self) -> bool:
+        return time.monotonic() < self.cooldown_until
+
+    def health(self) -> dict:
+        return {
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "error_rate": self.error_rate(),
+            "calls": len(self.outcomes),
+            "cooling_down": self.cooling_down,
+            "last_error": str(self.last_error) if self.last_error else None,
+        }
+
+class ProviderRouter:
+    """
+    Sends chatbot requests to one of several ChatModules (behaves like a ChatModule itself).
+
+    Providers are tried in configured order; one that tripped the circuit breaker
+    (`failure_threshold` errors in a row) goes last for `cooldown` seconds, then gets
+    one trial request back in its place. An error fails over to the next provider. With
+    `hedge` on, a second provider is also asked once the first has been running longer
+    than its own p90 latency, and whichever answers first wins.
+
+    `providers` is a list of (name, LazyBackend); providers that aren't ready are skipped.
+    """
+    def __init__(self, providers, hedge: bool = False, hedge_min_delay: float = 1.0, hedge_default_delay: float = 8.0,
+                 window: int = 100, failure_threshold: int = 3, cooldown: float = 60.0):
+        self.providers = providers
+        self.stats = {name: ProviderStats(name, window) for name, _ in providers}
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_default_delay = hedge_default_delay
+        self.min_samples = 20 # before this many calls the p90 is too noisy to hedge on
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+
+    def ready(self):
+        """[(name, ChatModule)] in preference order."""
+        ready = [(index, name, backend.value) for index, (name, backend) in enumerate(self.providers) if backend.value is not None]
+        ready.sort(key=lambda item: (self.stats[item[1]].cooling_down, item[0]))
+        return [(name, module) for _, name, module in ready]
+
+    @property
+    def triggers(self):
+        ready = self.ready()
+        return getattr(ready[0][1], 'triggers', []) if ready else []
+
+    def hedge_delay(self, name: str) -> float:
+        stats = self.stats[name]
+        if len(stats.latencies) < self.min_samples:
+            return self.hedge_default_delay
+        return max(stats.quantile(0.9), self.hedge_min_delay)
+
+    async def _call(self, name, module, messages, uid):
+        started = time.perf_counter()
+        try:
+            result = await module.chat_with_messages(messages, uid)
+        except asyncio.CancelledError:
+            raise # lost a hedge race, not the provider's fault
+        except Exception as e:
+            elapsed = time.perf_counter() - started
+            self.stats[name].record(elapsed, False, self.failure_threshold, self.cooldown, e)
+            METRICS.inc("llm_provider_errors", provider=name)
+            raise
+        elapsed = time.perf_counter() - started
+        self.stats[name].record(elapsed, True, self.failure_threshold, self.cooldown)
+        METRICS.observe("llm_provider", elapsed, provider=name)
+        return result
+
+    async def chat_with_messages(self, messages, uid):
+        queue = self.ready()
+        if not queue:
+            raise RuntimeError("no chat provider is ready")
+        pending = {} # task -> provider name
+        first = queue[0][0]
+        deadline = time.monotonic() + self.hedge_delay(first)
+        hedged = False
+        last_error = None
+
+        def launch():
+            name, module = queue.pop(0)
+            pending[asyncio.create_task(self._call(name, module, messages, uid))] = name
+
+        launch()
+        try:
+            while pending:
+                timeout = None
+                if self.hedge and queue and not hedged:
+                    timeout = max(deadline - time.monotonic(), 0)
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done: # the first provider is slower than its p90: ask the next one too
+                    hedged = True
+                    METRICS.inc("llm_router", action="hedge", provider=first)
+                    launch()
+                    continue
+                for task in done:
+                    name = pending.pop(task)
+                    if task.exception() is None:
+                        if name != first:
+                            METRICS.inc("llm_router", action="hedge_won" if hedged else "failover_ok", provider=name)
+                        return task.result()
+                    last_error = task.exception()
+                if not pending and queue:
+                    METRICS.inc("llm_router", action="failover", provider=queue[0][0])
+                    launch()
+            raise last_error
+        finally:
+            for task in pending: # the losing request's thread still finishes; its answer is dropped
+                task.cancel()
+
+    def health(self) -> dict:
+        return {name: self.stats[name].health() for name, _ in self.providers}
@@ -1,200 +1,22 @@
 # comfy_parser.py made by nenya
 import json
+import os
+import tempfile
+import time
+from pathlib import Path
+import pytomlpp as toml
+from cache_utils import LRUCache
 
 # --- Constants ---
 COMFY_METADATA_PROPAGATE_NONE = True # If a node required for propagation is None, stop propagation
+# Rule packs (TOML/JSON) describing how nodes propagate values and which nodes are samplers
+RULE_PACK_DIRS = [Path(__file__).with_name('comfy_rules')]
+RULES_CACHE_PATH = Path(__file__).with_name('.comfy_rules.cache')
+RULES_RELOAD_INTERVAL = 2.0 # seconds between checks of the rule pack files
+RULES_FORMAT_VERSION = 2
+RULES_MEMO_SIZE = 1024 # substring lookups remembered per compiled rule set
 
 # --- Data Structures ---
-comfy_nodes_propagation_data = [
-    # ... (Keep the entire list from the original code here) ...
-    {
-        "class_type": 'TagSeparator',
-        "mapping": {
-            0: "pos_prompt",
-            1: "neg_prompt",
-        }
-    },
-    {
-        "class_type": {
-            "operation_type": "any_of_inputs",
-            "operation_input": [
-                'ModelSamplingWaifuDiffusionV',
-                'Mahiro',
-                'ModelSamplingFlux',
-                'IPAdapterUnifiedLoader',
-                'IPAdapterAdvanced',
-                'IPAdapter',
-                'ApplyFluxIPAdapter',
-                'ApplyAdvancedFluxIPAdapter',
-                'IPAdapterAdvanced',
-            ],
-        },
-        "mapping": {
-            0: "model",
-        }
-    },
-    {
-        "class_type": {
-            "operation_type": "any_of_inputs",
-            "operation_input": [
-                'ModelMergeSimple',
-                'ModelMergeAdd',
-                'ModelMergeSubstract',
-            ],
-        },
-        "mapping": {
-            0: {
-                "operation_type": "format",
-                "keys_to_use": ["model1", "model2"],
-                "operation_input": "{model1} [+] {model2}",
-            },
-        }
-    },
-    {
-        "class_type": {
-            "operation_type": "any_of_inputs",
-            "operation_input": [
-                'CheckpointLoaderSimple',
-                'Checkpoint Loader',
-            ],
-        },
-        "mapping": {
-            0: "ckpt_name",
-        }
-    },
-    {
-        "class_type": {
-            "operation_type": "any_of_inputs",
-            "operation_input": [
-                'UnetLoaderGGUF',
-                'UNETLoader',
-                'UnetLoaderGGUFAdvanced',
-            ],
-        },
-        "mapping": {
-            0: "unet_name"
-        }
-    },
-    {
-        "class_type": 'CLIPTextEncode',
-        "mapping": {
-            0: "text",
-            1: "clip",
-        }
-    },
-    {
-        "class_type": 'Seed',
-        "mapping": {
-            0: 'seed',
-        }
-    },
-    {
-        "class_type": 'KSampler',
-        "mapping": {
-            0: 'latent_image',
-        }
-    },
-    {
-        "class_type": 'VAEEncode',
-        "mapping": {
-            0: 'pixels',
-        }
-    },
-    {
-        "class_type": 'LatentBlend',
-        "mapping": {
-            0: 'samples1',
-        }
-    },
-    {
-        "class_type": 'VAEDecode',
-        "mapping": {
-            0: 'samples',
-        }
-    },
-    {
-        "class_type": 'ImageBlend',
-        "mapping": {
-            0: 'image1',
-        }
-    },
-    {
-        "class_type": {
-            "operation_type": "any_of_inputs",
-            "operation_input": [
-                'ImageScaleBy',
-                'ImageUpscaleWithModel',
-            ],
-        },
-        "mapping": {
-            0: 'image',
-        }
-    },
-    {
-        "class_type": 'EmptyLatentImage',
-        "mapping": {
-            0: {
-                "operation_type": "format",
-                "keys_to_use": ["width", "height"],
-                "operation_input": "{width} x {height}",
-            },
-        }
-    },
-    {
-        "class_type": 'LoraLoader',
-        "mapping": {
-            0: {
-                "operation_type": "format",
-                "keys_to_use": ["model", "lora_name", 'strength_model'],
-                "operation_input": "{model}\n+ LoRA: <{lora_name}:{strength_model}>",
-            }
-        }
-    },
-]
-
-target_comfy_nodes = [
-    # ... (Keep the entire list from the original code here) ...
-    {
-        "class_type": {
-            "operation_type": "any_of_inputs",
-            "operation_input": [
-                'KSampler',
-                'KSampler (WAS)',
-            ]
-        },
-        "inputs": [
-            "model",
-            "positive",
-            "negative",
-            "latent_image",
-            "sampler_name",
-            "scheduler",
-            "cfg",
-            "steps",
-            "seed",
-        ]
-    },
-    {
-        "class_type": {
-            "operation_type": "any_of_inputs",
-            "operation_input": [
-                'KSamplerAdvanced',
-            ]
-        },
-        "inputs": [
-            "model",
-            "positive",
-            "negative",
-            "latent_image",
-            "sampler_name",
-            "scheduler",
-            "cfg",
-            "steps",
-            "noise_seed",
-        ]
-    },
-]
-
 format_of_comfy_fields_to_types = {
     # ... (Keep the entire dict from the original code here) ...
     'models': ['{model}'],
@@ -205,6 +27,11 @@ format_of_comfy_fields_to_types = {
     'seeds': ['{seed}', '{noise_seed}'],
 }
 
+# Nodes that only forward their input in the UI graph
+UI_PASSTHROUGH_TYPES = {'Reroute'}
+UI_MODE_MUTED = 2
+UI_MODE_BYPASSED = 4
+
 comfy_fields_pretty_names = {
     # ... (Keep the entire dict from the original code here) ...
     'models': "Model",
@@ -215,6 +42,180 @@ comfy_fields_pretty_names = {
     'seeds': "Seed",
 }
 
+# --- Rule Packs ---
+class CompiledRules:
+    """
+    Rule packs compiled into dict lookups keyed by class type.
+    propagation: class type -> {output slot: input key | format operation}
+    targets:     class type -> {'inputs': [...], 'paths': {param: [[input, input, ...], ...]}}
+    widgets:     class type -> widget names (UI-format workflows)
+    outputs:     class types that end up in the saved image
+    Substring matches (class_type_contains) are checked after an exact miss and memoized
+    in a bounded LRU, since class types come straight from uploaded workflows.
+    """
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.propagation = {}
+        self.targets = {}
+        self.widgets = {}
+        self.outputs = set()
+        self.contains = {'propagation': [], 'targets': []} # [(lowercase substring, rule)]
+        self._memo = LRUCache(RULES_MEMO_SIZE)
+
+    def lookup(self, table: str, class_type):
+        exact = getattr(self, table)
+        if class_type in exact:
+            return exact[class_type]
+        key = (table, class_type)
+        if key not in self._memo:
+            lowered = class_type.lower() if isinstance(class_type, str) else ""
+            self._memo.put(key, next((rule for needle, rule in self.contains[table] if needle in lowered), None))
+        return self._memo.get(key)
+
+    def to_json(self) -> str:
+        return json.dumps({
+            'fingerprint': self.fingerprint,
+            'propagation': self.propagation,
+            'targets': self.targets,
+            'widgets': self.widgets,
+            'outputs': sorted(self.outputs),
+            'contains': self.contains,
+        })
+
+    @classmethod
+    def from_json(cls, text: str) -> 'CompiledRules':
+        data = json.loads(text)
+        rules = cls(_freeze(data['fingerprint']))
+        # JSON object keys are strings; propagation mappings are keyed by output slot
+        rules.propagation = {class_type: {int(slot): rule for slot, rule in mapping.items()}
+                             for class_type, mapping in data['propagation'].items()}
+        rules.targets = data['targets']
+        rules.widgets = data['widgets']
+        rules.outputs = set(data['outputs'])
+        rules.contains = {
+            'propagation': [(needle, {int(slot): rule for slot, rule in mapping.items()})
+                            for needle, mapping in data['contains']['propagation']],
+            'targets': [(needle, rule) for needle, rule in data['contains']['targets']],
+        }
+        return rules
+
+def _freeze(value):
+    """Lists back to tuples, so a fingerprint read from JSON compares equal to a fresh one."""
+    return tuple(_freeze(item) for item in value) if isinstance(value, list) else value
+
+def _rule_pack_files():
+    files = []
+    for directory in RULE_PACK_DIRS:
+        directory = Path(directory)
+        if directory.is_dir():
+            files.extend(sorted(path for path in directory.iterdir() if path.suffix in ('.toml', '.json')))
+    return files
+
+def rule_pack_fingerprint():
+    """Changes whenever a rule pack file is added, removed or modified."""
+    fingerprint = [RULES_FORMAT_VERSION]
+    for path in _rule_pack_files():
+        stat = path.stat()
+        fingerprint.append((str(path), stat.st_mtime_ns, stat.st_size))
+    return tuple(fingerprint)
+
+def _compile_mapping(mapping, source):
+    compiled = {}
+    for slot, rule in mapping.items():
+        if isinstance(rule, str):
+            compiled[int(slot)] = rule
+        elif isinstance(rule, dict) and 'format' in rule:
+            compiled[int(slot)] = {
+                "operation_type": "format",
+                "keys_to_use": list(rule.get('keys', [])),
+                "operation_input": rule['format'],
+            }
+        else:
+            raise ValueError(f"{source}: invalid mapping for slot {slot}: {rule!r}")
+    return compiled
+
+def compile_rule_packs(packs, fingerprint=None) -> CompiledRules:
+    """Compiles [(source name, pack dict)] in order; later packs override earlier ones."""
+    rules = CompiledRules(fingerprint)
+    for source, pack in packs:
+        rules.outputs.update(pack.get('outputs', []))
+        rules.widgets.update(pack.get('widgets', {}))
+        for section, table in (('propagate', 'propagation'), ('target', 'targets')):
+            for entry in pack.get(section, []):
+                if section == 'propagate':
+                    rule = _compile_mapping(entry.get('mapping', {}), source)
+                else:
+                    rule = {'inputs': list(entry.get('inputs', [])), 'paths': dict(entry.get('paths', {}))}
+                if not entry.get('class_types') and not entry.get('class_type_contains'):
+                    raise ValueError(f"{source}: {section} entry without class_types")
+                for class_type in entry.get('class_types', []):
+                    getattr(rules, table)[class_type] = rule
+                for needle in entry.get('class_type_contains', []):
+                    rules.contains[table].insert(0, (needle.lower(), rule)) # later packs take precedence
+    return rules
+
+def load_rule_packs(fingerprint=None) -> CompiledRules:
+    """Compiled rules for the current pack files, from the on-disk cache when it is still valid."""
+    fingerprint = fingerprint or rule_pack_fingerprint()
+    try:
+        cached = CompiledRules.from_json(RULES_CACHE_PATH.read_text(encoding='utf-8'))
+        if cached.fingerprint == fingerprint:
+            return cached
+    except Exception:
+        pass # missing, stale or unreadable cache: just recompile
+
+    packs = []
+    for path in _rule_pack_files():
+        text = path.read_text(encoding='utf-8')
+        packs.append((path.name, json.loads(text) if path.suffix == '.json' else toml.loads(text)))
+    rules = compile_rule_packs(packs, fingerprint)
+    tmp_path = None
+    try:
+        # Every worker recompiles after a pack edit, so each writes its own temp file
+        fd, tmp_path = tempfile.mkstemp(dir=RULES_CACHE_PATH.parent, prefix=RULES_CACHE_PATH.name + '.', suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(rules.to_json())
+        os.replace(tmp_path, RULES_CACHE_PATH)
+    except OSError:
+        if tmp_path is not None:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+        # read-only install, compile again next time
+    return rules
+
+_rules = None
+_rules_checked = 0.0
+_rules_failed_fingerprint = None
+
+def current_rules() -> CompiledRules:
+    """
+    The active compiled rules. Pack files are re-checked every RULES_RELOAD_INTERVAL
+    seconds; a changed pack is compiled fully before being swapped in, and a broken
+    one leaves the previous rules active.
+    """
+    global _rules, _rules_checked, _rules_failed_fingerprint
+    now = time.monotonic()
+    if _rules is not None and now - _rules_checked < RULES_RELOAD_INTERVAL:
+        return _rules
+    _rules_checked = now
+    fingerprint = rule_pack_fingerprint()
+    if _rules is not None and fingerprint in (_rules.fingerprint, _rules_failed_fingerprint):
+        return _rules
+    try:
+        new_rules = load_rule_packs(fingerprint)
+    except Exception as e:
+        _rules_failed_fingerprint = fingerprint
+        print(f"Warning: Could not load ComfyUI rule packs, keeping the previous rules: {e}")
+        if _rules is None:
+            _rules = CompiledRules(None)
+        return _rules
+    if _rules is not None:
+        print(f"Reloaded ComfyUI rule packs ({len(new_rules.propagation)} propagation, {len(new_rules.targets)} target rules).")
+    _rules = new_rules
+    return _rules
+
 # --- Helper Functions ---
 def custom_operation(operation_data, input_object):
     """Performs custom operations defined in the mapping data."""
@@ -239,33 +240,84 @@ def custom_operation(operation_data, input_object):
         print(f"Warning: Unknown custom operation type: {op_type}")
         return None # Or raise an error
 
-def resolve_class_type(node_type, list_of_formats):
-    """Finds the matching format definition for a given node class type."""
-    for node_format in list_of_formats:
-        class_type_def = node_format['class_type']
-        if isinstance(class_type_def, str):
-            if class_type_def == node_type:
-                return node_format
-        elif isinstance(class_type_def, dict): # Custom operation
-            if custom_operation(class_type_def, node_type):
-                return node_format
-        else:
-            print(f"Warning: Unknown class_type format: {class_type_def}")
-
-    return None
-
 def is_comfy_link(obj):
     """Checks if an object represents a ComfyUI node link."""
     return isinstance(obj, list) and len(obj) == 2 and isinstance(obj[0], str) and isinstance(obj[1], int)
 
-def resolve_bypasses(comfy_link, workflow_data):
-    """Recursively resolves links through bypass/passthrough nodes."""
+def upstream_nodes(node_details, workflow_data):
+    """Ids of the nodes feeding a node's inputs (its edges, walked backwards)."""
+    return [value[0] for value in node_details.get('inputs', {}).values()
+            if is_comfy_link(value) and value[0] in workflow_data]
+
+def find_target_nodes(workflow_data, rules=None):
+    """
+    Returns [(node_id, target_rule)] for the sampler nodes that actually feed an output,
+    nearest to the output first. Walks backwards from the output nodes, indexing only the
+    nodes it reaches, so preview branches, preprocessors and other dead ends are never
+    visited. Falls back to every sampler in the workflow when no output reaches one.
+    """
+    rules = rules or current_rules()
+    outputs = [node_id for node_id, node_details in workflow_data.items()
+               if isinstance(node_details, dict) and node_details.get('class_type') in rules.outputs]
+    distances = {node_id: 0 for node_id in outputs}
+    queue = list(outputs)
+    targets = []
+    for node_id in queue: # breadth-first, so distances are shortest
+        node_details = workflow_data[node_id]
+        if not isinstance(node_details, dict):
+            continue
+        target_rule = rules.lookup('targets', node_details.get('class_type'))
+        if target_rule is not None:
+            targets.append((node_id, target_rule))
+        for source_id in upstream_nodes(node_details, workflow_data):
+            if source_id not in distances:
+                distances[source_id] = distances[node_id] + 1
+                queue.append(source_id)
+    if targets:
+        return targets
+
+    for node_id, node_details in workflow_data.items():
+        if isinstance(node_details, dict) and 'class_type' in node_details:
+            target_rule = rules.lookup('targets', node_details['class_type'])
+            if target_rule is not None:
+                targets.append((node_id, target_rule))
+    return targets
+
+def resolve_path(node_details, path, workflow_data, memo=None, rules=None):
+    """
+    Follows a path of input names from a node: every name but the last is a link to
+    step through, the last input is resolved like any other (see resolve_bypasses).
+    """
+    for input_key in path[:-1]:
+        link = node_details.get('inputs', {}).get(input_key)
+        if not is_comfy_link(link) or not isinstance(workflow_data.get(link[0]), dict):
+            return None
+        node_details = workflow_data[link[0]]
+    if path[-1] not in node_details.get('inputs', {}):
+        return None
+    return resolve_bypasses(node_details['inputs'][path[-1]], workflow_data, memo, rules)
+
+def resolve_bypasses(comfy_link, workflow_data, memo=None, rules=None):
+    """
+    Recursively resolves links through bypass/passthrough nodes.
+    `memo` caches results per link, so chains shared by several samplers are only walked once.
+    """
     if comfy_link is None:
         return None
 
     if not is_comfy_link(comfy_link):
         return comfy_link # Value is not a link, return as is
 
+    rules = rules or current_rules()
+    if memo is None:
+        return _resolve_link(comfy_link, workflow_data, None, rules)
+    key = (comfy_link[0], comfy_link[1])
+    if key not in memo:
+        memo[key] = None # also stops cycles
+        memo[key] = _resolve_link(comfy_link, workflow_data, memo, rules)
+    return memo[key]
+
+def _resolve_link(comfy_link, workflow_data, memo, rules):
     linked_node_id = comfy_link[0]
     linked_node_input_id = comfy_link[1]
 
@@ -282,14 +334,13 @@ def resolve_bypasses(comfy_link, workflow_data):
     linked_node_type = linked_node['class_type']
 
     # Find if this node type is defined for propagation
-    propagation_rule = resolve_class_type(linked_node_type, comfy_nodes_propagation_data)
-    if propagation_rule is None:
+    mapping = rules.lookup('propagation', linked_node_type)
+    if mapping is None:
         # This node type doesn't propagate, so we stop here (or maybe return an identifier?)
         # Depending on desired behavior, you might return None or something else.
         # For now, returning None as it signifies the end of this propagation path.
         return None
 
-    mapping = propagation_rule.get('mapping', {})
     # Check if the specific input ID has a mapping rule
     if linked_node_input_id not in mapping:
         # print(f"Warning: No mapping found for input ID {linked_node_input_id} in node type '{linked_node_type}'.")
@@ -303,7 +354,7 @@ def resolve_bypasses(comfy_link, workflow_data):
             # print(f"Warning: Mapped input key '{input_key_to_follow}' not found in node '{linked_node_id}'.")
             return None # The required input doesn't exist on the node
         new_link = linked_node['inputs'][input_key_to_follow]
-        return resolve_bypasses(new_link, workflow_data) # Recurse
+        return resolve_bypasses(new_link, workflow_data, memo, rules) # Recurse
 
     elif isinstance(mapping_result, dict): # Custom operation (like formatting)
         resolved_keys = {}
@@ -320,7 +371,7 @@ def resolve_bypasses(comfy_link, workflow_data):
                 resolved_keys[key] = f"{{{key}}}" # Use placeholder if not propagating None
                 continue # Skip resolving this key
 
-            resolved_value = resolve_bypasses(linked_node['inputs'][key], workflow_data)
+            resolved_value = resolve_bypasses(linked_node['inputs'][key], workflow_data, memo, rules)
             if COMFY_METADATA_PROPAGATE_NONE and resolved_value is None:
                 return None # Stop propagation if any required key resolves to None
             resolved_keys[key] = resolved_value if resolved_value is not None else f"{{{key}}}" # Use placeholder if None
@@ -332,6 +383,90 @@ def resolve_bypasses(comfy_link, workflow_data):
         print(f"Warning: Unknown mapping result type for node type '{linked_node_type}': {mapping_result}")
         return None
 
+def _ui_widget_names(node):
+    """Widget names for a UI node: the known list for its type, else the inputs the frontend marked as widgets."""
+    names = current_rules().widgets.get(node.get('type'))
+    if names is not None:
+        return names
+    names = []
+    for node_input in node.get('inputs') or []:
+        widget = node_input.get('widget')
+        if isinstance(widget, dict) and 'name' in widget:
+            names.append(widget['name'])
+            if widget['name'] in ('seed', 'noise_seed'):
+                names.append('control_after_generate')
+    return names
+
+def ui_workflow_to_prompt(workflow: dict) -> dict:
+    """
+    Converts the UI-format "workflow" chunk (nodes + links arrays) into the API-format
+    prompt dict the rest of this module works on, in one pass over nodes and links.
+    Links are indexed by id; muted nodes are dropped and bypassed nodes / reroutes are
+    linked through to whatever feeds them.
+    """
+    nodes = {}
+    for node in workflow.get('nodes') or []:
+        if isinstance(node, dict) and 'id' in node:
+            nodes[node['id']] = node
+    links = {}
+    for link in workflow.get('links') or []:
+        if isinstance(link, list) and len(link) >= 5:
+            links[link[0]] = link # [id, origin_id, origin_slot, target_id, target_slot, type]
+        elif isinstance(link, dict) and 'id' in link: # newer frontends save links as objects
+            links[link['id']] = [link['id'], link.get('origin_id'), link.get('origin_slot'), link.get('target_id'), link.get('target_slot'), link.get('type')]
+
+    def link_source(link_id, seen=()):
+        """(origin id, slot) for a link, skipping over bypassed nodes and reroutes."""
+        link = links.get(link_id)
+        if link is None or link[1] not in nodes or link_id in seen:
+            return None
+        origin = nodes[link[1]]
+        if origin.get('type') in UI_PASSTHROUGH_TYPES or origin.get('mode') == UI_MODE_BYPASSED:
+            # Follow the first linked input of the same type (reroutes have a single untyped one)
+            for origin_input in origin.get('inputs') or []:
+                if origin_input.get('link') is not None and (origin.get('type') in UI_PASSTHROUGH_TYPES or origin_input.get('type') == link[5]):
+                    return link_source(origin_input['link'], seen + (link_id,))
+            return None
+        if origin.get('mode') == UI_MODE_MUTED:
+            return None
+        return link[1], link[2]
+
+    prompt = {}
+    for node_id, node in nodes.items():
+        if node.get('mode') in (UI_MODE_MUTED, UI_MODE_BYPASSED) or node.get('type') in UI_PASSTHROUGH_TYPES:
+            continue
+        inputs = {}
+        widget_values = node.get('widgets_values')
+        if isinstance(widget_values, dict): # some custom nodes save named widgets
+            inputs.update(widget_values)
+        elif isinstance(widget_values, list):
+            for name, value in zip(_ui_widget_names(node), widget_values):
+                if name != 'control_after_generate':
+                    inputs[name] = value
+        for node_input in node.get('inputs') or []:
+            name = node_input.get('name')
+            if name is None or node_input.get('link') is None:
+                continue
+            source = link_source(node_input['link'])
+            if source is None:
+                continue
+            if 'widget' in node_input and nodes[source[0]].get('type') == 'PrimitiveNode':
+                continue # the primitive's value is already mirrored into this node's widgets
+            inputs[name] = [str(source[0]), source[1]]
+        prompt[str(node_id)] = {'class_type': node.get('type'), 'inputs': inputs}
+    return prompt
+
+def convert_ui_workflow(workflow_json_str: str):
+    """JSON string of the API-format prompt for a UI-format workflow chunk, or None if it isn't one."""
+    try:
+        workflow = json.loads(workflow_json_str)
+    except (json.JSONDecodeError, TypeError):
+        return None
+    if not isinstance(workflow, dict) or not isinstance(workflow.get('nodes'), list):
+        return None
+    prompt = ui_workflow_to_prompt(workflow)
+    return json.dumps(prompt) if prompt else None
+
 # --- Main Parsing Function ---
 def comfyui_get_data(workflow_json_str: str) -> dict:
     """
@@ -351,32 +486,39 @@ def comfyui_get_data(workflow_json_str: str) -> dict:
             print("Warning: ComfyUI data is not a JSON object.")
             return [] # Expecting workflow to be a JSON object (dict)
 
+        rules = current_rules() # one snapshot per parse, even if a reload lands mid-way
         target_node_instances = {}
-        # First pass: Identify all instances of target node types
-        for node_id, node_details in workflow_data.items():
-            if node_details and 'class_type' in node_details:
-                target_format = resolve_class_type(node_details['class_type'], target_comfy_nodes)
-                if target_format is not None:
-                    # Store the node details along with the inputs we need to resolve
-                    target_node_instances[node_id] = {
-                        'details': node_details,
-                        'required_inputs': target_format.get('inputs', []),
-                        'resolved_params': {} # Initialize dict to store resolved values
-                    }
+        # First pass: Find the samplers that feed the saved image, nearest first
+        for node_id, target_rule in find_target_nodes(workflow_data, rules):
+            # Store the node details along with the inputs we need to resolve
+            target_node_instances[node_id] = {
+                'details': workflow_data[node_id],
+                'required_inputs': target_rule.get('inputs', []),
+                'paths': target_rule.get('paths', {}),
+                'resolved_params': {} # Initialize dict to store resolved values
+            }
 
         # Second pass: Resolve inputs for the identified target nodes
+        memo = {}
         for node_id, node_info in target_node_instances.items():
             node_details = node_info['details']
             node_inputs = node_details.get('inputs', {})
             for input_key in node_info['required_inputs']:
                 if input_key in node_inputs:
                     # Resolve the value for this input, tracing back through links
-                    resolved_value = resolve_bypasses(node_inputs[input_key], workflow_data)
+                    resolved_value = resolve_bypasses(node_inputs[input_key], workflow_data, memo, rules)
                     # Store the final resolved value (even if it's None or an error string)
                     node_info['resolved_params'][input_key] = resolved_value
                 # else:
                     # Optionally handle cases where a required input is missing entirely
                     # node_info['resolved_params'][input_key] = f"Error: Missing input {input_key}"
+            # Values held by helper nodes (guiders, schedulers, noise) are read through their paths
+            for param, paths in node_info['paths'].items():
+                for path in paths:
+                    resolved_value = resolve_path(node_details, path, workflow_data, memo, rules)
+                    if resolved_value is not None:
+                        node_info['resolved_params'][param] = resolved_value
+                        break
 
         # Third pass: Format the resolved parameters according to predefined rules
         results_by_type = {key: [] for key in format_of_comfy_fields_to_types}
@@ -408,10 +550,10 @@ def comfyui_get_data(workflow_json_str: str) -> dict:
                     val_str = val_str[:1020] + "..."
                 extracted_params.append({"type": pretty_name, "val": val_str})
 
-        # Fix before passing to PI-Chan
+        # Fix before passing to PI-Chan (the sampler nearest to the output wins)
         final = {}
         for param in extracted_params:
-            final[param['type']] = param['val']
+            final.setdefault(param['type'], param['val'])
             
         return final
 
@@ -0,0 +1,98 @@
+"""Config persistence for PI-Chan"""
+import asyncio
+import contextlib
+import os
+import tempfile
+import threading
+from pathlib import Path
+import pytomlpp as toml
+from translation_utils import tprint
+
+try:
+    import fcntl
+except ImportError: # Windows: launcher workers are still serialised per process only
+    fcntl = None
+
+@contextlib.contextmanager
+def _file_lock(lock_path: Path):
+    """Exclusive advisory lock shared by every process writing the same config file."""
+    if fcntl is None:
+        yield
+        return
+    with open(lock_path, 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+class ConfigStore:
+    """
+    Applies config changes in memory right away and writes them to disk later.
+
+    Changes made within `debounce` seconds of each other are coalesced into one
+    write, which runs off the event loop and replaces the file atomically
+    (write to a temp file, then rename). Keys not touched through the store are
+    re-read from disk before each write, so manual edits to other settings survive.
+    Failed writes are retried with a backoff.
+    """
+    def __init__(self, path: Path, data: dict, debounce: float = 2.0):
+        self.path = Path(path)
+        self.data = data
+        self.debounce = debounce
+        self._pending = {}
+        self._flush_task = None
+        self._write_lock = threading.Lock()
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def set(self, key, value):
+        """Update a key in memory and schedule it to be persisted."""
+        self.data[key] = value
+        self._pending[key] = value
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self):
+        delay = self.debounce
+        # Loop until nothing is left, so changes made during a write (or a failed write) aren't stranded
+        while True:
+            await asyncio.sleep(delay)
+            changes, self._pending = self._pending, {}
+            if not changes:
+                return
+            try:
+                await asyncio.to_thread(self._write, changes)
+                delay = self.debounce
+            except Exception as e:
+                tprint("error_persisting_config", path=self.path, error=e)
+                # Keep the changes around and retry, backing off up to a minute
+                self._pending = {**changes, **self._pending}
+                delay = min(max(delay, self.debounce, 1.0) * 2, 60.0)
+
+    def _write(self, changes: dict):
+        # The thread lock covers this process; the file lock covers launcher workers writing the same file
+        with self._write_lock, _file_lock(self.path.with_name(self.path.name + '.lock')):
+            current = toml.loads(self.path.read_text(encoding='utf-8')) if self.path.exists() else {}
+            current.update(changes)
+            fd, tmp_name = tempfile.mkstemp(dir=self.path.parent or '.', prefix=self.path.name + '.', suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    f.write(toml.dumps(current))
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_name, self.path)
+            except BaseException:
+                with contextlib.suppress(OSError):
+                    os.unlink(tmp_name)
+                raise
+
+    def flush_sync(self):
+        """Write any pending changes immediately (used on shutdown, outside the loop)."""
+        changes, self._pending = self._pending, {}
+        if changes:
+            try:
+                self._write(changes)
+            except Exception as e:
+                tprint("error_persisting_config", path=self.path, error=e)
@@ -0,0 +1,131 @@
+"""Records gateway events (messages, reactions) to JSONL for replaying with benchmarks/replay_events.py"""
+import asyncio
+import contextlib
+import json
+import time
+from pathlib import Path
+from translation_utils import tprint
+
+RECORDING_VERSION = 1
+
+class EventRecorder:
+    """
+    Appends the inputs of on_message / on_raw_reaction_add to a JSONL file, one event per
+    line, timestamped relative to the start of the recording. Attachment bytes are saved
+    next to it under attachments/ (up to `max_attachment_bytes` each) so a replay does not
+    need Discord's CDN; those downloads count against `budget` (a ByteBudget) like the
+    bot's own. Lines are written by a background task in a worker thread, never on the
+    event loop. Recording contains message text and images: only enable it on servers
+    where that is acceptable.
+    """
+    def __init__(self, path, record_attachments: bool = True, max_attachment_bytes: int = 32 * 1024**2, budget=None):
+        self.path = Path(path)
+        self.record_attachments = record_attachments
+        self.max_attachment_bytes = max_attachment_bytes
+        self.budget = budget
+        self.started = time.monotonic()
+        self.events = 0
+        self._file = None
+        self._lines = []
+        self._writer = None
+        self._tasks = set()
+
+    def _write(self, event: dict):
+        event["t"] = round(time.monotonic() - self.started, 4)
+        self._lines.append(json.dumps(event, ensure_ascii=False) + "\n")
+        self.events += 1
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.create_task(self._drain())
+
+    async def _drain(self):
+        while self._lines:
+            lines, self._lines = self._lines, []
+            try:
+                await asyncio.to_thread(self._append, lines)
+            except Exception as e:
+                tprint("error_recording_event", error=e)
+
+    def _append(self, lines):
+        if self._file is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            fresh = not self.path.exists() or self.path.stat().st_size == 0
+            self._file = open(self.path, "a", encoding="utf-8")
+            if fresh:
+                header = {"type": "header", "version": RECORDING_VERSION, "started": time.strftime("%Y-%m-%dT%H:%M:%S%z")}
+                self._file.write(json.dumps(header) + "\n")
+        self._file.writelines(lines)
+        self._file.flush()
+
+    def record_message(self, message):
+        try:
+            attachments = []
+            for attachment in message.attachments:
+                fixture = None
+                if self.record_attachments and attachment.size <= self.max_attachment_bytes:
+                    fixture = f"attachments/{attachment.id}{Path(attachment.filename).suffix.lower()}"
+                    self._spawn(self._save_attachment(attachment, self.path.parent / fixture))
+                attachments.append({
+                    "id": attachment.id, "filename": attachment.filename, "size": attachment.size,
+                    "url": attachment.url, "fixture": fixture,
+                })
+            reference = message.reference.message_id if message.reference else None
+            self._write({
+                "type": "message",
+                "id": message.id,
+                "channel_id": message.channel.id,
+                "guild_id": message.guild.id if message.guild else None,
+                "author": {"id": message.author.id, "bot": message.author.bot, "name": message.author.global_name or message.author.name},
+                "content": message.content,
+                "created_at": message.created_at.isoformat(),
+                "reference_id": reference,
+                "mentions": [user.id for user in message.mentions],
+                "attachments": attachments,
+            })
+        except Exception as e:
+            tprint("error_recording_event", error=e)
+
+    def record_reaction(self, payload):
+        try:
+            self._write({
+                "type": "reaction",
+                "message_id": payload.message_id,
+                "channel_id": payload.channel_id,
+                "guild_id": payload.guild_id,
+                "user_id": payload.user_id,
+                "member": {"id": payload.member.id, "bot": payload.member.bot} if payload.member else None,
+                "emoji": str(payload.emoji),
+            })
+        except Exception as e:
+            tprint("error_recording_event", error=e)
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _save_attachment(self, attachment, target: Path):
+        if target.exists():
+            return
+        try:
+            reservation = self.budget.reserve(attachment.size) if self.budget is not None else contextlib.nullcontext()
+            async with reservation:
+                data = await attachment.read()
+                await asyncio.to_thread(self._write_fixture, target, data)
+        except Exception as e:
+            tprint("error_recording_event", error=e)
+
+    @staticmethod
+    def _write_fixture(target: Path, data: bytes):
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp = target.with_suffix(target.suffix + ".part")
+        tmp.write_bytes(data)
+        tmp.replace(target)
+
+    def close(self):
+        """Flushes what is still queued and closes the file (blocking, for shutdown)."""
+        if self._lines:
+            lines, self._lines = self._lines, []
+            self._append(lines)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
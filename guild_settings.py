@@ -0,0 +1,128 @@
+"""Per-guild/per-channel settings storage for PI-Chan"""
+import asyncio
+import sqlite3
+import threading
+from dataclasses import dataclass, replace
+from pathlib import Path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS guild_settings (
+    guild_id INTEGER PRIMARY KEY,
+    scan_limit_bytes INTEGER,
+    metadata_emoji TEXT,
+    guess_emoji TEXT,
+    auto_react INTEGER,
+    chatbot_enabled INTEGER
+);
+CREATE TABLE IF NOT EXISTS channel_settings (
+    channel_id INTEGER PRIMARY KEY,
+    guild_id INTEGER,
+    monitored INTEGER NOT NULL DEFAULT 0,
+    chatbot INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS channel_settings_guild ON channel_settings (guild_id);
+"""
+
+GUILD_FIELDS = ('scan_limit_bytes', 'metadata_emoji', 'guess_emoji', 'auto_react', 'chatbot_enabled')
+CHANNEL_FLAGS = ('monitored', 'chatbot')
+
+@dataclass(frozen=True)
+class GuildSettings:
+    scan_limit_bytes: int
+    metadata_emoji: str
+    guess_emoji: str
+    auto_react: bool = True
+    chatbot_enabled: bool = True
+
+class GuildSettingsStore:
+    """
+    SQLite-backed settings with an in-memory cache in front of it.
+
+    Every guild row is loaded at startup, so lookups on the message path are a
+    dict hit; guilds without a row get the global defaults. NULL columns mean
+    "use the default". Writes update the cache first and hit the database on a
+    worker thread, one row at a time.
+    """
+    def __init__(self, path: Path, defaults: GuildSettings):
+        self.path = Path(path)
+        self.defaults = defaults
+        # Sharded deployments open the same file from several worker processes
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30)
+        self._lock = threading.Lock()
+        self._overrides = {}
+        self._cache = {}
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+            self._conn.commit()
+            for row in self._conn.execute(f"SELECT guild_id, {', '.join(GUILD_FIELDS)} FROM guild_settings"):
+                self._overrides[row[0]] = {k: v for k, v in zip(GUILD_FIELDS, row[1:]) if v is not None}
+
+    # --- Guild settings ---
+    def get(self, guild_id: int) -> GuildSettings:
+        """Resolved settings for a guild (O(1), never touches the database)."""
+        settings = self._cache.get(guild_id)
+        if settings is None:
+            overrides = self._overrides.get(guild_id, {})
+            settings = replace(self.defaults, **{k: (bool(v) if k in ('auto_react', 'chatbot_enabled') else v) for k, v in overrides.items()})
+            self._cache[guild_id] = settings
+        return settings
+
+    async def update(self, guild_id: int, **changes) -> GuildSettings:
+        """Set (or with None, reset to default) guild settings."""
+        for key in changes:
+            if key not in GUILD_FIELDS:
+                raise KeyError(f"Unknown guild setting: {key}")
+        overrides = dict(self._overrides.get(guild_id, {}))
+        for key, value in changes.items():
+            if value is None:
+                overrides.pop(key, None)
+            else:
+                overrides[key] = value
+        self._overrides[guild_id] = overrides
+        self._cache.pop(guild_id, None)
+        row = [overrides.get(k) for k in GUILD_FIELDS]
+        await asyncio.to_thread(self._execute,
+            f"INSERT OR REPLACE INTO guild_settings (guild_id, {', '.join(GUILD_FIELDS)}) VALUES (?{', ?' * len(GUILD_FIELDS)})",
+            (guild_id, *row))
+        return self.get(guild_id)
+
+    # --- Channel flags ---
+    def load_channel_sets(self):
+        """Returns (monitored, chatbot) channel id sets."""
+        monitored, chatbot = set(), set()
+        with self._lock:
+            for channel_id, is_monitored, is_chatbot in self._conn.execute("SELECT channel_id, monitored, chatbot FROM channel_settings"):
+                if is_monitored:
+                    monitored.add(channel_id)
+                if is_chatbot:
+                    chatbot.add(channel_id)
+        return monitored, chatbot
+
+    def has_channels(self) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM channel_settings LIMIT 1").fetchone() is not None
+
+    def import_channels(self, monitored, chatbot):
+        """One-off migration of the old config.toml lists (guild unknown, left NULL)."""
+        rows = [(cid, None, int(cid in monitored), int(cid in chatbot)) for cid in set(monitored) | set(chatbot)]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO channel_settings (channel_id, guild_id, monitored, chatbot) VALUES (?, ?, ?, ?)", rows)
+            self._conn.commit()
+
+    async def set_channel_flag(self, channel_id: int, guild_id: int, flag: str, value: bool):
+        if flag not in CHANNEL_FLAGS:
+            raise KeyError(f"Unknown channel flag: {flag}")
+        await asyncio.to_thread(self._execute,
+            f"INSERT INTO channel_settings (channel_id, guild_id, {flag}) VALUES (?, ?, ?) "
+            f"ON CONFLICT(channel_id) DO UPDATE SET {flag} = excluded.{flag}, guild_id = COALESCE(excluded.guild_id, guild_id)",
+            (channel_id, guild_id, int(value)))
+
+    def _execute(self, sql, params):
+        with self._lock:
+            self._conn.execute(sql, params)
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,146 @@
+"""
+Multi-process launcher for PI-Chan.
+
+Splits the bot's shards across several worker processes (each one an
+AutoShardedBot running its slice), so image decoding in busy guilds uses more
+than one core. Workers that exit unexpectedly are restarted with backoff.
+
+Usage:
+    python launcher.py [--processes 4] [--shards 8]
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+import pytomlpp as toml
+from translation_utils import init_translator, tprint
+
+CONFIG_PATH = Path('config.toml')
+IDENTIFY_INTERVAL = 5.5 # Discord allows one IDENTIFY per 5 seconds (per concurrency bucket)
+MAX_RESTART_DELAY = 300
+
+
+def recommended_shard_count(token: str) -> int:
+    """Asks Discord how many shards the bot should run."""
+    request = urllib.request.Request(
+        "https://discord.com/api/v10/gateway/bot",
+        headers={"Authorization": f"Bot {token}", "User-Agent": "DiscordBot (https://github.com/yoinked-h/PI-Chan, 1.0)"},
+    )
+    with urllib.request.urlopen(request, timeout=15) as response:
+        return json.load(response)["shards"]
+
+
+def split_shards(shard_count: int, processes: int) -> list:
+    """Contiguous slices, e.g. 8 shards over 3 processes -> [0,1,2], [3,4,5], [6,7]."""
+    processes = max(min(processes, shard_count), 1)
+    size, extra = divmod(shard_count, processes)
+    slices, start = [], 0
+    for index in range(processes):
+        end = start + size + (1 if index < extra else 0)
+        slices.append(list(range(start, end)))
+        start = end
+    return slices
+
+
+class Worker:
+    def __init__(self, index: int, shard_ids: list, shard_count: int):
+        self.index = index
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.process = None
+        self.restarts = 0
+        self.started = 0.0
+        self.restart_at = None
+
+    def start(self):
+        env = dict(os.environ)
+        env.update({
+            'PICHAN_WORKER': str(self.index),
+            'PICHAN_SHARD_IDS': ",".join(map(str, self.shard_ids)),
+            'PICHAN_SHARD_COUNT': str(self.shard_count),
+        })
+        self.process = subprocess.Popen([sys.executable, str(Path(__file__).with_name('PromptInspector.py'))], env=env)
+        self.started = time.monotonic()
+        self.restart_at = None
+        tprint("launcher_worker_started", worker=self.index, pid=self.process.pid, shards=self.shard_ids)
+
+    def poll(self):
+        """Schedules a restart with exponential backoff if the worker died."""
+        if self.process is None or self.restart_at is not None:
+            return
+        code = self.process.poll()
+        if code is None:
+            return
+        if time.monotonic() - self.started > MAX_RESTART_DELAY:
+            self.restarts = 0 # it ran fine for a while, start the backoff over
+        delay = min(IDENTIFY_INTERVAL * 2 ** self.restarts, MAX_RESTART_DELAY)
+        self.restarts += 1
+        self.restart_at = time.monotonic() + delay
+        tprint("launcher_worker_exited", worker=self.index, code=code, delay=f"{delay:.0f}")
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run PI-Chan's shards across several processes.")
+    parser.add_argument("--processes", type=int, help="worker processes (default: SHARD_PROCESSES or the CPU count)")
+    parser.add_argument("--shards", type=int, help="total shard count (default: SHARD_COUNT or Discord's recommendation)")
+    args = parser.parse_args()
+
+    config = toml.loads(CONFIG_PATH.read_text(encoding='utf-8')) if CONFIG_PATH.exists() else {}
+    init_translator(config.get('LANGUAGE', 'normal'))
+    shard_count = args.shards or config.get('SHARD_COUNT', 0)
+    if not shard_count:
+        try:
+            shard_count = recommended_shard_count(config.get('TOKEN', ''))
+        except Exception as e:
+            tprint("launcher_error_fetching_shard_count", error=e)
+            sys.exit(1)
+    processes = args.processes or config.get('SHARD_PROCESSES', 0) or os.cpu_count() or 1
+
+    workers = [Worker(index, shard_ids, shard_count) for index, shard_ids in enumerate(split_shards(shard_count, processes))]
+    tprint("launcher_starting", processes=len(workers), shard_count=shard_count)
+
+    stopping = False
+    def request_stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    # Stagger startup so the workers' IDENTIFYs don't all land at once
+    for worker in workers:
+        if stopping:
+            break
+        worker.start()
+        deadline = time.monotonic() + IDENTIFY_INTERVAL * len(worker.shard_ids)
+        while not stopping and time.monotonic() < deadline:
+            time.sleep(0.5)
+
+    while not stopping:
+        for worker in workers:
+            worker.poll()
+            if worker.restart_at is not None and time.monotonic() >= worker.restart_at:
+                worker.start()
+        time.sleep(1)
+
+    tprint("launcher_stopping")
+    for worker in workers:
+        worker.stop()
+    for worker in workers:
+        if worker.process is not None:
+            try:
+                worker.process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                worker.process.kill()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Event-loop lag watchdog and sampling profiler for PI-Chan"""
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from metrics import METRICS
+from translation_utils import tprint
+
+class LoopLagMonitor:
+    """
+    Measures how late the event loop wakes up and catches whatever is blocking it.
+
+    A coroutine on the loop updates a heartbeat every `interval` seconds and records
+    the lag. A watchdog thread checks the heartbeat; once it is older than
+    `threshold`, it grabs the loop thread's current stack (the code that is
+    blocking) and logs it, once per stall.
+    """
+    def __init__(self, interval: float = 0.1, threshold: float = 0.5):
+        self.interval = interval
+        self.threshold = threshold
+        self.max_lag = 0.0
+        self.stalls = 0
+        self.last_stall_stack = None
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id = None
+        self._task = None
+        self._watchdog = None
+        self._stopping = threading.Event()
+
+    def start(self):
+        if self._task is not None and not self._task.done():
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._task = asyncio.create_task(self._tick())
+        if self._watchdog is None:
+            self._watchdog = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+            self._watchdog.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _tick(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(now - expected, 0.0)
+            self._heartbeat = now
+            self.max_lag = max(self.max_lag, lag)
+            METRICS.observe("loop_lag", lag)
+
+    def _watch(self):
+        reported = False
+        while not self._stopping.wait(self.threshold / 4):
+            stalled_for = time.monotonic() - self._heartbeat - self.interval
+            if stalled_for < self.threshold:
+                reported = False
+                continue
+            if reported:
+                continue
+            reported = True
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            self.stalls += 1
+            self.last_stall_stack = "".join(traceback.format_stack(frame))
+            METRICS.inc("loop_stalls")
+            tprint("event_loop_stalled", seconds=f"{stalled_for:.2f}", stack=self.last_stall_stack)
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})"
+
+
+def sample_stacks(thread_id: int, seconds: float, interval: float = 0.005) -> Counter:
+    """Samples a thread's stack every `interval` seconds; returns collapsed stack -> sample count."""
+    stacks = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        if frame is not None:
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            stacks[";".join(reversed(labels))] += 1
+        time.sleep(interval)
+    return stacks
+
+
+async def profile_event_loop(seconds: float, interval: float = 0.005) -> str:
+    """
+    Profiles the event loop thread for `seconds` and returns collapsed stacks
+    ("frame;frame;frame count" per line), the input format of flamegraph.pl and speedscope.
+    """
+    loop_thread_id = threading.get_ident()
+    stacks = await asyncio.to_thread(sample_stacks, loop_thread_id, seconds, interval)
+    return "\n".join(f"{stack} {count}" for stack, count in stacks.most_common()) + "\n"
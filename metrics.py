@@ -0,0 +1,178 @@
+"""Pipeline metrics (histograms/counters) and a Prometheus exporter for PI-Chan"""
+import threading
+import time
+from bisect import bisect_left
+from translation_utils import tprint
+
+# Upper bounds in seconds; covers sub-millisecond parsing up to multi-minute predictions
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+STAGES = (
+    "download", "image_open", "info_read", "stealth_decode", "format_detect",
+    "comfy_parse", "embed_render", "discord_send", "gradio_predict", "llm_call", "llm_summary",
+)
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile by linear interpolation inside the matching bucket."""
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * ((rank - seen) / bucket_count)
+            seen += bucket_count
+        return self.buckets[-1]
+
+class Timer:
+    """Context manager returned by MetricsRegistry.timed; labels can be filled in inside the block."""
+    def __init__(self, registry, stage, labels):
+        self.registry = registry
+        self.stage = stage
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.elapsed = time.perf_counter() - self.started
+        if exc_type is not None:
+            self.labels.setdefault('outcome', 'error')
+        self.registry.observe(self.stage, self.elapsed, **self.labels)
+        return False
+
+class MetricsRegistry:
+    """
+    Holds stage latency histograms (keyed by stage + labels), counters and gauges.
+    Thread-safe, since some stages run in worker threads.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {} # name -> callable returning {labels_tuple: value}
+        self.started = time.time()
+
+    @staticmethod
+    def _key(name, labels):
+        return (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+
+    def timed(self, stage: str, **labels) -> Timer:
+        return Timer(self, stage, labels)
+
+    def observe(self, stage: str, seconds: float, **labels):
+        key = self._key(stage, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def counter_total(self, name: str, **labels) -> float:
+        """Sum of a counter over every label set that includes `labels`."""
+        wanted = set((k, str(v)) for k, v in labels.items())
+        with self._lock:
+            return sum(value for (counter, pairs), value in self.counters.items() if counter == name and wanted <= set(pairs))
+
+    def register_gauge(self, name: str, callback):
+        """callback() -> dict of {labels dict as tuple of pairs: value}, evaluated at export time."""
+        self.gauges[name] = callback
+
+    def stage_summary(self, stage: str, group_by: str = None) -> dict:
+        """Merged histogram for a stage, optionally split by one label (e.g. format)."""
+        merged = {}
+        with self._lock:
+            for (name, labels), histogram in self.histograms.items():
+                if name != stage:
+                    continue
+                group = dict(labels).get(group_by, '-') if group_by else stage
+                target = merged.get(group)
+                if target is None:
+                    target = merged[group] = Histogram(histogram.buckets)
+                target.counts = [a + b for a, b in zip(target.counts, histogram.counts)]
+                target.sum += histogram.sum
+                target.count += histogram.count
+        return merged
+
+    def render_prometheus(self) -> str:
+        """Prometheus text exposition format."""
+        def fmt_labels(pairs):
+            if not pairs:
+                return ""
+            escaped = (f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for k, v in pairs)
+            return "{" + ",".join(escaped) + "}"
+
+        lines = [
+            "# HELP pichan_stage_seconds Latency of each pipeline stage.",
+            "# TYPE pichan_stage_seconds histogram",
+        ]
+        with self._lock:
+            histograms = list(self.histograms.items())
+            counters = list(self.counters.items())
+        for (stage, labels), histogram in sorted(histograms):
+            base = (("stage", stage),) + labels
+            cumulative = 0
+            for bound, bucket_count in zip(histogram.buckets, histogram.counts):
+                cumulative += bucket_count
+                lines.append(f"pichan_stage_seconds_bucket{fmt_labels(base + (('le', repr(bound)),))} {cumulative}")
+            lines.append(f"pichan_stage_seconds_bucket{fmt_labels(base + (('le', '+Inf'),))} {histogram.count}")
+            lines.append(f"pichan_stage_seconds_sum{fmt_labels(base)} {histogram.sum}")
+            lines.append(f"pichan_stage_seconds_count{fmt_labels(base)} {histogram.count}")
+
+        seen_counter_names = set()
+        for (name, labels), value in sorted(counters):
+            if name not in seen_counter_names:
+                lines.append(f"# TYPE pichan_{name}_total counter")
+                seen_counter_names.add(name)
+            lines.append(f"pichan_{name}_total{fmt_labels(labels)} {value}")
+
+        for name, callback in self.gauges.items():
+            try:
+                values = callback()
+            except Exception:
+                continue
+            lines.append(f"# TYPE pichan_{name} gauge")
+            for labels, value in values.items():
+                lines.append(f"pichan_{name}{fmt_labels(labels)} {value}")
+
+        lines.append("# TYPE pichan_uptime_seconds gauge")
+        lines.append(f"pichan_uptime_seconds {time.time() - self.started}")
+        return "\n".join(lines) + "\n"
+
+    async def start_http_server(self, host: str, port: int):
+        """Serves /metrics with aiohttp (already installed with py-cord)."""
+        from aiohttp import web
+
+        async def handle_metrics(request):
+            return web.Response(text=self.render_prometheus(), content_type="text/plain", charset="utf-8")
+
+        app = web.Application()
+        app.router.add_get("/metrics", handle_metrics)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        tprint("metrics_endpoint_started", host=host, port=port)
+        return runner
+
+METRICS = MetricsRegistry()
@@ -0,0 +1,222 @@
+"""Outbound Discord request scheduling for PI-Chan"""
+import asyncio
+import heapq
+import itertools
+import logging
+
+import discord
+
+# Priority classes (lower runs first)
+PRIORITY_INTERACTIVE = 0 # Direct answers to a user action (metadata DMs, chatbot replies)
+PRIORITY_UPDATE = 1      # Edits of messages we already sent
+PRIORITY_BACKGROUND = 2  # Auto-reactions on monitored channels
+
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_UPDATE: "update",
+    PRIORITY_BACKGROUND: "background",
+}
+
+class _Job:
+    __slots__ = ('priority', 'factory', 'bucket', 'merge_key', 'deadline', 'futures', 'dispatched')
+
+    def __init__(self, priority, factory, bucket, merge_key, deadline, future):
+        self.priority = priority
+        self.factory = factory
+        self.bucket = bucket
+        self.merge_key = merge_key
+        self.deadline = deadline
+        self.futures = [future]
+        self.dispatched = False
+
+class _RateLimitLogCounter(logging.Handler):
+    """
+    Counts 429 responses. py-cord retries them internally and only reports them through
+    logging, once per response with this message (global limits add a second line).
+    """
+    def __init__(self, scheduler):
+        super().__init__(level=logging.WARNING)
+        self.scheduler = scheduler
+
+    def emit(self, record):
+        try:
+            if record.getMessage().startswith('We are being rate limited'):
+                self.scheduler.rate_limited += 1
+        except Exception:
+            pass
+
+class OutboundScheduler:
+    """
+    Central queue for messages, reactions and edits sent by the bot.
+
+    Jobs run highest priority first, at most one at a time per rate-limit bucket
+    (usually the target channel), with a global concurrency cap. Jobs sharing a
+    merge key are collapsed into the newest one, and jobs with a TTL are dropped
+    if they sit in the queue for too long.
+    """
+    def __init__(self, concurrency: int = 4):
+        self.concurrency = max(int(concurrency), 1)
+        self._heap = []
+        self._seq = itertools.count()
+        self._pending_by_merge_key = {}
+        self._busy_buckets = set()
+        self._blocked_until = {}
+        self._in_flight = 0
+        self._wakeup = None
+        self._dispatcher = None
+        self._tasks = set() # running sends, referenced so they aren't garbage-collected mid-flight
+        # Metrics
+        self.sent = 0
+        self.failed = 0
+        self.merged = 0
+        self.dropped_stale = 0
+        self.rate_limited = 0
+        logging.getLogger('discord.http').addHandler(_RateLimitLogCounter(self))
+
+    def _ensure_started(self):
+        if self._dispatcher is None or self._dispatcher.done():
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.create_task(self._dispatch_loop())
+
+    def submit(self, factory, priority: int = PRIORITY_INTERACTIVE, bucket=None, merge_key=None, ttl: float = None) -> asyncio.Future:
+        """
+        Queue factory() (a coroutine function) to be sent. Returns a future for its result.
+        A job dropped for being stale resolves to None.
+        """
+        self._ensure_started()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        if merge_key is not None and merge_key in self._pending_by_merge_key:
+            # Newer work supersedes the queued job; everyone waiting gets the newest result
+            job = self._pending_by_merge_key[merge_key]
+            job.factory = factory
+            job.futures.append(future)
+            if priority < job.priority:
+                job.priority = priority
+                heapq.heappush(self._heap, (job.priority, next(self._seq), job))
+            self.merged += 1
+            return future
+
+        deadline = loop.time() + ttl if ttl is not None else None
+        job = _Job(priority, factory, bucket, merge_key, deadline, future)
+        if merge_key is not None:
+            self._pending_by_merge_key[merge_key] = job
+        heapq.heappush(self._heap, (priority, next(self._seq), job))
+        self._wakeup.set()
+        return future
+
+    def wrap(self, send_func, priority: int = PRIORITY_INTERACTIVE, bucket=None):
+        """Returns a drop-in replacement for send_func that goes through the scheduler."""
+        async def scheduled(*args, **kwargs):
+            return await self.submit(lambda: send_func(*args, **kwargs), priority=priority, bucket=bucket)
+        return scheduled
+
+    def _next_ready(self, now):
+        """Pops the best runnable job, or returns (None, seconds until a blocked bucket frees)."""
+        skipped = []
+        seen = set()
+        found = None
+        wait = None
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            job = entry[2]
+            if job.dispatched or id(job) in seen or all(f.done() for f in job.futures):
+                continue # Already handled, duplicate entry from a priority bump, or nobody waiting
+            seen.add(id(job))
+            if job.deadline is not None and now > job.deadline:
+                job.dispatched = True
+                self._finish(job, result=None)
+                self.dropped_stale += 1
+                continue
+            if job.bucket in self._busy_buckets:
+                skipped.append(entry)
+                continue
+            blocked = self._blocked_until.get(job.bucket, 0) - now
+            if blocked > 0:
+                wait = blocked if wait is None else min(wait, blocked)
+                skipped.append(entry)
+                continue
+            found = job
+            break
+        for entry in skipped:
+            heapq.heappush(self._heap, entry)
+        return found, wait
+
+    def _finish(self, job, result=None, error=None):
+        if job.merge_key is not None and self._pending_by_merge_key.get(job.merge_key) is job:
+            del self._pending_by_merge_key[job.merge_key]
+        for future in job.futures:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    async def _dispatch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._wakeup.clear()
+            job = None
+            wait = None
+            if self._in_flight < self.concurrency:
+                job, wait = self._next_ready(loop.time())
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            job.dispatched = True
+            # Taken off the queue: later submits with this merge key start a new job
+            if job.merge_key is not None and self._pending_by_merge_key.get(job.merge_key) is job:
+                del self._pending_by_merge_key[job.merge_key]
+            self._in_flight += 1
+            if job.bucket is not None:
+                self._busy_buckets.add(job.bucket)
+            task = asyncio.create_task(self._run(job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, job):
+        try:
+            result = await job.factory()
+            self.sent += 1
+            self._finish(job, result=result)
+        except discord.HTTPException as e:
+            self.failed += 1
+            if e.status == 429: # already counted by _RateLimitLogCounter
+                retry_after = 1.0
+                try:
+                    retry_after = float(e.response.headers.get('Retry-After', retry_after))
+                except Exception:
+                    pass
+                self._blocked_until[job.bucket] = asyncio.get_running_loop().time() + retry_after
+            self._finish(job, error=e)
+        except Exception as e:
+            self.failed += 1
+            self._finish(job, error=e)
+        finally:
+            self._in_flight -= 1
+            self._busy_buckets.discard(job.bucket)
+            self._wakeup.set()
+
+    def stats(self) -> dict:
+        """Queue depth per priority class plus send/429 counters."""
+        depth = {name: 0 for name in PRIORITY_NAMES.values()}
+        counted = set()
+        for priority, _seq, job in self._heap:
+            if job.dispatched or id(job) in counted or all(f.done() for f in job.futures):
+                continue
+            counted.add(id(job))
+            depth[PRIORITY_NAMES.get(job.priority, str(job.priority))] += 1
+        return {
+            'queued': depth,
+            'in_flight': self._in_flight,
+            'sent': self.sent,
+            'failed': self.failed,
+            'merged': self.merged,
+            'dropped_stale': self.dropped_stale,
+            'rate_limited': self.rate_limited,
+        }
@@ -0,0 +1,75 @@
+"""Durable storage of raw generation parameters for the Full Parameters button"""
+import asyncio
+import sqlite3
+import threading
+import time
+import zlib
+from pathlib import Path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS full_parameters (
+    attachment_id INTEGER PRIMARY KEY,
+    created REAL NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS full_parameters_created ON full_parameters (created);
+"""
+
+class ParameterStore:
+    """
+    Raw metadata strings keyed by attachment id, so a Full Parameters button can be
+    answered without the original message (after restarts, in channels the bot can't
+    read). Lives in the settings database; rows are zlib-compressed and the table is
+    bounded by `max_rows` and `max_age` seconds, pruned every `prune_every` writes.
+    """
+    def __init__(self, path: Path, max_rows: int = 100_000, max_age: float = 30 * 86400, prune_every: int = 256):
+        self.path = Path(path)
+        self.max_rows = max(int(max_rows), 1)
+        self.max_age = max_age
+        self.prune_every = max(int(prune_every), 1)
+        self._writes = 0
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+            self._conn.commit()
+
+    async def get(self, attachment_id: int):
+        """The stored string, or None if it was never stored or has been pruned."""
+        return await asyncio.to_thread(self._get, attachment_id)
+
+    async def put(self, attachment_id: int, metadata: str):
+        await asyncio.to_thread(self._put, attachment_id, metadata)
+
+    def _get(self, attachment_id: int):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM full_parameters WHERE attachment_id = ? AND created >= ?",
+                (attachment_id, time.time() - self.max_age)
+            ).fetchone()
+        return zlib.decompress(row[0]).decode('utf-8') if row else None
+
+    def _put(self, attachment_id: int, metadata: str):
+        data = zlib.compress(metadata.encode('utf-8'))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO full_parameters (attachment_id, created, data) VALUES (?, ?, ?)",
+                (attachment_id, time.time(), data)
+            )
+            self._writes += 1
+            if self._writes % self.prune_every == 0:
+                self._prune()
+            self._conn.commit()
+
+    def _prune(self):
+        self._conn.execute("DELETE FROM full_parameters WHERE created < ?", (time.time() - self.max_age,))
+        cutoff = self._conn.execute(
+            "SELECT created FROM full_parameters ORDER BY created DESC LIMIT 1 OFFSET ?", (self.max_rows,)
+        ).fetchone()
+        if cutoff is not None:
+            self._conn.execute("DELETE FROM full_parameters WHERE created <= ?", cutoff)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
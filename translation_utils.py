@@ -61,6 +61,13 @@ def t(key: str, **kwargs) -> str:
     """Shorthand function to get translated text"""
     return get_translator().get(key, **kwargs)
 
+PRINTED = {} # key -> times printed; error keys are exported as the logged_errors gauge
+
 def tprint(key: str, **kwargs):
     """Shorthand function to print translated text"""
+    PRINTED[key] = PRINTED.get(key, 0) + 1
     get_translator().print(key, **kwargs)
+
+def error_counts() -> dict:
+    """How often each error/failure message has been printed, since most errors are handled and only logged."""
+    return {key: count for key, count in PRINTED.items() if 'error' in key or 'fatal' in key or 'failed' in key}